@@ -39,14 +39,22 @@ localhost
 ...     i.save() # doctest: +SKIP
 """
 
+import contextlib
+import cPickle
+import cStringIO
+import marshal
 import os
 import re
+import stat
 import subprocess
+import tempfile
 import time
 import getpass
 
 from pynag.Model import macros
 from pynag.Model import all_attributes
+from pynag.Parsers.object_cache import ObjectCache
+from pynag.Utils import instrumentation
 from pynag.Utils import paths
 
 import pynag.Control.Command
@@ -62,6 +70,28 @@ cfg_file = None  # '/etc/nagios/nagios.cfg'
 # Were new objects are written by default
 pynag_directory = None
 
+# If set, parsed configuration files are cached in this directory between processes
+cache_dir = None
+
+# If True, parsed objects are kept in memory in a compact form (see pynag.Parsers.compact)
+compact = False
+
+# If True, changes to configuration files are noticed without looking at every file (see pynag.Parsers.watcher)
+watch = False
+
+# If set, a snapshot of the object cache is kept in this file (see save_snapshot()). New
+# processes load their cache from it, as long as no configuration file has changed since.
+# Part of the snapshot is a pickle, so only point this at a file nobody else can write to.
+snapshot_file = None
+
+# Where objects are read from, one of the keys of config_sources. 'object_cache' reads
+# the objects.cache file that nagios writes on startup, which is fast but read-only.
+source = 'config'
+config_sources = {
+    'config': pynag.Parsers.config_parser.Config,
+    'object_cache': ObjectCache,
+}
+
 # This is the config parser that we use internally, if cfg_file is changed, then config
 # will be recreated whenever a parse is called.
 config = pynag.Parsers.config_parser.Config(cfg_file=cfg_file)
@@ -75,6 +105,201 @@ config = pynag.Parsers.config_parser.Config(cfg_file=cfg_file)
 # file whenever something has been written.
 eventhandlers = []
 
+# Save events of objects saved inside batch(), they are passed on to
+# eventhandlers when the batch has been written to disk
+_deferred_save_events = None
+
+
+@contextlib.contextmanager
+def batch():
+    """ Context manager that writes every change made inside it at the end, one write per file
+
+    Inside a batch, ObjectDefinition.save() and delete() keep changes in
+    memory, and every changed file is written once when the batch ends.
+    If an exception is raised inside the batch, no changes are written.
+    See pynag.Parsers.config_parser.Config.transaction() for details.
+
+    Example:
+
+    >>> with batch():  # doctest: +SKIP
+    ...     for host in Host.objects.all:
+    ...         host.notes = "Managed by pynag"
+    ...         host.save()
+    """
+    global _deferred_save_events
+    my_config = config
+    outermost = _deferred_save_events is None
+    if outermost:
+        _deferred_save_events = []
+    try:
+        with my_config.transaction():
+            yield
+        events = _deferred_save_events
+    finally:
+        if outermost:
+            _deferred_save_events = None
+    if outermost:
+        for object_definition, message in events:
+            object_definition._event(level='save', message=message)
+
+
+@pynag.Utils.synchronized(pynag.Utils.rlock)
+@instrumentation.instrumented('Model.save_snapshot')
+def save_snapshot(path):
+    """ Writes the object cache, and the parsed configuration it was made from, to path
+
+    A new process can call load_snapshot() to start with the cache as it
+    is now, instead of parsing the configuration and making every object
+    again. Unsaved changes to objects are not included. Set snapshot_file
+    to have this done automatically.
+
+    Args:
+
+        path (str): File to write the snapshot to. It is replaced at once,
+        so processes that load it at the same time see either the old or
+        the new snapshot.
+    """
+    fetcher = ObjectDefinition.objects
+    if fetcher.needs_reload():
+        fetcher.reload_cache()
+    my_config = ObjectFetcher._cached_config
+
+    items = []
+    for objects in my_config.data.values():
+        items.extend(objects)
+    item_numbers = dict((id(item), number) for number, item in enumerate(items))
+    definitions = []
+    for item, i, shortname, name, relations in ObjectFetcher._cached_definitions.values():
+        definitions.append((item_numbers[id(item)], i.get_id(), shortname, name, relations))
+    object_relations = {}
+    for k, v in ObjectRelations.__dict__.items():
+        if isinstance(v, defaultdict):
+            object_relations[k] = dict((key, dict(value) if isinstance(value, defaultdict) else value)
+                                       for key, value in v.items())
+
+    # Items are plain data, which marshal handles a lot faster than pickle.
+    # Everything else in the configuration refers to them by number.
+    persistent_ids = {}
+    if all(type(item) is dict for item in items):
+        for number, item in enumerate(items):
+            persistent_ids[id(item)] = number
+            meta = item['meta']
+            persistent_ids[id(meta)] = (number, 'meta')
+            for k, v in meta.items():
+                if isinstance(v, (dict, list)):
+                    persistent_ids[id(v)] = (number, 'meta', k)
+        marshalled_items, pickled_items = items, None
+    else:
+        # Compact items are pickled along with the configuration they refer to
+        marshalled_items, pickled_items = None, items
+    stream = cStringIO.StringIO()
+    pickler = cPickle.Pickler(stream, 2)
+    pickler.persistent_id = lambda obj: persistent_ids.get(id(obj))
+    pickler.dump((my_config, pickled_items))
+
+    snapshot_key = (pynag.__version__, type(my_config).__name__, my_config.cfg_file)
+    snapshot = (snapshot_key, marshalled_items, stream.getvalue(), definitions, object_relations)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        try:
+            os.write(fd, marshal.dumps(snapshot))
+        finally:
+            os.close(fd)
+        os.rename(tmp_filename, path)
+    except:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+@pynag.Utils.synchronized(pynag.Utils.rlock)
+@instrumentation.instrumented('Model.load_snapshot')
+def load_snapshot(path):
+    """ Fills the object cache from a snapshot written by save_snapshot()
+
+    The snapshot is only used if it was made from the same cfg_file and
+    source as we have now, by the same version of pynag, and if no
+    configuration file has changed since it was made.
+
+    Loading a snapshot unpickles part of it, which can run any code. So the
+    snapshot is not used unless it is owned by the user we run as, and
+    neither its group nor others can write to it.
+
+    Args:
+
+        path (str): File that save_snapshot() wrote to
+
+    Returns:
+
+        True if the cache was loaded. False if the snapshot could not be
+        used, in which case the cache is left as it was.
+    """
+    global config
+    try:
+        fh = open(path, 'rb')
+        try:
+            file_stat = os.fstat(fh.fileno())
+            if file_stat.st_uid != os.getuid() or file_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                return False
+            snapshot = marshal.load(fh)
+        finally:
+            fh.close()
+        snapshot_key, items, pickled_config, definitions, object_relations = snapshot
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return False
+    config_class = config_sources[source]
+    if snapshot_key != (pynag.__version__, config_class.__name__, cfg_file):
+        return False
+
+    def persistent_load(persistent_id):
+        if type(persistent_id) is int:
+            return items[persistent_id]
+        result = items[persistent_id[0]]
+        for key in persistent_id[1:]:
+            result = result[key]
+        return result
+
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(pickled_config))
+    unpickler.persistent_load = persistent_load
+    try:
+        new_config, pickled_items = unpickler.load()
+    except (cPickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError, ImportError):
+        return False
+    if type(new_config) is not config_class:
+        return False
+    if pickled_items is not None:
+        items = pickled_items
+
+    # Same as in Config.parse(), start watching the files before looking at them
+    new_config.cache_dir = cache_dir
+    new_config.watch = watch
+    if new_config.watch:
+        new_config._start_watcher()
+    if new_config.get_timestamps() != new_config.timestamps:
+        if new_config._watcher is not None:
+            new_config._watcher.close()
+        return False
+    config = new_config
+
+    ObjectFetcher._clear_cache()
+    cached_definitions = ObjectFetcher._cached_definitions
+    for number, object_id, shortname, name, relations in definitions:
+        item = items[number]
+        i = string_to_class.get(item['meta']['object_type'], ObjectDefinition)(item=item)
+        i.__object_id__ = object_id
+        cached_definitions[id(item)] = (item, i, shortname, name, relations)
+    for k, v in object_relations.items():
+        dictionary = getattr(ObjectRelations, k)
+        for key, value in v.items():
+            if isinstance(value, dict):
+                dictionary[key].update(value)
+            else:
+                dictionary[key] = value
+    ObjectDefinition.objects._index_definitions(add_relations=False)
+    ObjectFetcher._cached_config = config
+    return True
+
 try:
     from collections import defaultdict
 except ImportError:
@@ -215,6 +440,7 @@ class ObjectRelations(object):
         return checked_groups
 
     @staticmethod
+    @instrumentation.instrumented('ObjectRelations.resolve_regex')
     def resolve_regex():
         """ If any object relations are a regular expression, then expand them into a full list """
         self = ObjectRelations
@@ -295,6 +521,7 @@ class ObjectRelations(object):
                 #dictionary[key] = new_value
 
     @staticmethod
+    @instrumentation.instrumented('ObjectRelations.resolve_contactgroups')
     def resolve_contactgroups():
         """ Update all contactgroup relations to take into account contactgroup.contactgroup_members """
         groups = ObjectRelations.contactgroup_contactgroups.keys()
@@ -309,6 +536,7 @@ class ObjectRelations(object):
                 ObjectRelations.contactgroup_contacts[group].update(ObjectRelations.contactgroup_contacts[subgroup])
 
     @staticmethod
+    @instrumentation.instrumented('ObjectRelations.resolve_hostgroups')
     def resolve_hostgroups():
         """ Update all hostgroup relations to take into account hostgroup.hostgroup_members """
         groups = ObjectRelations.hostgroup_hostgroups.keys()
@@ -323,6 +551,7 @@ class ObjectRelations(object):
                 ObjectRelations.hostgroup_hosts[group].update(ObjectRelations.hostgroup_hosts[subgroup])
 
     @staticmethod
+    @instrumentation.instrumented('ObjectRelations.resolve_servicegroups')
     def resolve_servicegroups():
         """ Update all servicegroup relations to take into account servicegroup.servicegroup_members """
 
@@ -363,6 +592,42 @@ class ObjectRelations(object):
                     pass
 
 
+class _RelationRecorder(object):
+
+    """ Stands in for ObjectRelations in _do_relations(), and records what is added to it
+
+    Every relation added with recorder.<name>[key].add(value) (or
+    recorder.use[key1][key2].add(value)) is appended to self.log as
+    (name, keys, value)
+    """
+
+    def __init__(self):
+        self.log = []
+
+    def __getattr__(self, name):
+        return _RelationKeys(self.log, name, ())
+
+
+class _RelationKeys(object):
+
+    """ One of the dicts in ObjectRelations, as seen through a _RelationRecorder """
+
+    def __init__(self, log, name, keys):
+        self.log = log
+        self.name = name
+        self.keys = keys
+
+    def __getitem__(self, key):
+        return _RelationKeys(self.log, self.name, self.keys + (key,))
+
+    def add(self, value):
+        self.log.append((self.name, self.keys, value))
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+
 class ObjectFetcher(object):
 
     """
@@ -376,12 +641,23 @@ class ObjectFetcher(object):
      * _cached_shortnames[o.object_type][o.get_shortname()] = o
      * _cached_names[o.object_type][o.name] = o
      * _cached_object_type[o.object_type].append( o )
+     * _cached_definitions[id(item)] = (item, o, shortname, name, relations)
+       where relations is a list of what o._do_relations() added to ObjectRelations
+     * _cached_indexes[(object_type, attribute_name, 'exact' or 'has_field')][value] = [o, ...]
+       made by filter() when needed, see get_index()
     """
+
+    # Attributes that filter() looks up in an index, instead of looking at every object
+    indexed_attributes = ('host_name', 'hostgroup_name', 'use', 'name', 'service_description', 'members')
+
     _cached_objects = []
     _cached_ids = {}
     _cached_shortnames = defaultdict(dict)
     _cached_names = defaultdict(dict)
     _cached_object_type = defaultdict(list)
+    _cached_definitions = {}
+    _cached_config = None
+    _cached_indexes = {}
     _cache_only = False
 
     def __init__(self, object_type):
@@ -400,43 +676,159 @@ class ObjectFetcher(object):
     all = property(get_all)
 
     @pynag.Utils.synchronized(pynag.Utils.rlock)
+    @instrumentation.instrumented('ObjectFetcher.reload_cache')
     def reload_cache(self):
-        """Reload configuration cache"""
-        # clear object list
+        """Reload configuration cache
+
+        Only configuration files that have changed since last time are
+        parsed again (see pynag.Parsers.config_parser.Config.parse()). Items
+        in other files are the same as before, and so are the
+        ObjectDefinitions made from them, unless they have unsaved changes.
+        ObjectRelations are rebuilt from what every ObjectDefinition added to
+        them the first time, so _do_relations() only runs for new objects.
+
+        This is not an incremental update: the cache and ObjectRelations are
+        still emptied and filled again with every object, and the resolve_*
+        passes of ObjectRelations run over all of them.
+        """
+        global config
+        # A new process can skip everything below if nothing has changed since the snapshot was made
+        first_load = ObjectFetcher._cached_config is None
+        if snapshot_file and first_load and load_snapshot(snapshot_file):
+            return True
+
+        # If global variable cfg_file or source has been changed, lets create a new ConfigParser object
+        config_class = config_sources[source]
+        if config is None or config.cfg_file != cfg_file or type(config) is not config_class:
+            config = config_class(cfg_file, cache_dir=cache_dir, compact=compact, watch=watch)
+        elif cache_dir and config.cache_dir != cache_dir:
+            # cache_dir was set after config was made
+            config.cache_dir = cache_dir
+        if config.needs_reparse():
+            config.parse()
+
+        if ObjectFetcher._cached_config is config:
+            previous_definitions = ObjectFetcher._cached_definitions
+        else:
+            previous_definitions = {}
+
+        self._clear_cache()
+
+        self._load_definitions(previous_definitions)
+        ObjectFetcher._cached_config = config
+
+        ObjectRelations.resolve_contactgroups()
+        ObjectRelations.resolve_hostgroups()
+        ObjectRelations.resolve_servicegroups()
+        ObjectRelations.resolve_regex()
+        instrumentation.count('ObjectFetcher.reload_cache', objects=len(ObjectFetcher._cached_objects))
+
+        # Let the next process start from here, see load_snapshot()
+        if snapshot_file and first_load:
+            try:
+                save_snapshot(snapshot_file)
+            except (IOError, OSError, ValueError, TypeError, cPickle.PicklingError):
+                pass
+        return True
+
+    @staticmethod
+    def _clear_cache():
+        """ Forget every object in the cache, and how they are related to each other """
         ObjectFetcher._cached_objects = []
         ObjectFetcher._cached_ids = {}
         ObjectFetcher._cached_shortnames = defaultdict(dict)
         ObjectFetcher._cached_names = defaultdict(dict)
         ObjectFetcher._cached_object_type = defaultdict(list)
-        global config
-        # If global variable cfg_file has been changed, lets create a new ConfigParser object
-        if config is None or config.cfg_file != cfg_file:
-            config = pynag.Parsers.config_parser.Config(cfg_file)
-        if config.needs_reparse():
-            config.parse()
+        ObjectFetcher._cached_definitions = {}
+        ObjectFetcher._cached_config = None
+        ObjectFetcher._cached_indexes = {}
 
         # Reset our list of how objects are related to each other
         ObjectRelations.reset()
 
-        # Fetch all objects from config_parser.config
+    def _load_definitions(self, previous_definitions):
+        """ Fills the cache with an ObjectDefinition for every item in config.data
+
+        Args:
+
+            previous_definitions: ObjectFetcher._cached_definitions of the
+            previous reload_cache(). ObjectDefinitions in there are reused
+            if their item is still in config.data.
+        """
+        definitions = ObjectFetcher._cached_definitions
+        new_objects = []
         for object_type, objects in config.data.items():
             # change "all_host" to just "host"
             object_type = object_type[len("all_"):]
             Class = string_to_class.get(object_type, ObjectDefinition)
-            for i in objects:
-                i = Class(item=i)
-                ObjectFetcher._cached_objects.append(i)
-                ObjectFetcher._cached_object_type[object_type].append(i)
-                ObjectFetcher._cached_ids[i.get_id()] = i
-                ObjectFetcher._cached_shortnames[i.object_type][i.get_shortname()] = i
-                if i.name is not None:
-                    ObjectFetcher._cached_names[i.object_type][i.name] = i
-                i._do_relations()
-        ObjectRelations.resolve_contactgroups()
-        ObjectRelations.resolve_hostgroups()
-        ObjectRelations.resolve_servicegroups()
-        ObjectRelations.resolve_regex()
-        return True
+            for item in objects:
+                entry = previous_definitions.get(id(item))
+                # Objects with unsaved changes are not the same as their item anymore
+                if entry is None or entry[1]._changes or entry[1]._filename_has_changed:
+                    new_objects.append((item, Class(item=item)))
+                else:
+                    definitions[id(item)] = entry
+
+        # Find out what the new ones add to ObjectRelations
+        new_relations = self._get_relations([i for item, i in new_objects])
+        for (item, i), relations in zip(new_objects, new_relations):
+            definitions[id(item)] = (item, i, i.get_shortname(), i.name, relations)
+
+        self._index_definitions()
+
+    def _index_definitions(self, add_relations=True):
+        """ Fills object lists and lookup dicts from ObjectFetcher._cached_definitions
+
+        Objects are added in the same order as their items are in config.data.
+
+        Args:
+
+            add_relations (bool): If True, add what every object recorded in
+            _cached_definitions to ObjectRelations.
+        """
+        definitions = ObjectFetcher._cached_definitions
+        cached_objects = ObjectFetcher._cached_objects
+        cached_object_type = ObjectFetcher._cached_object_type
+        cached_ids = ObjectFetcher._cached_ids
+        cached_shortnames = ObjectFetcher._cached_shortnames
+        cached_names = ObjectFetcher._cached_names
+        relation_dicts = {}
+        for object_type, objects in config.data.items():
+            object_type = object_type[len("all_"):]
+            object_type_list = cached_object_type[object_type]
+            shortnames = cached_shortnames[object_type]
+            names = cached_names[object_type]
+            for item in objects:
+                item, i, shortname, name, relations = definitions[id(item)]
+                cached_objects.append(i)
+                object_type_list.append(i)
+                cached_ids[i.get_id()] = i
+                shortnames[shortname] = i
+                if name is not None:
+                    names[name] = i
+                if not add_relations:
+                    continue
+                for relation_name, keys, value in relations:
+                    dictionary = relation_dicts.get(relation_name)
+                    if dictionary is None:
+                        dictionary = relation_dicts[relation_name] = getattr(ObjectRelations, relation_name)
+                    for key in keys[:-1]:
+                        dictionary = dictionary[key]
+                    dictionary[keys[-1]].add(value)
+
+    def _get_relations(self, objects):
+        """ Returns a list of what _do_relations() of each of objects adds to ObjectRelations
+
+        Every relation is a tuple of (name of the dict in ObjectRelations, keys, value).
+        ObjectRelations itself is left untouched, see _RelationRecorder.
+        """
+        result = []
+        recorder = _RelationRecorder()
+        for i in objects:
+            i._do_relations(recorder)
+            result.append(recorder.log[:])
+            del recorder.log[:]
+        return result
 
     @pynag.Utils.synchronized(pynag.Utils.rlock)
     def needs_reload(self):
@@ -445,6 +837,8 @@ class ObjectFetcher(object):
             return True
         if config is None:
             return True
+        if type(config) is not config_sources[source]:
+            return True
         if self._cache_only:
             return False
 
@@ -527,8 +921,213 @@ class ObjectFetcher(object):
         Get all hosts that have an address:
          >>> Host.objects.filter(address_exists=True) # doctest: +SKIP
 
+        Exact matches and __has_field on any of indexed_attributes are looked
+        up in an index (see get_index()), the rest of the search arguments
+        are only checked against objects found there.
+
+        Returns:
+
+            A QuerySet, which is a list of the objects that can be narrowed
+            down further, ordered, counted and sliced:
+             >>> services = Service.objects.filter(host_name__startswith='www') # doctest: +SKIP
+             >>> services.exclude(register='0').order_by('host_name')[0:50] # doctest: +SKIP
+        """
+        objects = self._get_candidates([kwargs])
+        if kwargs:
+            objects = pynag.Utils.grep(objects, **kwargs)
+        return QuerySet(objects)
+
+    def _get_candidates(self, searches):
+        """ Returns the fewest objects that can match every one of searches
+
+        Args:
+
+            searches (list): List of dicts with search arguments, like filter() takes
+
+        Returns:
+
+            List of objects from an index of one of the search arguments, or
+            self.all if none of them are indexed.
+        """
+        objects = self.all
+        candidates = None
+        for kwargs in searches:
+            for k, v in kwargs.items():
+                if k.endswith('__has_field'):
+                    attribute_name = k[:-len('__has_field')]
+                    kind = 'has_field'
+                else:
+                    attribute_name = k
+                    kind = 'exact'
+                if attribute_name not in self.indexed_attributes:
+                    continue
+                index = self.get_index(attribute_name, kind)
+                if index is None:
+                    continue
+                # A list means the objects must match every value in it, same as in grep()
+                if not isinstance(v, list):
+                    v = [v]
+                for i in v:
+                    matches = index.get(str(i), [])
+                    if candidates is None or len(matches) < len(candidates):
+                        candidates = matches
+        if candidates is not None:
+            objects = candidates
+        return objects
+
+    @pynag.Utils.synchronized(pynag.Utils.rlock)
+    def get_index(self, attribute_name, kind='exact'):
+        """ Returns objects of this type grouped by the value of one of their attributes
+
+        The index is made the first time it is needed, and is thrown away
+        when the cache is reloaded or when any object gets a new value for
+        attribute_name.
+
+        Args:
+
+            attribute_name (str): Name of the attribute, i.e. 'host_name'
+
+            kind (str): 'exact' to group objects by str() of their value, the
+            same way as filter(attribute_name=value) compares them. Or
+            'has_field' to group objects by every field in a comma
+            seperated value, like filter(attribute_name__has_field=value).
+
+        Returns:
+
+            dict of value -> list of objects, in the same order as in
+            self.all. None if objects cannot be grouped by attribute_name,
+            because some of them have a list as value.
+        """
+        objects = self.all
+        index_key = (self.object_type, attribute_name, kind)
+        if index_key in ObjectFetcher._cached_indexes:
+            return ObjectFetcher._cached_indexes[index_key]
+        index = {}
+        for i in objects:
+            value = i.get(attribute_name)
+            if isinstance(value, list):
+                index = None
+                break
+            if kind == 'has_field':
+                keys = AttributeList(value).fields
+                if len(keys) > 1:
+                    keys = sorted(set(keys), key=keys.index)
+            else:
+                keys = [str(value)]
+            for key in keys:
+                if key in index:
+                    index[key].append(i)
+                else:
+                    index[key] = [i]
+        ObjectFetcher._cached_indexes[index_key] = index
+        return index
+
+    @staticmethod
+    def _forget_indexes(attribute_name):
+        """ Throw away every index of attribute_name, because an object has a new value for it """
+        for index_key in ObjectFetcher._cached_indexes.keys():
+            if index_key[1] == attribute_name:
+                del ObjectFetcher._cached_indexes[index_key]
+
+
+class QuerySet(list):
+
+    """
+    A list of objects of one type that match a search, that can be narrowed down further
+
+    ObjectFetcher.filter() returns a QuerySet. It is a list of the objects
+    that were found, so it can be used anywhere a list can. Narrowing it down,
+    ordering, counting or slicing it only looks at the objects in it, not at
+    every object in the configuration.
+
+    Example:
+     >>> services = Service.objects.filter(host_name__startswith='www') # doctest: +SKIP
+     >>> services = services.exclude(service_description='Ping') # doctest: +SKIP
+     >>> services.count() # doctest: +SKIP
+     >>> services.order_by('host_name', '-service_description')[50:100] # doctest: +SKIP
+     >>> services.values('host_name', 'service_description') # doctest: +SKIP
+
+    Like any other list, it does not change when the configuration does.
+    """
+
+    def filter(self, **kwargs):
+        """ Returns a new QuerySet, of objects that also match kwargs
+
+        See ObjectFetcher.filter() for the search arguments.
+        """
+        if not kwargs:
+            return QuerySet(self)
+        return QuerySet(pynag.Utils.grep(self, **kwargs))
+
+    def exclude(self, **kwargs):
+        """ Returns a new QuerySet, without objects that match every argument in kwargs
+
+        Example:
+         >>> Host.objects.filter().exclude(register='0', use='generic-host') # doctest: +SKIP
+        """
+        if not kwargs:
+            return QuerySet(self)
+        excluded = set(map(id, pynag.Utils.grep(self, **kwargs)))
+        return QuerySet([i for i in self if id(i) not in excluded])
+
+    def order_by(self, *fields):
+        """ Returns a new QuerySet, ordered by the value of fields
+
+        Args:
+
+            fields (str): Attribute names. Put '-' in front of a name to sort
+            in descending order, i.e. order_by('host_name', '-address')
+        """
+        objects = list(self)
+        for field in reversed(fields):
+            name = field.lstrip('-')
+            objects.sort(key=lambda x: x.get(name), reverse=field.startswith('-'))
+        return QuerySet(objects)
+
+    def values(self, *fields):
+        """ Returns a new QuerySet, of dicts with fields of every object instead of the objects
+
+        Args:
+
+            fields (str): Attribute names. If none are given, every attribute
+            defined in the object itself is included.
+        """
+        if fields:
+            values = [dict((field, i.get(field)) for field in fields) for i in self]
+        else:
+            values = []
+            for i in self:
+                attributes = i._defined_attributes.copy()
+                attributes.update(i._changes)
+                values.append(attributes)
+        return QuerySet(values)
+
+    def count(self, *args):
+        """ Returns the number of objects
+
+        count(item) works like list.count(item).
         """
-        return pynag.Utils.grep(self.all, **kwargs)
+        if args:
+            return list.count(self, *args)
+        return len(self)
+
+    def first(self):
+        """ Returns the first object, or None if there are none """
+        if self:
+            return self[0]
+        return None
+
+    def exists(self):
+        """ Returns True if there is at least one object """
+        return len(self) > 0
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return QuerySet(list.__getitem__(self, k))
+        return list.__getitem__(self, k)
+
+    def __getslice__(self, i, j):
+        return QuerySet(list.__getslice__(self, i, j))
 
 
 class ObjectDefinition(object):
@@ -645,6 +1244,8 @@ class ObjectDefinition(object):
             self.set_macro(key, item)
         elif self[key] != item:
             self._changes[key] = item
+            if ObjectFetcher._cached_indexes:
+                ObjectFetcher._forget_indexes(key)
             self._event(level="debug", message="attribute changed: %s = %s" % (key, item))
 
     def __getitem__(self, key):
@@ -845,6 +1446,8 @@ class ObjectDefinition(object):
         self._inherited_attributes = new_me._inherited_attributes
         self._meta = new_me._meta
         self.__object_id__ = None
+        # Inherited attributes might have changed as well
+        ObjectFetcher._cached_indexes.clear()
 
     @pynag.Utils.synchronized(pynag.Utils.rlock)
     def rewrite(self, str_new_definition=None):
@@ -1386,6 +1989,19 @@ class ObjectDefinition(object):
                         results.append(gp)
         return results
 
+    def get_impacted_objects(self, attribute_names=None):
+        """ Get all objects whose effective configuration can change when this one is edited
+
+        See :py:meth:`pynag.Parsers.config_parser.Config.get_impacted_objects`
+
+        :param attribute_names: List of attributes that are edited, None if any of them might be
+
+        :returns: A list of ObjectDefinition objects
+        """
+        items = config.get_impacted_objects(self._original_attributes, attribute_names)
+        item_ids = set(id(i) for i in items)
+        return [i for i in ObjectFetcher._cached_objects if id(i._original_attributes) in item_ids]
+
     def get_attribute_tuple(self):
         """ Returns all relevant attributes in the form of:
 
@@ -1507,6 +2123,10 @@ class ObjectDefinition(object):
 
     def _event(self, level=None, message=None):
         """ Pass informational message about something that has happened within the Model """
+        if level == 'save' and _deferred_save_events is not None:
+            # Files have not been written yet, see batch()
+            _deferred_save_events.append((self, message))
+            return
         for i in eventhandlers:
             if level == 'write':
                 i.write(object_definition=self, message=message)
@@ -1517,14 +2137,14 @@ class ObjectDefinition(object):
             else:
                 i.debug(object_definition=self, message=message)
 
-    def _do_relations(self):
+    def _do_relations(self, relations=ObjectRelations):
         """ Discover all related objects (f.e. services that belong to this host, etc
 
         ObjectDefinition only has relations via 'use' paramameter. Subclasses should extend this.
         """
         parents = AttributeList(self.use)
         for i in parents.fields:
-            ObjectRelations.use[self.object_type][i].add(self.get_id())
+            relations.use[self.object_type][i].add(self.get_id())
 
 
 class Host(ObjectDefinition):
@@ -1747,25 +2367,25 @@ class Host(ObjectDefinition):
                 copies.append(i.copy(filename=filename, host_name=args.get('host_name')))
         return copies
 
-    def _do_relations(self):
-        super(self.__class__, self)._do_relations()
+    def _do_relations(self, relations=ObjectRelations):
+        super(self.__class__, self)._do_relations(relations)
         # Do hostgroups
         hg = AttributeList(self.hostgroups)
         for i in hg.fields:
-            ObjectRelations.host_hostgroups[self.host_name].add(i)
-            ObjectRelations.hostgroup_hosts[i].add(self.host_name)
+            relations.host_hostgroups[self.host_name].add(i)
+            relations.hostgroup_hosts[i].add(self.host_name)
             # Contactgroups
         cg = AttributeList(self.contact_groups)
         for i in cg.fields:
-            ObjectRelations.host_contact_groups[self.host_name].add(i)
-            ObjectRelations.contactgroup_hosts[i].add(self.get_id())
+            relations.host_contact_groups[self.host_name].add(i)
+            relations.contactgroup_hosts[i].add(self.get_id())
         contacts = AttributeList(self.contacts)
         for i in contacts.fields:
-            ObjectRelations.host_contacts[self.host_name].add(i)
-            ObjectRelations.contact_hosts[i].add(self.get_id())
+            relations.host_contacts[self.host_name].add(i)
+            relations.contact_hosts[i].add(self.get_id())
         if self.check_command:
             command_name = self.check_command.split('!')[0]
-            ObjectRelations.command_service[self.host_name].add(command_name)
+            relations.command_service[self.host_name].add(command_name)
 
     def add_to_hostgroup(self, hostgroup_name):
         """ Add host to a hostgroup """
@@ -1823,33 +2443,33 @@ class Service(ObjectDefinition):
         except Exception:
             return _UNRESOLVED_MACRO
 
-    def _do_relations(self):
-        super(self.__class__, self)._do_relations()
+    def _do_relations(self, relations=ObjectRelations):
+        super(self.__class__, self)._do_relations(relations)
         # Do hostgroups
         hg = AttributeList(self.hostgroup_name)
         for i in hg.fields:
-            ObjectRelations.service_hostgroups[self.get_id()].add(i)
-            ObjectRelations.hostgroup_services[i].add(self.get_id())
+            relations.service_hostgroups[self.get_id()].add(i)
+            relations.hostgroup_services[i].add(self.get_id())
             # Contactgroups
         cg = AttributeList(self.contact_groups)
         for i in cg.fields:
-            ObjectRelations.service_contact_groups[self.get_id()].add(i)
-            ObjectRelations.contactgroup_services[i].add(self.get_id())
+            relations.service_contact_groups[self.get_id()].add(i)
+            relations.contactgroup_services[i].add(self.get_id())
         contacts = AttributeList(self.contacts)
         for i in contacts.fields:
-            ObjectRelations.service_contacts[self.get_id()].add(i)
-            ObjectRelations.contact_services[i].add(self.get_id())
+            relations.service_contacts[self.get_id()].add(i)
+            relations.contact_services[i].add(self.get_id())
         sg = AttributeList(self.servicegroups)
         for i in sg.fields:
-            ObjectRelations.service_servicegroups[self.get_id()].add(i)
-            ObjectRelations.servicegroup_services[i].add(self.get_id())
+            relations.service_servicegroups[self.get_id()].add(i)
+            relations.servicegroup_services[i].add(self.get_id())
         if self.check_command:
             command_name = self.check_command.split('!')[0]
-            ObjectRelations.command_service[self.get_id()].add(command_name)
+            relations.command_service[self.get_id()].add(command_name)
         hosts = AttributeList(self.host_name)
         for i in hosts.fields:
-            ObjectRelations.service_hosts[self.get_id()].add(i)
-            ObjectRelations.host_services[i].add(self.get_id())
+            relations.service_hosts[self.get_id()].add(i)
+            relations.host_services[i].add(self.get_id())
 
     def acknowledge(self, sticky=1, notify=1, persistent=0, author='pynag', comment='acknowledged by pynag',
                     timestamp=None):
@@ -2068,12 +2688,12 @@ class Contact(ObjectDefinition):
             return _UNRESOLVED_MACRO
         return self.get(attribute_name, _UNRESOLVED_MACRO)
 
-    def _do_relations(self):
-        super(self.__class__, self)._do_relations()
+    def _do_relations(self, relations=ObjectRelations):
+        super(self.__class__, self)._do_relations(relations)
         groups = AttributeList(self.contactgroups)
         for i in groups.fields:
-            ObjectRelations.contact_contactgroups[self.contact_name].add(i)
-            ObjectRelations.contactgroup_contacts[i].add(self.contact_name)
+            relations.contact_contactgroups[self.contact_name].add(i)
+            relations.contactgroup_contacts[i].add(self.contact_name)
 
     def add_to_contactgroup(self, contactgroup):
         return _add_to_contactgroup(self, contactgroup)
@@ -2189,15 +2809,15 @@ class Contactgroup(ObjectDefinition):
         get_object = lambda x: services[x]
         return map(get_object, list_of_shortnames)
 
-    def _do_relations(self):
-        super(self.__class__, self)._do_relations()
+    def _do_relations(self, relations=ObjectRelations):
+        super(self.__class__, self)._do_relations(relations)
         members = AttributeList(self.members)
         for i in members.fields:
-            ObjectRelations.contactgroup_contacts[self.contactgroup_name].add(i)
-            ObjectRelations.contact_contactgroups[i].add(self.contactgroup_name)
+            relations.contactgroup_contacts[self.contactgroup_name].add(i)
+            relations.contact_contactgroups[i].add(self.contactgroup_name)
         groups = AttributeList(self.contactgroup_members)
         for i in groups.fields:
-            ObjectRelations.contactgroup_contactgroups[self.contactgroup_name].add(i)
+            relations.contactgroup_contactgroups[self.contactgroup_name].add(i)
 
     def add_contact(self, contact_name):
         """ Adds one specific contact to this contactgroup. """
@@ -2292,15 +2912,15 @@ class Hostgroup(ObjectDefinition):
         list_of_shortnames = sorted(ObjectRelations.hostgroup_subgroups[self.hostgroup_name])
         return map(get_object, list_of_shortnames)
 
-    def _do_relations(self):
-        super(self.__class__, self)._do_relations()
+    def _do_relations(self, relations=ObjectRelations):
+        super(self.__class__, self)._do_relations(relations)
         members = AttributeList(self.members)
         for i in members.fields:
-            ObjectRelations.hostgroup_hosts[self.hostgroup_name].add(i)
-            ObjectRelations.host_hostgroups[i].add(self.hostgroup_name)
+            relations.hostgroup_hosts[self.hostgroup_name].add(i)
+            relations.host_hostgroups[i].add(self.hostgroup_name)
         groups = AttributeList(self.hostgroup_members)
         for i in groups.fields:
-            ObjectRelations.hostgroup_hostgroups[self.hostgroup_name].add(i)
+            relations.hostgroup_hostgroups[self.hostgroup_name].add(i)
 
     def add_host(self, host_name):
         """ Adds host to this group. Behaves like Hostgroup._add_member_to_group """
@@ -2448,8 +3068,8 @@ class Servicegroup(ObjectDefinition):
         service = Service.objects.get_by_shortname(shortname)
         return _remove_object_from_group(service, self)
 
-    def _do_relations(self):
-        super(self.__class__, self)._do_relations()
+    def _do_relations(self, relations=ObjectRelations):
+        super(self.__class__, self)._do_relations(relations)
 
         # Members directive for the servicegroup is members = host1,service1,host2,service2,...,hostn,servicen
         members = AttributeList(self.members).fields
@@ -2457,11 +3077,11 @@ class Servicegroup(ObjectDefinition):
             host_name = members.pop(0)
             service_description = members.pop(0)
             shortname = '%s/%s' % (host_name, service_description)
-            ObjectRelations.servicegroup_members[self.servicegroup_name].add(shortname)
+            relations.servicegroup_members[self.servicegroup_name].add(shortname)
             # Handle servicegroup_members
         groups = AttributeList(self.servicegroup_members)
         for i in groups.fields:
-            ObjectRelations.servicegroup_servicegroups[self.servicegroup_name].add(i)
+            relations.servicegroup_servicegroups[self.servicegroup_name].add(i)
 
     def downtime(self, start_time=None, end_time=None, trigger_id=0, duration=7200, author=None,
                  comment='Downtime scheduled by pynag', recursive=False):
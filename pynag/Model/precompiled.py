@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+#
+# pynag - Python Nagios plug-in and configuration environment
+# Copyright (C) 2011 Pall Sigurdsson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Writes a flattened copy of the configuration, much like "nagios -p" does.
+
+Every registered object is written with all of its effective attributes and
+without templates. Hostgroup, contactgroup and servicegroup memberships
+(including regular expressions) are expanded, and services that apply to more
+than one host are written once for every host. The output is always the same
+for the same configuration, and can be read with
+:py:class:`pynag.Parsers.object_cache.ObjectCache`.
+
+Example:
+
+>>> import pynag.Model
+>>> from pynag.Model import precompiled
+>>> pynag.Model.cfg_file = '/etc/nagios/nagios.cfg' # doctest: +SKIP
+>>> precompiled.write_precompiled_config('/var/cache/nagios/precompiled.cfg') # doctest: +SKIP
+
+The output has one section for every configuration file. When it is written
+again, sections of configuration files that have not changed are copied from
+the previous output instead of being generated again. Unless, of course,
+something that objects in other files depend on has changed, i.e. templates,
+group memberships or the list of hosts.
+"""
+
+import hashlib
+from collections import defaultdict
+
+import pynag.Model
+
+# Objects are written in the same order as nagios writes them to objects.cache
+object_type_order = [
+    'timeperiod',
+    'command',
+    'contactgroup',
+    'hostgroup',
+    'servicegroup',
+    'contact',
+    'host',
+    'service',
+    'serviceescalation',
+    'servicedependency',
+    'hostescalation',
+    'hostdependency',
+]
+
+# Attributes that only mean something for templates
+template_attributes = ('use', 'name', 'register')
+
+# Every section of the output starts with this, followed by the timestamp
+# and name of the configuration file the objects in it came from
+_section_prefix = '# source: '
+
+
+def write_precompiled_config(filename, incremental=True):
+    """ Writes every registered object in the configuration to filename
+
+    The configuration is the one in pynag.Model.cfg_file, and it is reloaded
+    if it has changed. filename is replaced atomically.
+
+    Args:
+
+        filename (str): Where to write the flattened configuration
+
+        incremental (bool): If True, sections of configuration files that have
+        not changed since filename was written are copied from filename. They
+        are read into memory first, filename might be rewritten in place.
+
+    Returns:
+
+        List of configuration files whose objects were generated. Empty list if
+        nothing has changed, in which case filename is left alone.
+    """
+    flattener = _Flattener()
+    header = flattener.get_header()
+    sources = flattener.get_sources()
+
+    old_sections = {}
+    if incremental:
+        old_sections = _read_sections(filename, header)
+
+    regenerated = []
+    for source, timestamp in sources:
+        if timestamp is None or old_sections.get(source, (None,))[0] != timestamp:
+            regenerated.append(source)
+    if old_sections and not regenerated and len(old_sections) == len(sources):
+        return []
+
+    def iter_output():
+        yield header
+        for source, timestamp in sources:
+            yield '%s%s %s\n' % (_section_prefix, timestamp, source)
+            if source in regenerated:
+                for definition in flattener.iter_definitions(source):
+                    yield definition
+            else:
+                old_timestamp, contents = old_sections[source]
+                yield contents
+    pynag.Model.config.write_atomically(filename, iter_output())
+    return regenerated
+
+
+def iter_precompiled_config():
+    """ Iterates through every object definition that write_precompiled_config() writes
+
+    Yields:
+
+        (object_type, attributes) for every definition, attributes being a dict.
+    """
+    flattener = _Flattener()
+    for source, timestamp in flattener.get_sources():
+        for object_type, attributes in flattener.iter_objects(source):
+            yield object_type, attributes
+
+
+class _Flattener(object):
+
+    """ Expands every object in pynag.Model, one configuration file at a time """
+
+    def __init__(self):
+        objects = pynag.Model.ObjectDefinition.objects.get_all()
+        self.config = pynag.Model.config
+        self.relations = pynag.Model.ObjectRelations
+
+        # objects_by_file[filename] = [registered_object1, registered_object2]
+        self.objects_by_file = defaultdict(list)
+
+        # Objects that other objects can inherit from
+        self.templates = []
+
+        self.host_names = set()
+        group_names = defaultdict(set)
+        for i in objects:
+            is_registered = i._defined_attributes.get('register') != '0'
+            if 'name' in i._defined_attributes or not is_registered:
+                self.templates.append(i)
+            if not is_registered:
+                continue
+            self.objects_by_file[i._meta['filename']].append(i)
+            if i.object_type == 'host':
+                self.host_names.add(i['host_name'])
+            elif i.object_type in ('hostgroup', 'contactgroup', 'servicegroup'):
+                group_names[i.object_type].add(i['%s_name' % i.object_type])
+        self.host_names.discard(None)
+
+        # ObjectRelations.host_hostgroups and contact_contactgroups do not have
+        # every membership that regular expressions give, so we look at it
+        # from the other side.
+        # host_hostgroups[host_name] = set([hostgroup_name, ...])
+        self.host_hostgroups = _get_members_groups(self.relations.hostgroup_hosts, group_names['hostgroup'])
+        # contact_contactgroups[contact_name] = set([contactgroup_name, ...])
+        self.contact_contactgroups = _get_members_groups(self.relations.contactgroup_contacts,
+                                                         group_names['contactgroup'])
+
+        # servicegroup_members[servicegroup_name] = set([(host_name, service_description), ...])
+        self.servicegroup_members = defaultdict(set)
+        # service_servicegroups[(host_name, service_description)] = set([servicegroup_name, ...])
+        self.service_servicegroups = defaultdict(set)
+        cached_ids = pynag.Model.ObjectFetcher._cached_ids
+        for servicegroup, service_ids in self.relations.servicegroup_services.items():
+            if servicegroup not in group_names['servicegroup']:
+                continue
+            for service_id in service_ids:
+                service = cached_ids.get(service_id)
+                if service is None or service._defined_attributes.get('register') == '0':
+                    continue
+                service_description = service['service_description']
+                for host_name in self.get_service_hosts(service):
+                    self.servicegroup_members[servicegroup].add((host_name, service_description))
+                    self.service_servicegroups[(host_name, service_description)].add(servicegroup)
+
+    def get_header(self):
+        """ Returns the first lines of the output
+
+        They include a digest of everything that objects depend on, other
+        than their own definition. If it changes, every object has to be
+        generated again.
+        """
+        digest = hashlib.md5()
+        template_definitions = []
+        for i in self.templates:
+            definition = sorted(i._defined_attributes.items())
+            template_definitions.append((i.object_type, i._meta['filename'], definition))
+        digest.update(repr(sorted(template_definitions)))
+        digest.update(repr(sorted(self.host_names)))
+        for relation in (self.host_hostgroups, self.contact_contactgroups, self.servicegroup_members):
+            digest.update(repr(sorted((k, sorted(v)) for k, v in relation.items() if v)))
+        lines = [
+            "# Flattened nagios configuration, written by pynag. Do not edit.\n",
+            "# cfg_file: %s\n" % self.config.cfg_file,
+            "# digest: %s\n" % digest.hexdigest(),
+            "\n",
+        ]
+        return ''.join(lines)
+
+    def get_sources(self):
+        """ Returns a sorted list of (filename, timestamp) of configuration files with registered objects
+
+        timestamp is a string, or None if it is not known.
+        """
+        timestamps = self.config.timestamps or {}
+        sources = []
+        for filename in sorted(self.objects_by_file):
+            timestamp = timestamps.get(filename)
+            if timestamp is not None:
+                timestamp = repr(timestamp)
+            sources.append((filename, timestamp))
+        return sources
+
+    def get_service_hosts(self, service):
+        """ Returns a sorted list of every host_name that service applies to """
+        relations = self.relations
+        service_id = service.get_id()
+        host_names = set()
+        excluded = set()
+        for host_name in relations.service_hosts.get(service_id, ()):
+            if host_name == '*':
+                host_names.update(self.host_names)
+            elif host_name.startswith('!'):
+                excluded.add(host_name[1:])
+            else:
+                host_names.add(host_name)
+        for hostgroup_name in relations.service_hostgroups.get(service_id, ()):
+            if hostgroup_name.startswith('!'):
+                excluded.update(relations.hostgroup_hosts.get(hostgroup_name[1:], ()))
+            else:
+                host_names.update(relations.hostgroup_hosts.get(hostgroup_name, ()))
+        host_names -= excluded
+        host_names.discard(None)
+        return sorted(host_names)
+
+    def iter_objects(self, filename):
+        """ Iterates through (object_type, attributes) of every object in filename, in order """
+        relations = self.relations
+        objects = []
+        for i in self.objects_by_file.get(filename, ()):
+            attributes = i._inherited_attributes.copy()
+            attributes.update(i._defined_attributes)
+            for attribute_name in template_attributes:
+                attributes.pop(attribute_name, None)
+            for attribute_name, value in attributes.items():
+                if value == 'null':
+                    del attributes[attribute_name]
+
+            object_type = i.object_type
+            if object_type == 'service':
+                attributes.pop('hostgroup_name', None)
+                service_description = attributes.get('service_description')
+                for host_name in self.get_service_hosts(i):
+                    service = attributes.copy()
+                    service['host_name'] = host_name
+                    _set_list(service, 'servicegroups', self.service_servicegroups.get((host_name, service_description)))
+                    objects.append((object_type, "%s/%s" % (host_name, service_description), service))
+                continue
+            elif object_type == 'host':
+                _set_list(attributes, 'hostgroups', self.host_hostgroups.get(attributes.get('host_name')))
+            elif object_type == 'hostgroup':
+                attributes.pop('hostgroup_members', None)
+                _set_list(attributes, 'members', relations.hostgroup_hosts.get(attributes.get('hostgroup_name')))
+            elif object_type == 'contact':
+                _set_list(attributes, 'contactgroups', self.contact_contactgroups.get(attributes.get('contact_name')))
+            elif object_type == 'contactgroup':
+                attributes.pop('contactgroup_members', None)
+                _set_list(attributes, 'members', relations.contactgroup_contacts.get(attributes.get('contactgroup_name')))
+            elif object_type == 'servicegroup':
+                attributes.pop('servicegroup_members', None)
+                members = self.servicegroup_members.get(attributes.get('servicegroup_name'), ())
+                members = ['%s,%s' % member for member in sorted(members)]
+                _set_list(attributes, 'members', members)
+            objects.append((object_type, i.get_shortname(), attributes))
+
+        objects.sort(key=_get_sort_key)
+        for object_type, shortname, attributes in objects:
+            yield object_type, attributes
+
+    def iter_definitions(self, filename):
+        """ Iterates through object definitions (str) of every object in filename, in order """
+        for object_type, attributes in self.iter_objects(filename):
+            lines = ['define %s {\n' % object_type]
+            for k, v in sorted(attributes.items()):
+                if v == '':
+                    lines.append('\t%s\n' % k)
+                else:
+                    lines.append('\t%s\t%s\n' % (k, v))
+            lines.append('\t}\n\n')
+            yield ''.join(lines)
+
+
+def _set_list(attributes, attribute_name, values):
+    """ Sets attributes[attribute_name] to a comma seperated list of values, or removes it if there are none """
+    values = sorted(i for i in values or () if i and not i.startswith('!'))
+    if values:
+        attributes[attribute_name] = ','.join(values)
+    else:
+        attributes.pop(attribute_name, None)
+
+
+def _get_members_groups(group_members, group_names):
+    """ Turns group_members[group_name] = set(members) into members_groups[member] = set(group_names)
+
+    Only groups in group_names are included.
+    """
+    members_groups = defaultdict(set)
+    for group_name, members in group_members.items():
+        if group_name not in group_names:
+            continue
+        for member in members:
+            members_groups[member].add(group_name)
+    return members_groups
+
+
+def _get_sort_key(definition):
+    object_type, shortname, attributes = definition
+    if object_type in object_type_order:
+        type_order = object_type_order.index(object_type)
+    else:
+        type_order = len(object_type_order)
+    return type_order, object_type, shortname, sorted(attributes.items())
+
+
+def _read_sections(filename, header):
+    """ Reads the sections in an earlier output of write_precompiled_config()
+
+    Returns:
+
+        dict of section[source_filename] = (timestamp, contents). Empty dict
+        if filename does not exist or was written from something else than
+        header.
+    """
+    sections = {}
+    try:
+        fh = open(filename, 'rb')
+    except IOError:
+        return sections
+    try:
+        if fh.read(len(header)) != header:
+            return sections
+        source = None
+        lines = []
+        for line in fh:
+            if line.startswith(_section_prefix):
+                if source is not None:
+                    sections[source] = (timestamp, ''.join(lines))
+                timestamp, source = line[len(_section_prefix):].rstrip('\n').split(' ', 1)
+                lines = []
+            else:
+                lines.append(line)
+        if source is not None:
+            sections[source] = (timestamp, ''.join(lines))
+    finally:
+        fh.close()
+    return sections
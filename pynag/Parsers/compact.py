@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""Memory efficient representation of parsed object definitions.
+
+A normal parsed item is a dict of attributes, with a 'meta' dict that has
+its own copy of defined and inherited attributes, and the raw definition as
+it appeared in the configuration file. :py:class:`CompactItem` and
+:py:class:`CompactMeta` behave the same way, but store every attribute only
+once, intern attribute names and read raw definitions back from the
+configuration file when they are asked for.
+
+See the compact argument of :py:class:`pynag.Parsers.config_parser.Config`.
+"""
+
+import hashlib
+
+# Keys that every meta has
+META_KEYS = (
+    'object_type',
+    'filename',
+    'template_fields',
+    'needs_commit',
+    'delete_me',
+    'defined_attributes',
+    'inherited_attributes',
+    'raw_definition',
+    'line_start',
+    'line_end',
+)
+_meta_keys = frozenset(META_KEYS)
+
+# Marks attributes that have been removed from a CompactItem
+_deleted = object()
+
+
+def _intern(string):
+    """ Interns string if it can be interned """
+    if type(string) is str:
+        return intern(string)
+    return string
+
+
+class CompactSource(object):
+
+    """ A configuration file that compact items were parsed from
+
+    Every item parsed from the same file shares one CompactSource, which
+    reads raw definitions back from the file on demand.
+    """
+
+    __slots__ = ('config', 'filename', 'stamp')
+
+    def __init__(self, config, filename, stamp):
+        """
+        Args:
+
+            config: :py:class:`pynag.Parsers.config_parser.Config` that parsed the file
+
+            filename: Path to the configuration file
+
+            stamp: (mtime, size) of the file when it was parsed
+        """
+        self.config = config
+        self.filename = filename
+        self.stamp = stamp
+
+    def get_raw_definition(self, line_start):
+        """ Returns raw_definition of the object definition that starts on line_start """
+        return self.config._get_raw_definition(self.filename, self.stamp, line_start)
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactSource):
+            return False
+        return self.filename == other.filename and self.stamp == other.stamp
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class CompactMeta(object):
+
+    """ Replacement for the 'meta' dict of a parsed item
+
+    Supports the same keys and dict protocol as the meta dict, with a few
+    differences:
+
+        * inherited_attributes is only created when it is needed
+        * template_fields is calculated from defined and inherited attributes,
+          unless it has been set explicitly
+        * raw_definition is read from the configuration file when it is
+          needed, unless it has been set explicitly
+    """
+
+    __slots__ = (
+        'object_type',
+        'filename',
+        'needs_commit',
+        'delete_me',
+        'defined_attributes',
+        'line_start',
+        'line_end',
+        '_inherited_attributes',
+        '_template_fields',
+        '_raw_definition',
+        '_digest',
+        '_source',
+        '_extra',
+    )
+
+    def __init__(self, object_type, filename, defined_attributes=None):
+        self.object_type = object_type
+        self.filename = filename
+        self.needs_commit = None
+        self.delete_me = None
+        self.defined_attributes = defined_attributes if defined_attributes is not None else {}
+        self.line_start = None
+        self.line_end = None
+        self._inherited_attributes = None
+        self._template_fields = None
+        self._raw_definition = None
+        self._digest = None
+        self._source = None
+        self._extra = None
+
+    def _get_inherited_attributes(self):
+        if self._inherited_attributes is None:
+            self._inherited_attributes = {}
+        return self._inherited_attributes
+
+    def _set_inherited_attributes(self, value):
+        self._inherited_attributes = value
+
+    inherited_attributes = property(_get_inherited_attributes, _set_inherited_attributes)
+
+    def _get_template_fields(self):
+        if self._template_fields is not None:
+            return self._template_fields
+        inherited_attributes = self._inherited_attributes
+        if not inherited_attributes:
+            return []
+        defined_attributes = self.defined_attributes
+        return [k for k in inherited_attributes if k not in defined_attributes]
+
+    def _set_template_fields(self, value):
+        self._template_fields = value
+
+    template_fields = property(_get_template_fields, _set_template_fields)
+
+    def _get_raw_definition(self):
+        if self._raw_definition is not None or self._source is None:
+            return self._raw_definition
+        return self._source.get_raw_definition(self.line_start)
+
+    def _set_raw_definition(self, value):
+        self._raw_definition = value
+        self._digest = None
+        self._source = None
+
+    raw_definition = property(_get_raw_definition, _set_raw_definition)
+
+    def set_source(self, source, raw_definition):
+        """ Forget raw_definition, and read it from source when it is needed
+
+        Args:
+
+            source: :py:class:`CompactSource` of the file this definition is in
+
+            raw_definition: Current raw definition, as it appears in source
+        """
+        if isinstance(raw_definition, unicode):
+            self._digest = hashlib.md5(raw_definition.encode('utf-8')).digest()
+        else:
+            self._digest = hashlib.md5(raw_definition).digest()
+        self._source = source
+        self._raw_definition = None
+
+    def get_template_cache_key(self):
+        """ Returns a key that identifies raw_definition, without reading it from file """
+        if self._digest is not None:
+            return self._digest
+        return self._raw_definition
+
+    def copy(self):
+        """ Returns a shallow copy of this meta as a normal dict """
+        return dict(self.iteritems())
+
+    def __getitem__(self, key):
+        if key in _meta_keys:
+            return getattr(self, key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _meta_keys:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __contains__(self, key):
+        return key in _meta_keys or (self._extra is not None and key in self._extra)
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(META_KEYS) + len(self._extra or ())
+
+    def keys(self):
+        return list(META_KEYS) + (self._extra or {}).keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    iterkeys = __iter__
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        if self._extra is not None and key in self._extra:
+            return self._extra.pop(key)
+        if args:
+            return args[0]
+        raise KeyError(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, CompactMeta) and self._source is not None and self._source == other._source:
+            # Same definition in the same version of the same file
+            for key in META_KEYS:
+                if key != 'raw_definition' and self[key] != other[key]:
+                    return False
+            return self.line_start == other.line_start and (self._extra or {}) == (other._extra or {})
+        if not isinstance(other, (dict, CompactMeta)):
+            return False
+        return dict(self.iteritems()) == dict(other.iteritems())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+
+class CompactItem(object):
+
+    """ Replacement for a parsed item dict
+
+    Attributes are looked up in meta['defined_attributes'] and then in
+    meta['inherited_attributes'] instead of being stored in the item itself.
+    Changes that make the item differ from those are stored separately.
+    """
+
+    __slots__ = ('meta', '_changes')
+
+    def __init__(self, meta):
+        self.meta = meta
+        self._changes = None
+
+    @classmethod
+    def from_item(cls, item, source=None):
+        """ Creates a CompactItem with the same attributes and meta as item
+
+        Args:
+
+            item: An item dict as created by :py:meth:`Config.parse_string`
+
+            source (optional): :py:class:`CompactSource` of the file item was
+            parsed from. If provided, raw_definition is not kept in memory.
+
+        Returns:
+
+            A new CompactItem
+        """
+        meta = item['meta']
+        defined_attributes = {}
+        for key, value in meta.get('defined_attributes', {}).iteritems():
+            defined_attributes[_intern(key)] = value
+        compact_meta = CompactMeta(meta.get('object_type'), meta.get('filename'), defined_attributes)
+        compact_meta.needs_commit = meta.get('needs_commit')
+        compact_meta.delete_me = meta.get('delete_me')
+        compact_meta.line_start = meta.get('line_start')
+        compact_meta.line_end = meta.get('line_end')
+        if meta.get('inherited_attributes'):
+            compact_meta.inherited_attributes = dict((_intern(k), v) for k, v in meta['inherited_attributes'].iteritems())
+        if meta.get('template_fields'):
+            compact_meta.template_fields = list(meta['template_fields'])
+        raw_definition = meta.get('raw_definition')
+        if source is not None and raw_definition is not None and compact_meta.line_start is not None:
+            compact_meta.set_source(source, raw_definition)
+        else:
+            compact_meta.raw_definition = raw_definition
+        for key, value in meta.iteritems():
+            if key not in _meta_keys:
+                compact_meta[key] = value
+
+        result = cls(compact_meta)
+        for key, value in item.iteritems():
+            if key != 'meta' and result.get(key, _deleted) is not value:
+                result[_intern(key)] = value
+        if len(result) != len(item):
+            for key in result.keys():
+                if key not in item:
+                    del result[key]
+        return result
+
+    def get_pristine_copy(self):
+        """ Returns a copy of this item as it was before any templates were applied to it """
+        meta = self.meta
+        new_meta = CompactMeta(meta.object_type, meta.filename, meta.defined_attributes.copy())
+        new_meta.needs_commit = meta.needs_commit
+        new_meta.delete_me = meta.delete_me
+        new_meta.line_start = meta.line_start
+        new_meta.line_end = meta.line_end
+        new_meta._raw_definition = meta._raw_definition
+        new_meta._digest = meta._digest
+        new_meta._source = meta._source
+        if meta._extra is not None:
+            new_meta._extra = meta._extra.copy()
+        return CompactItem(new_meta)
+
+    def __getitem__(self, key):
+        if key == 'meta':
+            return self.meta
+        changes = self._changes
+        if changes is not None and key in changes:
+            value = changes[key]
+            if value is _deleted:
+                raise KeyError(key)
+            return value
+        meta = self.meta
+        defined_attributes = meta.defined_attributes
+        if key in defined_attributes:
+            return defined_attributes[key]
+        inherited_attributes = meta._inherited_attributes
+        if inherited_attributes is not None and key in inherited_attributes:
+            return inherited_attributes[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'meta':
+            if not isinstance(value, CompactMeta):
+                value = CompactItem.from_item({'meta': value}).meta
+            self.meta = value
+            return
+        changes = self._changes
+        if changes is None or key not in changes:
+            # No need to remember a value we already have
+            if self.get(key, _deleted) is value:
+                return
+            if changes is None:
+                changes = self._changes = {}
+        changes[key] = value
+
+    def __delitem__(self, key):
+        if key == 'meta' or key not in self:
+            raise KeyError(key)
+        if self._changes is None:
+            self._changes = {}
+        self._changes[key] = _deleted
+
+    def __contains__(self, key):
+        if key == 'meta':
+            return True
+        changes = self._changes
+        if changes is not None and key in changes:
+            return changes[key] is not _deleted
+        meta = self.meta
+        if key in meta.defined_attributes:
+            return True
+        inherited_attributes = meta._inherited_attributes
+        return inherited_attributes is not None and key in inherited_attributes
+
+    has_key = __contains__
+
+    def keys(self):
+        meta = self.meta
+        defined_attributes = meta.defined_attributes
+        result = ['meta'] + defined_attributes.keys()
+        inherited_attributes = meta._inherited_attributes
+        if inherited_attributes:
+            result += [k for k in inherited_attributes if k not in defined_attributes]
+        changes = self._changes
+        if changes:
+            result = [k for k in result if changes.get(k) is not _deleted]
+            result += [k for k, v in changes.iteritems() if v is not _deleted and k not in result]
+        return result
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    iterkeys = __iter__
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        try:
+            value = self[key]
+        except KeyError:
+            if args:
+                return args[0]
+            raise
+        del self[key]
+        return value
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def copy(self):
+        """ Returns a shallow copy of this item as a normal dict """
+        return dict(self.iteritems())
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, (dict, CompactItem)):
+            return False
+        keys = self.keys()
+        if len(keys) != len(other):
+            return False
+        # Attributes first, comparing meta might involve reading files
+        for key in keys:
+            if key == 'meta':
+                continue
+            if key not in other or self[key] != other[key]:
+                return False
+        return self.meta == other['meta']
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
@@ -1,22 +1,94 @@
 # -*- coding: utf-8 -*-
 """Module for low-level parsing of nagios-style configuration files."""
 
+import contextlib
+import cStringIO
+import hashlib
+import itertools
+import marshal
+import multiprocessing
 import os
 import re
+import stat
+import StringIO
 import sys
+import tempfile
 import time
+import types
 
+import pynag
 import pynag.Utils
+from pynag.Utils import instrumentation
 from pynag.Utils import paths
 
 # TODO: Raise more specific errors in this module.
 from pynag.Parsers.errors import ParserError
+from pynag.Parsers.compact import CompactItem, CompactMeta, CompactSource
+from pynag.Parsers.dependencies import DependencyGraph
+from pynag.Parsers import watcher
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# Mode of new files written by Config.write(). The umask can only be read by
+# setting it, so that is done once here instead of on every write.
+_umask = os.umask(0)
+os.umask(_umask)
+new_file_mode = 0666 & ~_umask
+del _umask
 
 
 class ConfigFileNotFound(ParserError):
     """ This exception is thrown if we cannot locate any nagios.cfg-style config file. """
 
 
+class _DirEntry(object):
+
+    """ Minimal stand-in for os.DirEntry when scandir is not available
+
+    Just like the real thing, results of lstat() and stat() are cached so
+    every file is only looked at once.
+    """
+    __slots__ = ('name', 'path', '_lstat', '_stat')
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._lstat = None
+        self._stat = None
+
+    def is_symlink(self):
+        try:
+            return stat.S_ISLNK(self._get_lstat().st_mode)
+        except OSError:
+            return False
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def stat(self):
+        if self._stat is None:
+            lstat = self._get_lstat()
+            if stat.S_ISLNK(lstat.st_mode):
+                self._stat = os.stat(self.path)
+            else:
+                self._stat = lstat
+        return self._stat
+
+    def _get_lstat(self):
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        return self._lstat
+
+
 class Config(object):
 
     """ Parse and write nagios config files """
@@ -25,7 +97,21 @@ class Config(object):
     # define <object_type> {
     __beginning_of_object = re.compile("^\s*define\s+(\w+)\s*\{?(.*)$")
 
-    def __init__(self, cfg_file=None, strict=False):
+    # Attributes that identify objects of each type when two configurations
+    # are compared with diff(). Types that are not here are identified by
+    # <object_type>_name, and templates by their name.
+    diff_keys = {
+        'service': ('host_name', 'hostgroup_name', 'service_description'),
+        'serviceescalation': ('host_name', 'hostgroup_name', 'service_description', 'contact_groups', 'contacts'),
+        'hostescalation': ('host_name', 'hostgroup_name', 'contact_groups', 'contacts'),
+        'servicedependency': ('host_name', 'hostgroup_name', 'service_description', 'dependent_host_name',
+                              'dependent_hostgroup_name', 'dependent_service_description'),
+        'hostdependency': ('host_name', 'hostgroup_name', 'dependent_host_name', 'dependent_hostgroup_name'),
+        'serviceextinfo': ('host_name', 'service_description'),
+        'hostextinfo': ('host_name',),
+    }
+
+    def __init__(self, cfg_file=None, strict=False, parallel=None, cache_dir=None, compact=False, watch=False, durable=False):
         """ Constructor for :py:class:`pynag.Parsers.config` class
 
         Args:
@@ -35,10 +121,40 @@ class Config(object):
 
             strict (bool): if True, use stricter parsing which is more prone to
             raising exceptions
+
+            parallel (int): If set, parse() will parse object configuration
+            files in a pool of this many worker processes. Worker processes
+            read files directly from local disk, so files are parsed in this
+            process if open(), parse_file() or parse_string() is overridden.
+
+            cache_dir (str): If set, parsed object configuration files are
+            cached in this directory so other processes do not have to parse
+            them again. A good place is a directory next to object_cache_file.
+
+            compact (bool): If True, parsed items are stored as
+            :py:class:`pynag.Parsers.compact.CompactItem` which use a lot less
+            memory than dicts. raw_definition of those is read from the
+            configuration file when needed.
+
+            watch (bool): If True, needs_reparse() asks a
+            :py:mod:`pynag.Parsers.watcher` if anything has changed instead
+            of looking at every configuration file. Uses inotify on Linux.
+
+            durable (bool): If True, files that are written are synced to
+            disk (with fsync) before write() returns, so changes survive a
+            crash or power failure. Inside a :py:meth:`transaction` every
+            changed file is synced once when it ends. Syncing is slow, so
+            it is off by default.
         """
 
         self.cfg_file = cfg_file  # Main configuration file
         self.strict = strict  # Use strict parsing or not
+        self.parallel = parallel  # Number of processes used to parse files
+        self.cache_dir = cache_dir  # Where to store parsed files between processes
+        self.compact = compact  # Store parsed items as CompactItem
+        self.watch = watch  # Use a watcher to find out if files have changed
+        self._watcher = None  # Started by parse() if self.watch is True
+        self.durable = durable  # Sync written files to disk
 
         # If nagios.cfg is not set, lets do some minor autodiscover.
         if self.cfg_file is None:
@@ -47,8 +163,57 @@ class Config(object):
         self.data = {}
         self.maincfg_values = []
         self._is_dirty = False
+
+        # Per-file results of previous parse(), used to only re-read files
+        # that have changed. _parsed_files[filename] = {'stamp', 'items', 'errors'}
+        self._parsed_files = {}
+
+        # Files that we have written to ourselves since last parse()
+        self._dirty_files = set()
+
+        # Line ranges of object definitions in files, used to locate items
+        # that are being modified. See _get_definition_index()
+        self._definition_index = {}
+
+        # Contents of files that have been changed inside a transaction(),
+        # _pending_writes[filename] = (stamp, list of lines)
+        self._pending_writes = {}
+        self._transaction_depth = 0
+        self._number_of_pending_writes = 0
+
+        # Errors raised while applying templates, keyed by id() of the item
+        self._template_errors = {}
+
+        # (filename, stamp, {line_start: raw_definition}) of the last file
+        # that raw definitions of compact items were read from
+        self._raw_definition_cache = None
+
         self.reset()  # Initilize misc member variables
 
+    def __getstate__(self):
+        """ Returns what pickle needs to save of this Config (see pynag.Model.save_snapshot())
+
+        The watcher is left out, and so is everything that is keyed by id()
+        of items, as items get new ids when they are loaded. So are
+        functions that have been put on this instance, like the ones
+        pynag.Utils.misc.FakeNagiosEnvironment wraps open() with.
+        """
+        state = self.__dict__.copy()
+        state['_watcher'] = None
+        state['_dependency_graph'] = None
+        for k, v in state.items():
+            if isinstance(v, (types.FunctionType, types.MethodType)):
+                del state[k]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        template_errors = {}
+        for errors in self._template_errors.values():
+            for error in errors:
+                template_errors.setdefault(id(getattr(error, 'item', None)), []).append(error)
+        self._template_errors = template_errors
+
     def guess_nagios_directory(self):
         """ Returns a path to the nagios configuration directory on your system
 
@@ -118,6 +283,11 @@ class Config(object):
 
         self.cfg_files = []  # List of other configuration files
         self.data = {}  # dict of every known object definition
+        self._items_by_filename = None  # Made from self.data when needed, see _get_filename_index()
+        self._items_by_key = {}  # _items_by_key[object_type][key], see _get_key_index()
+        self._dependency_graph = None  # Made from self.data when needed, see get_impacted_objects()
+        self._cfg_file_timestamps = {}  # mtimes seen by the last get_cfg_files(), see get_timestamps()
+        self._cfg_dir_timestamps = {}  # mtimes of every directory walked by the last get_cfg_files()
         self.errors = []  # List of ParserErrors
         self.item_list = None
         self.item_cache = None
@@ -247,52 +417,520 @@ class Config(object):
             original_item to which have been added all the attributes defined
             in parent items.
         """
-
-        # TODO: There is space for more performance tweaks here
         # If item does not inherit from anyone else, lets just return item as is.
         if 'use' not in original_item:
             return original_item
-        object_type = original_item['meta']['object_type']
-        raw_definition = original_item['meta']['raw_definition']
-        my_cache = self.item_apply_cache.get(object_type, {})
-
-        # Performance tweak, if item has been parsed. Lets not do it again
-        if raw_definition in my_cache:
-            return my_cache[raw_definition]
-
-        parent_names = original_item['use'].split(',')
-        parent_items = []
-        for parent_name in parent_names:
-            parent_item = self._get_item(parent_name, object_type)
-            if parent_item is None:
-                error_string = "Can not find any %s named %s\n" % (object_type, parent_name)
-                self.errors.append(ParserError(error_string, item=original_item))
+        return self._resolve_templates([original_item])[0]
+
+    def _resolve_templates(self, items):
+        """ Apply templates to every item in items
+
+        Walks the use= graph depth first, so every template is resolved before
+        the items that use it. Resolved templates are stored in
+        :py:attr:`config.item_apply_cache`, so each template is resolved only
+        once no matter how many items use it or how deep the hierarchy is.
+
+        Circular use= are reported as :py:class:`ParserError` and the
+        template that closes the circle is not applied.
+
+        Args:
+
+            items: List of parsed items
+
+        Returns:
+
+            List of items with templates applied, in the same order as items.
+            A template with the same raw definition as a template that has
+            already been resolved is replaced with the resolved one.
+        """
+        result = []
+        # Attributes that every resolved template passes on to items that use
+        # it, by object_type and name of the template
+        parent_attributes = {}
+        for original_item in items:
+            if 'use' not in original_item:
+                result.append(original_item)
+                continue
+            object_type = original_item['meta']['object_type']
+            my_cache = self.item_apply_cache.get(object_type, {})
+            raw_definition = self._get_template_cache_key(original_item)
+            # Performance tweak, if item has been parsed. Lets not do it again
+            if raw_definition in my_cache:
+                result.append(my_cache[raw_definition])
                 continue
+            my_parents = parent_attributes.setdefault(object_type, {})
+
+            # Every entry in stack is an item that is being resolved, the
+            # names of parents that are left to look at, and attributes of
+            # parents that have been resolved
+            stack = [(original_item, raw_definition, iter(original_item['use'].split(',')), [])]
+            while stack:
+                item, raw_definition, parent_names, attributes = stack[-1]
+                for parent_name in parent_names:
+                    if parent_name in my_parents:
+                        attributes.append(my_parents[parent_name])
+                        continue
+                    parent_item = self._get_item(parent_name, object_type)
+                    if parent_item is None:
+                        error_string = "Can not find any %s named %s\n" % (object_type, parent_name)
+                        self.errors.append(ParserError(error_string, item=item))
+                        continue
+                    if 'use' in parent_item:
+                        parent_raw_definition = self._get_template_cache_key(parent_item)
+                        if parent_raw_definition in my_cache:
+                            parent_item = my_cache[parent_raw_definition]
+                        elif [i for i in stack if i[0] is parent_item]:
+                            names = [i[0].get('name') for i in stack]
+                            names = names[names.index(parent_name):] + [parent_name]
+                            error_string = "Circular use= in %s definitions: %s" % (object_type, ' -> '.join(names))
+                            self.errors.append(ParserError(error_string, item=item))
+                            continue
+                        else:
+                            # Parent has templates of its own, resolve those first
+                            stack.append((parent_item, parent_raw_definition, iter(parent_item['use'].split(',')), []))
+                            break
+                    my_parents[parent_name] = self._get_inheritable_attributes(parent_item)
+                    attributes.append(my_parents[parent_name])
+                else:
+                    # All parents of item have been resolved
+                    stack.pop()
+                    self._inherit_attributes(item, attributes)
+                    if 'name' in item:
+                        my_cache[raw_definition] = item
+                    if stack:
+                        my_parents[item['name']] = self._get_inheritable_attributes(item)
+                        stack[-1][3].append(my_parents[item['name']])
+            result.append(original_item)
+        return result
 
-            try:
-                # Parent item probably has use flags on its own. So lets apply to parent first
-                parent_item = self._apply_template(parent_item)
-            except RuntimeError:
-                t, e = sys.exc_info()[:2]
-                self.errors.append(ParserError("Error while parsing item: %s (it might have circular use=)" % str(e),
-                                               item=original_item))
-            parent_items.append(parent_item)
-
-        inherited_attributes = original_item['meta']['inherited_attributes']
-        template_fields = original_item['meta']['template_fields']
-        for parent_item in parent_items:
-            for k, v in parent_item.iteritems():
-                if k in ('use', 'register', 'meta', 'name'):
+    def _get_inheritable_attributes(self, parent_item):
+        """ Returns a dict with the attributes that parent_item passes on to items that use it """
+        attributes = dict(parent_item.iteritems())
+        for k in ('use', 'register', 'meta', 'name'):
+            attributes.pop(k, None)
+        return attributes
+
+    def _inherit_attributes(self, item, parent_attributes):
+        """ Add attributes of parents to item
+
+        Args:
+
+            item: Item to add attributes to
+
+            parent_attributes: List of dicts, from :py:meth:`_get_inheritable_attributes`,
+            of every parent in item's use=. Attributes of the first parent take
+            precedence over the next ones, and attributes defined in item
+            itself take precedence over all of them.
+        """
+        inherited_attributes = item['meta']['inherited_attributes']
+        for attributes in parent_attributes:
+            if not inherited_attributes:
+                inherited_attributes.update(attributes)
+            else:
+                for k, v in attributes.iteritems():
+                    if k not in inherited_attributes:
+                        inherited_attributes[k] = v
+        # Compact items look up inherited attributes by themselves
+        if isinstance(item, CompactItem):
+            return
+        template_fields = item['meta']['template_fields']
+        for attributes in parent_attributes:
+            missing = [k for k in attributes if k not in item]
+            template_fields += missing
+            for k in missing:
+                item[k] = attributes[k]
+
+    def _get_template_cache_key(self, item):
+        """ Returns the key that item is stored with in self.item_apply_cache
+
+        This is the raw definition of item, or for compact items something
+        that identifies it without reading it from file.
+        """
+        meta = item['meta']
+        if isinstance(meta, CompactMeta):
+            return meta.get_template_cache_key()
+        return meta['raw_definition']
+
+    def _get_pristine_copy(self, item):
+        """ Returns a copy of item as it was before any templates were applied to it
+
+        Args:
+
+            item: Parsed item as parsed by :py:meth:`parse_string`
+
+        Returns:
+
+            A new item that only has the attributes in item['meta']['defined_attributes']
+        """
+        if isinstance(item, CompactItem):
+            return item.get_pristine_copy()
+        meta = item['meta'].copy()
+        meta['defined_attributes'] = meta['defined_attributes'].copy()
+        meta['inherited_attributes'] = {}
+        meta['template_fields'] = []
+        new_item = meta['defined_attributes'].copy()
+        new_item['meta'] = meta
+        return new_item
+
+    def _get_file_stamp(self, filename):
+        """ Returns a (mtime, size) tuple that identifies current version of filename
+
+        Inside a :py:meth:`transaction`, files with pending changes get a stamp
+        that identifies the pending version of the file instead.
+
+        Returns:
+
+            None if filename could not be stat'ed
+        """
+        if filename in self._pending_writes:
+            return self._pending_writes[filename][0]
+        try:
+            file_stat = self.stat(filename)
+        except (IOError, OSError):
+            return None
+        return file_stat.st_mtime, getattr(file_stat, 'st_size', None)
+
+    def _load_files(self, cfg_files, changed_files=None):
+        """ Parse cfg_files into self.pre_object_list, only re-reading files that changed since last parse
+
+        Files whose mtime and size are the same as during previous parse() are
+        not read again, instead their items are reused. Items in unchanged
+        files that inherit (directly or via other templates) from a template
+        that was added, changed or removed are replaced with un-templated copies.
+
+        Args:
+
+            cfg_files: List of object configuration files to load
+
+            changed_files: If set, every file that has changed since previous
+            parse(), as reported by a watcher. Other files that were loaded
+            last time are reused without looking at their mtime and size.
+
+        Returns:
+
+            set of id() of every item in self.pre_object_list that needs to
+            have its templates applied.
+        """
+        previous = self._parsed_files
+        current = {}
+        stamps = {}
+        files_to_parse = []
+
+        for filename in cfg_files:
+            if filename in stamps:
+                continue
+            entry = previous.get(filename)
+            if changed_files is not None and entry is not None and entry['stamp'] is not None and \
+                    filename not in changed_files and filename not in self._dirty_files and \
+                    filename not in self._pending_writes:
+                stamps[filename] = entry['stamp']
+                continue
+            stamp = stamps[filename] = self._get_file_stamp(filename)
+            if entry is None or stamp is None or entry['stamp'] != stamp or filename in self._dirty_files:
+                files_to_parse.append(filename)
+
+        parsed_files = {}
+        if self.cache_dir:
+            for filename in files_to_parse[:]:
+                if filename in self._dirty_files:
                     continue
-                if k not in inherited_attributes:
-                    inherited_attributes[k] = v
-                if k not in original_item:
-                    original_item[k] = v
-                    template_fields.append(k)
-        if 'name' in original_item:
-            my_cache[raw_definition] = original_item
+                items = self._read_parse_cache(filename, stamps[filename])
+                if items is not None:
+                    parsed_files[filename] = (items, [])
+                    files_to_parse.remove(filename)
+
+        # Items can be made compact while parsing, unless they are going to the disk cache
+        if self.compact and not self.cache_dir:
+            parsed = self._parse_files(files_to_parse, stamps)
+        else:
+            parsed = self._parse_files(files_to_parse)
+        for filename, (items, errors) in parsed.items():
+            parsed_files[filename] = (items, errors)
+            # Files with errors are not cached, so the errors are reported every time
+            if self.cache_dir and not errors and filename not in self._pending_writes:
+                self._write_parse_cache(filename, stamps[filename], items)
+        if self.compact and self.cache_dir:
+            for filename, (items, errors) in parsed_files.items():
+                parsed_files[filename] = (self._get_compact_items(filename, stamps[filename], items), errors)
+        changed_files = set(parsed_files)
+        for filename in cfg_files:
+            if filename in current:
+                continue
+            if filename in parsed_files:
+                items, errors = parsed_files[filename]
+                entry = {'stamp': stamps[filename], 'items': items, 'errors': errors}
+            else:
+                entry = previous[filename]
+            self.errors += entry['errors']
+            current[filename] = entry
+
+        # Any template defined in a file that changed might affect items in other files
+        dirty_templates = set()
+        for filename in changed_files.union(set(previous) - set(current)):
+            for entry in (previous.get(filename), current.get(filename)):
+                if entry is None:
+                    continue
+                for item in entry['items']:
+                    if 'name' in item:
+                        dirty_templates.add((item['meta']['object_type'], item['name']))
+
+        affected_items = set()
+        if dirty_templates:
+            children = {}
+            for filename, entry in current.items():
+                if filename in changed_files:
+                    continue
+                for item in entry['items']:
+                    if 'use' not in item:
+                        continue
+                    object_type = item['meta']['object_type']
+                    for parent_name in item['use'].split(','):
+                        children.setdefault((object_type, parent_name), []).append(item)
+            templates = list(dirty_templates)
+            while templates:
+                for child in children.pop(templates.pop(), []):
+                    if id(child) in affected_items:
+                        continue
+                    affected_items.add(id(child))
+                    if 'name' in child:
+                        templates.append((child['meta']['object_type'], child['name']))
+
+        items_to_resolve = set()
+        seen_files = set()
+        for filename in cfg_files:
+            entry = current[filename]
+            if filename in seen_files:
+                # Same file was listed twice, nagios would read it twice, so we do too
+                items = [self._get_pristine_copy(i) for i in entry['items']]
+                items_to_resolve.update(map(id, items))
+            elif filename in changed_files:
+                items = entry['items']
+                items_to_resolve.update(map(id, items))
+            else:
+                items = []
+                for item in entry['items']:
+                    if id(item) in affected_items:
+                        item = self._get_pristine_copy(item)
+                        items_to_resolve.add(id(item))
+                    items.append(item)
+                entry['items'] = items
+            seen_files.add(filename)
+            self.pre_object_list += items
+
+        self._parsed_files = current
+        self._dirty_files = set()
+        return items_to_resolve
+
+    def _parse_files(self, filenames, stamps=None):
+        """ Parse every file in filenames, possibly in parallel (see self.parallel)
+
+        Args:
+
+            filenames: list of object configuration files to parse
+
+            stamps: dict of filename -> (mtime, size). If provided, items are
+            converted to compact items as they are parsed (see :py:meth:`_get_compact_items`)
+
+        Returns:
+
+            dict of filename -> (items, errors) where items is the list
+            returned by :py:meth:`parse_file` and errors is a list of any
+            ParserError that came up while parsing the file.
+        """
+        result = {}
+        # Worker processes would not see changes that are pending in a transaction
+        if (self.parallel and self.parallel > 1 and len(filenames) > 1 and not self._pending_writes and
+                self._can_parse_in_workers()):
+            pool = multiprocessing.Pool(
+                processes=self.parallel,
+                initializer=_init_parse_worker,
+                initargs=(self.cfg_file, self.strict),
+            )
+            try:
+                parsed = pool.imap(_parse_file_in_worker, filenames)
+                for filename, (items, errors) in itertools.izip(filenames, parsed):
+                    if stamps is not None:
+                        items = self._get_compact_items(filename, stamps[filename], items)
+                    result[filename] = (items, errors)
+            finally:
+                pool.close()
+                pool.join()
+            return result
+
+        for filename in filenames:
+            errors_before = len(self.errors)
+            if stamps is not None:
+                items = self._parse_file_compact(filename, stamps[filename])
+            else:
+                items = self.parse_file(filename)
+            result[filename] = (items, self.errors[errors_before:])
+            del self.errors[errors_before:]
+        return result
+
+    def _can_parse_in_workers(self):
+        """ Returns True if worker processes would read and parse files the same way we do
+
+        Workers use a plain Config, so they would skip open(), parse_file()
+        or parse_string() of a subclass (like SshConfig) or of this instance.
+        """
+        for name in ('open', 'parse_file', 'parse_string'):
+            if name in self.__dict__:
+                return False
+            if getattr(type(self), name).im_func is not getattr(Config, name).im_func:
+                return False
+        return True
+
+    def _parse_file_compact(self, filename, stamp):
+        """ Same as :py:meth:`parse_file`, except items are returned as compact items
+
+        Items are converted one at a time as they are parsed, so there are
+        never more than one file's worth of items in memory as dicts.
+
+        Args:
+
+            filename: Path to the file to parse (string)
+
+            stamp: (mtime, size) of filename. If None, raw definitions are
+            kept in memory.
+        """
+        try:
+            raw_string = self.open(filename, 'rb').read()
+        except IOError:
+            t, e = sys.exc_info()[:2]
+            parser_error = ParserError(e.strerror)
+            parser_error.filename = e.filename
+            self.errors.append(parser_error)
+            return []
+        source = None
+        if stamp is not None:
+            source = CompactSource(self, filename, stamp)
+        return [CompactItem.from_item(item, source) for item in self._iter_string(raw_string, filename=filename)]
+
+    def _get_compact_items(self, filename, stamp, items):
+        """ Returns items, converted to :py:class:`pynag.Parsers.compact.CompactItem`
+
+        Args:
+
+            filename: Object configuration file that items were parsed from
+
+            stamp: (mtime, size) of filename when it was parsed. If None,
+            raw definitions are kept in memory.
+
+            items: List of items as returned by :py:meth:`parse_file`
+        """
+        source = None
+        if stamp is not None:
+            source = CompactSource(self, filename, stamp)
+        return [CompactItem.from_item(item, source) for item in items]
+
+    def _get_raw_definition(self, filename, stamp, line_start):
+        """ Returns raw_definition of the object definition on line_start in filename
+
+        This is how compact items get their raw_definition.
+
+        Args:
+
+            filename: Object configuration file to read
 
-        return original_item
+            stamp: (mtime, size) of filename when the definition was parsed
+
+            line_start: Line number where the object definition starts
+
+        Raises:
+
+            :py:class:`ParserError` if filename has changed since stamp
+        """
+        cache = self._raw_definition_cache
+        if cache is None or cache[0] != filename or cache[1] != stamp:
+            if self._get_file_stamp(filename) != stamp:
+                raise ParserError("Can not get raw definition from %s, it has changed since it was parsed" % filename)
+            raw_definitions = {}
+            errors_before = len(self.errors)
+            try:
+                raw_string = self.open(filename, 'rb').read()
+                for item in self._iter_string(raw_string, filename=filename):
+                    raw_definitions[item['meta']['line_start']] = item['meta']['raw_definition']
+            finally:
+                del self.errors[errors_before:]
+            cache = self._raw_definition_cache = (filename, stamp, raw_definitions)
+        return cache[2].get(line_start)
+
+    def _get_parse_cache_filename(self, filename):
+        """ Returns path to the file in self.cache_dir that caches parsed contents of filename """
+        if isinstance(filename, unicode):
+            # Same bytes as the name of the file on disk. The cache key has
+            # the filename too, so anything that cannot be encoded only
+            # makes the cache miss.
+            filename = filename.encode(sys.getfilesystemencoding() or 'utf-8', 'replace')
+        return os.path.join(self.cache_dir, hashlib.sha1(filename).hexdigest() + '.cache')
+
+    def _read_parse_cache(self, filename, stamp):
+        """ Returns parsed items of filename as stored in self.cache_dir
+
+        Args:
+
+            filename: Object configuration file that we want parsed items of
+
+            stamp: Current (mtime, size) of filename as returned by :py:meth:`_get_file_stamp`
+
+        Returns:
+
+            List of items like :py:meth:`parse_file` would return them, or
+            None if there is no valid cache entry for this version of filename.
+        """
+        if stamp is None:
+            return None
+        try:
+            fh = open(self._get_parse_cache_filename(filename), 'rb')
+            try:
+                cache_key, cached_items = marshal.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if cache_key != (pynag.__version__, filename, stamp[0], stamp[1]):
+            return None
+
+        # Items are stored without attributes, as they are the same as defined_attributes
+        items = []
+        for meta in cached_items:
+            item = meta['defined_attributes'].copy()
+            item['meta'] = meta
+            items.append(item)
+        return items
+
+    def _write_parse_cache(self, filename, stamp, items):
+        """ Stores parsed items of filename in self.cache_dir
+
+        Failure to write the cache is silently ignored.
+
+        Args:
+
+            filename: Object configuration file that was parsed
+
+            stamp: (mtime, size) of filename when it was parsed
+
+            items: List of items as returned by :py:meth:`parse_file`
+        """
+        if stamp is None:
+            return
+        cache_key = (pynag.__version__, filename, stamp[0], stamp[1])
+        cached_items = [item['meta'] for item in items]
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_filename = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        except (IOError, OSError):
+            return
+        try:
+            try:
+                os.write(fd, marshal.dumps((cache_key, cached_items)))
+            finally:
+                os.close(fd)
+            os.rename(tmp_filename, self._get_parse_cache_filename(filename))
+        except (IOError, OSError, ValueError):
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
 
     def _get_items_in_file(self, filename):
         """ Return all items in the given file
@@ -310,13 +948,22 @@ class Config(object):
             A list containing all the items in self.data that were defined in
             filename
         """
-        return_list = []
+        return list(self._get_filename_index().get(filename, []))
 
-        for k in self.data.keys():
-            for item in self[k]:
-                if item['meta']['filename'] == filename:
-                    return_list.append(item)
-        return return_list
+    def _get_filename_index(self):
+        """ Returns a dict of filename -> list of items that are defined in that file
+
+        The index is made from self.data the first time it is needed after
+        parse(), and :py:meth:`item_add`, :py:meth:`item_remove` and
+        :py:meth:`commit` keep it up to date.
+        """
+        if self._items_by_filename is None:
+            index = {}
+            for k in self.data.keys():
+                for item in self[k]:
+                    index.setdefault(item['meta']['filename'], []).append(item)
+            self._items_by_filename = index
+        return self._items_by_filename
 
     def get_new_item(self, object_type, filename):
         """ Returns an empty item with all necessary metadata
@@ -368,6 +1015,7 @@ class Config(object):
         for i in self.parse_file(filename):
             self.pre_object_list.append(i)
 
+    @instrumentation.instrumented('Config.parse_file', objects=len)
     def parse_file(self, filename):
         """ Parses a nagios object configuration file and returns lists of dictionaries.
 
@@ -384,6 +1032,7 @@ class Config(object):
         """
         try:
             raw_string = self.open(filename, 'rb').read()
+            instrumentation.count('Config.parse_file', bytes=len(raw_string))
             return self.parse_string(raw_string, filename=filename)
         except IOError:
             t, e = sys.exc_info()[:2]
@@ -392,6 +1041,53 @@ class Config(object):
             self.errors.append(parser_error)
             return []
 
+    def iter_definitions(self, files=None, object_types=None):
+        """ Iterate through object definitions one at a time
+
+        Unlike :py:meth:`parse` this does not keep anything around, and no
+        templates are applied. Only one file is held in memory at a time, so
+        memory usage does not grow with the size of the configuration.
+
+        Args:
+
+            files (optional): List of files to read. Defaults to every
+            object configuration file in nagios.cfg (:py:meth:`get_cfg_files`)
+
+            object_types (optional): List of object types (i.e. ['host', 'service']).
+            If provided, definitions of any other type are skipped.
+
+        Yields:
+
+            Dictionaries, like the ones returned by :py:meth:`parse_string`
+
+        Raises:
+
+            :py:class:`ParserError`
+
+        Example:
+
+            >>> c = Config(cfg_file="/etc/nagios/nagios.cfg")
+            >>> for host in c.iter_definitions(object_types=['host']): # doctest: +SKIP
+            ...     print host.get('host_name')
+        """
+        if files is None:
+            if not self.maincfg_values:
+                self.parse_maincfg()
+            files = self.get_cfg_files()
+        if object_types is not None:
+            object_types = set(object_types)
+        for filename in files:
+            try:
+                raw_string = self.open(filename, 'rb').read()
+            except IOError:
+                t, e = sys.exc_info()[:2]
+                parser_error = ParserError(e.strerror)
+                parser_error.filename = e.filename
+                self.errors.append(parser_error)
+                continue
+            for item in self._iter_string(raw_string, filename=filename, object_types=object_types):
+                yield item
+
     def parse_string(self, string, filename='None'):
         """ Parses a string, and returns all object definitions in that string
 
@@ -421,15 +1117,46 @@ class Config(object):
             :py:class:`ParserError`
 
         """
-        append = ""
+        return list(self._iter_string(string, filename=filename))
+
+    def _iter_string(self, string, filename='None', object_types=None):
+        """ Generator that yields object definitions in string one at a time
+
+        This is where the actual work of :py:meth:`parse_string` is done.
+
+        Args:
+
+            string: A string containing one or more object definitions
+
+            filename (optional): If filename is provided, it will be referenced
+            when raising exceptions
+
+            object_types (optional): A set of object types. If provided, any
+            definition of another type is skipped without building an item
+
+        Yields:
+
+            Dictionaries, that look like self.data
+
+        Raises:
+
+            :py:class:`ParserError`
+        """
+        # This loop runs once for every line of every config file, so per-line
+        # work is kept to a minimum: lookups are bound to locals, special cases
+        # for service and timeperiod attributes are decided once per definition
+        # and lines of skipped definitions are not tokenized.
+        beginning_of_object = self.__beginning_of_object
+        get_new_item = self.get_new_item
+        strict = self.strict
+        append = None
         current = None
-        in_definition = {}
+        defined_attributes = None
+        object_type = None
+        in_definition = False
         tmp_buffer = []
-        result = []
-
-        for sequence_no, line in enumerate(string.splitlines(False)):
-            line_num = sequence_no + 1
 
+        for line_num, line in enumerate(string.splitlines(False), 1):
             # If previous line ended with backslash, treat this line as a
             # continuation of previous line
             if append:
@@ -438,110 +1165,94 @@ class Config(object):
 
             # Cleanup and line skips
             line = line.strip()
-            if line == "":
+            if not line:
                 continue
-            if line[0] == "#" or line[0] == ';':
+            first = line[0]
+            if first == '#' or first == ';':
                 continue
 
             # If this line ends with a backslash, continue directly to next line
-            if line.endswith('\\'):
+            if line[-1] == '\\':
                 append = line.strip('\\')
                 continue
 
-            if line.startswith('}'):  # end of object definition
-
+            if first == '}':  # end of object definition
                 if not in_definition:
                     p = ParserError("Unexpected '}' found outside object definition in line %s" % line_num)
                     p.filename = filename
                     p.line_start = line_num
                     raise p
-
-                in_definition = None
-                current['meta']['line_end'] = line_num
+                in_definition = False
+                if current is None:  # end of a definition we were told to skip
+                    continue
                 # Looks to me like nagios ignores everything after the } so why shouldn't we ?
-                rest = line.split("}", 1)[1]
-
+                meta = current['meta']
+                meta['line_end'] = line_num
                 tmp_buffer.append(line)
                 try:
-                    current['meta']['raw_definition'] = '\n'.join(tmp_buffer)
+                    meta['raw_definition'] = '\n'.join(tmp_buffer)
                 except Exception:
                     raise ParserError("Encountered Unexpected end of object definition in file '%s'." % filename)
-                result.append(current)
-
-                # Destroy the Nagios Object
+                yield current
                 current = None
                 continue
 
-            elif line.startswith('define'):  # beginning of object definition
+            if first == 'd' and line.startswith('define'):  # beginning of object definition
                 if in_definition:
-                    msg = "Unexpected 'define' in {filename} on line {line_num}. was expecting '}}'."
-                    msg = msg.format(**locals())
+                    msg = "Unexpected 'define' in {0} on line {1}. was expecting '}}'.".format(filename, line_num)
                     self.errors.append(ParserError(msg, item=current))
-
-                m = self.__beginning_of_object.search(line)
-
-                tmp_buffer = [line]
-                object_type = m.groups()[0]
-                if self.strict and object_type not in self.object_type_keys.keys():
+                # Looks to me like nagios ignores everything after the {, so why shouldn't we ?
+                object_type = beginning_of_object.search(line).groups()[0]
+                if strict and object_type not in self.object_type_keys:
                     raise ParserError(
                         "Don't know any object definition of type '%s'. it is not in a list of known object definitions." % object_type)
-                current = self.get_new_item(object_type, filename)
-                current['meta']['line_start'] = line_num
-
-                # Start off an object
                 in_definition = True
-
-                # Looks to me like nagios ignores everything after the {, so why shouldn't we ?
-                rest = m.groups()[1]
+                if object_types is not None and object_type not in object_types:
+                    # Skip this definition without building an item for it
+                    current = None
+                    continue
+                tmp_buffer = [line]
+                current = get_new_item(object_type, filename)
+                current['meta']['line_start'] = line_num
+                defined_attributes = current['meta']['defined_attributes']
                 continue
-            else:  # In the middle of an object definition
-                tmp_buffer.append('    ' + line)
 
-            # save whatever's left in the buffer for the next iteration
             if not in_definition:
+                # save whatever's left in the buffer for the next iteration
                 append = line
                 continue
+            if current is None:
+                continue
 
             # this is an attribute inside an object definition
-            if in_definition:
-                #(key, value) = line.split(None, 1)
-                tmp = line.split(None, 1)
-                if len(tmp) > 1:
-                    (key, value) = tmp
-                else:
-                    key = tmp[0]
-                    value = ""
-
+            tmp_buffer.append('    ' + line)
+            tmp = line.split(None, 1)
+            if len(tmp) > 1:
+                key, value = tmp
                 # Strip out in-line comments
-                if value.find(";") != -1:
-                    value = value.split(";", 1)[0]
-
-                # Clean info
-                key = key.strip()
+                if ';' in value:
+                    value = value.split(';', 1)[0]
                 value = value.strip()
+            else:
+                key = line
+                value = ''
 
-                # Rename some old values that may be in the configuration
-                # This can probably be removed in the future to increase performance
-                if (current['meta']['object_type'] == 'service') and key == 'description':
+            # Rename some old values that may be in the configuration
+            if object_type == 'service':
+                if key == 'description':
                     key = 'service_description'
-
-                # Special hack for timeperiods as they are not consistent with other objects
-                # We will treat whole line as a key with an empty value
-                if (current['meta']['object_type'] == 'timeperiod') and key not in ('timeperiod_name', 'alias'):
-                    key = line
-                    value = ''
-                current[key] = value
-                current['meta']['defined_attributes'][key] = value
-            # Something is wrong in the config
-            else:
-                raise ParserError("Error: Unexpected token in file '%s'" % filename)
+            # Special hack for timeperiods as they are not consistent with other objects
+            # We will treat whole line as a key with an empty value
+            elif object_type == 'timeperiod' and key != 'timeperiod_name' and key != 'alias':
+                key = line
+                value = ''
+            current[key] = value
+            defined_attributes[key] = value
 
         # Something is wrong in the config
         if in_definition:
             raise ParserError("Error: Unexpected EOF in file '%s'" % filename)
 
-        return result
-
     def _locate_item(self, item):
         """ This is a helper function for anyone who wishes to modify objects.
 
@@ -562,28 +1273,68 @@ class Config(object):
             :py:class:`ValueError` if object was not found in "filename"
 
         """
+        return self._locate_definition(item)[:4]
+
+    def _locate_definition(self, item):
+        """ Same as :py:meth:`_locate_item`, but also returns position of item in definition index of its file
+
+        Returns: (tuple)
+
+            (everything_before, object_definition, everything_after, filename, position)
+        """
         if "filename" in item['meta']:
             filename = item['meta']['filename']
         else:
             raise ValueError("item does not have a filename")
 
-        # Look for our item, store it as my_item
-        for i in self.parse_file(filename):
-            if self.compareObjects(item, i):
-                my_item = i
+        # Performance tweak, only compare objects that have the same value
+        # of one of the attributes that compareObjects() would compare. An
+        # attribute that names the object is most likely to be unique.
+        probe = None
+        defined_attributes = item['meta']['defined_attributes']
+        object_type = item['meta'].get('object_type')
+        for k in ['%s_name' % object_type, 'name', 'service_description', 'host_name'] + defined_attributes.keys():
+            if k in defined_attributes and k not in ('meta', 'check_interval'):
+                probe = k
+                probe_value = str(item[k])
                 break
+
+        # Look for our item in the index first, if it is not there the
+        # index might be out of date so we parse the file again
+        for reread in (False, True):
+            definitions = self._get_definition_index(filename, reread=reread)
+            # Objects are often modified many times in a row, or in the
+            # order they are in the file. Look where the last one was first.
+            last_position = self._definition_index.get(filename, {}).get('last_position', 0)
+            positions = itertools.chain((last_position, last_position + 1), xrange(len(definitions)))
+            for position in positions:
+                if position >= len(definitions):
+                    continue
+                definition = definitions[position]
+                if probe is not None and (probe not in definition or str(definition[probe]) != probe_value):
+                    continue
+                if self.compareObjects(item, definition):
+                    break
+            else:
+                continue
+            break
         else:
             raise ValueError("We could not find object in %s\n%s" % (filename, item))
+        if filename in self._definition_index:
+            self._definition_index[filename]['last_position'] = position
 
         # Caller of this method expects to be returned
         # several lists that describe the lines in our file.
         # The splitting logic starts here.
-        my_file = self.open(filename)
-        all_lines = my_file.readlines()
-        my_file.close()
+        if filename in self._pending_writes:
+            all_lines = self._pending_writes[filename][1]
+        else:
+            my_file = self.open(filename)
+            all_lines = my_file.readlines()
+            my_file.close()
 
-        start = my_item['meta']['line_start'] - 1
-        end = my_item['meta']['line_end']
+        start = definition['meta']['line_start'] - 1
+        end = definition['meta']['line_end']
         everything_before = all_lines[:start]
         object_definition = all_lines[start:end]
         everything_after = all_lines[end:]
@@ -591,7 +1342,100 @@ class Config(object):
         # If there happen to be line continuations in the object we will edit
         # We will remove them from object_definition
         object_definition = self._clean_backslashes(object_definition)
-        return everything_before, object_definition, everything_after, filename
+        return everything_before, object_definition, everything_after, filename, position
+
+    def _get_definition_index(self, filename, reread=False):
+        """ Returns line ranges and defined attributes of every object definition in filename
+
+        The index is made from items of the last parse() if filename has not
+        changed since then, otherwise filename is parsed. The index is kept up
+        to date when :py:meth:`_modify_object` changes filename, so modifying
+        many objects in the same file only parses it once.
+
+        Args:
+
+            filename: Object configuration file
+
+            reread: If True, parse filename even if the index is up to date
+
+        Returns:
+
+            List of items that only have their defined attributes, and
+            line_start and line_end in their meta, in the same order as they
+            are defined in filename.
+        """
+        stamp = self._get_file_stamp(filename)
+        index = self._definition_index.get(filename)
+        if not reread and index is not None and stamp is not None and index['stamp'] == stamp:
+            return index['definitions']
+
+        entry = self._parsed_files.get(filename)
+        if not reread and entry is not None and stamp is not None \
+                and entry['stamp'] == stamp and filename not in self._dirty_files:
+            items = entry['items']
+        else:
+            items = self.parse_file(filename)
+        definitions = [self._get_definition(i) for i in items]
+        if stamp is not None:
+            self._definition_index[filename] = {'stamp': stamp, 'definitions': definitions}
+        return definitions
+
+    def _get_definition(self, item, line_offset=0):
+        """ Returns an entry for the definition index of item's file, see :py:meth:`_get_definition_index` """
+        meta = item['meta']
+        definition = dict(meta['defined_attributes'])
+        definition['meta'] = {
+            'defined_attributes': dict(meta['defined_attributes']),
+            'line_start': meta['line_start'] + line_offset,
+            'line_end': meta['line_end'] + line_offset,
+        }
+        return definition
+
+    def _update_definition_index(self, filename, position, everything_before, object_definition):
+        """ Update definition index of filename, after the definition at position has been replaced
+
+        Only the new object definition is parsed, line ranges of definitions
+        that come after it are moved. If the new definition can not be
+        parsed cleanly, the index is dropped and filename will be parsed
+        again next time it is needed.
+
+        Args:
+
+            filename: File that has been written to
+
+            position: Position in the index of the definition that was replaced
+
+            everything_before: Lines that are in filename before the new definition
+
+            object_definition: Lines of the new definition (list of strings)
+        """
+        index = self._definition_index.pop(filename, None)
+        if index is None:
+            return
+        new_string = ''.join(object_definition)
+        errors_before = len(self.errors)
+        try:
+            new_items = list(self._iter_string(new_string, filename=filename))
+        finally:
+            errors = self.errors[errors_before:]
+            del self.errors[errors_before:]
+        if errors or len(new_items) > 1:
+            return
+        # Without a line break at the end, new definition and the next line are joined
+        if new_string and not new_string.endswith('\n') and position + 1 < len(index['definitions']):
+            return
+
+        definitions = index['definitions']
+        line_offset = len(everything_before)
+        line_difference = line_offset + new_string.count('\n') - definitions[position]['meta']['line_end']
+        if line_difference:
+            for definition in definitions[position + 1:]:
+                definition['meta']['line_start'] += line_difference
+                definition['meta']['line_end'] += line_difference
+        definitions[position:position + 1] = [self._get_definition(i, line_offset) for i in new_items]
+        index['stamp'] = self._get_file_stamp(filename)
+        if index['stamp'] is not None:
+            self._definition_index[filename] = index
 
     def _clean_backslashes(self, list_of_strings):
         """ Returns list_of_strings with all all strings joined that ended with backslashes
@@ -653,7 +1497,14 @@ class Config(object):
             raise ValueError("either field_name or new_item must be set")
         if '\n' in str(new_value):
             raise ValueError("Invalid character \\n used as an attribute value.")
-        everything_before, object_definition, everything_after, filename = self._locate_item(item)
+        # Model changes the item in self.data after it has been saved, so the
+        # next lookup by a changed key has to see the new value
+        if new_item:
+            self._items_by_key.pop(item['meta'].get('object_type'), None)
+        else:
+            self._forget_key_indexes(item['meta'].get('object_type'), field_name, new_field_name)
+        self._dependency_graph = None
+        everything_before, object_definition, everything_after, filename, position = self._locate_definition(item)
         if new_item is not None:
             # We have instruction on how to write new object, so we dont need to parse it
             object_definition = [new_item]
@@ -709,8 +1560,16 @@ class Config(object):
                     everything_before.pop()  # remove this line
             object_definition.insert(0, comment)
             # Here we overwrite the config-file, hoping not to ruin anything
-        str_buffer = "%s%s%s" % (''.join(everything_before), ''.join(object_definition), ''.join(everything_after))
-        self.write(filename, str_buffer)
+        if self._transaction_depth:
+            # Keep the file as a list of lines, so it does not have to be split again on next change
+            lines = ''.join(object_definition).splitlines(True)
+            if lines and not lines[-1].endswith('\n') and everything_after:
+                lines[-1] += everything_after.pop(0)
+            self._write_pending(filename, everything_before + lines + everything_after)
+        else:
+            str_buffer = "%s%s%s" % (''.join(everything_before), ''.join(object_definition), ''.join(everything_after))
+            self.write(filename, str_buffer)
+        self._update_definition_index(filename, position, everything_before, object_definition)
         return True
 
     def open(self, filename, *args, **kwargs):
@@ -718,15 +1577,31 @@ class Config(object):
 
         Simply calls global open(filename, *args, **kwargs) and passes all arguments
         as they are received. See global open() function for more details.
+
+        Inside a :py:meth:`transaction`, files that have pending changes are
+        read from memory.
         """
+        if filename in self._pending_writes:
+            mode = args[0] if args else kwargs.get('mode', 'r')
+            if mode in ('r', 'rb', 'rU', 'U'):
+                string = ''.join(self._pending_writes[filename][1])
+                if isinstance(string, unicode):
+                    return StringIO.StringIO(string)
+                return cStringIO.StringIO(string)
         return open(filename, *args, **kwargs)
 
     @pynag.Utils.synchronized(pynag.Utils.rlock)
     def write(self, filename, string):
-        """ Wrapper around open(filename).write()
+        """ Replaces contents of filename with string
+
+        The new contents are written to a temporary file which is then renamed
+        to filename, so readers see either the old or the new contents, never
+        a half written file. See :py:meth:`write_atomically` for when filename
+        is rewritten in place instead. If self.durable is True, the file and
+        its directory are synced to disk before this returns.
 
-        Writes string to filename and closes the file handler. File handler is
-        openned in `'w'` mode.
+        Inside a :py:meth:`transaction`, string is kept in memory and written
+        when the transaction ends.
 
         Args:
 
@@ -735,19 +1610,226 @@ class Config(object):
 
             string: String to be written to file. (string)
 
+        Returns:
+
+            Return code as returned by :py:meth:`os.write`, None inside a
+            transaction
+
+        """
+        if self._transaction_depth:
+            self._write_pending(filename, string.splitlines(True))
+            return None
+        self._dirty_files.add(filename)
+        return_code = self.write_atomically(filename, string)
+        self._is_dirty = True
+        return return_code
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Context manager that collects changes to configuration files, and writes them all at the end
+
+        Inside the transaction, every change made with :py:meth:`write`,
+        :py:meth:`item_add`, :py:meth:`item_edit_field` and friends is kept in
+        memory, and reading files that have changed returns the changed contents.
+        When the outermost transaction ends, every changed file is read and
+        written only once, and replaced atomically. If self.durable is True,
+        each file is synced to disk once, and each directory with changed
+        files once after all of them have been replaced.
+
+        If an exception is raised inside the transaction, all changes made
+        in it are discarded.
+
+        Example::
+
+            >>> c = Config(cfg_file="/etc/nagios/nagios.cfg")
+            >>> with c.transaction():  # doctest: +SKIP
+            ...     for host in c.data['all_host']:
+            ...         c.item_edit_field(host, 'notes', 'Managed by pynag')
+        """
+        pynag.Utils.rlock.acquire()
+        try:
+            self._transaction_depth += 1
+            try:
+                yield self
+            except:
+                self._transaction_depth -= 1
+                if not self._transaction_depth:
+                    self._discard_pending_writes()
+                raise
+            self._transaction_depth -= 1
+            if not self._transaction_depth:
+                self._write_pending_files()
+        finally:
+            pynag.Utils.rlock.release()
+
+    def _write_pending(self, filename, lines):
+        """ Keep lines as contents of filename, until the transaction ends """
+        self._dirty_files.add(filename)
+        self._number_of_pending_writes += 1
+        self._pending_writes[filename] = (('pending', self._number_of_pending_writes), lines)
+
+    def _write_pending_files(self):
+        """ Writes all changes made in a transaction to disk """
+        pending_writes = self._pending_writes
+        self._pending_writes = {}
+        if not pending_writes:
+            return
+        # Directories that new files have been renamed into, synced once at the end
+        directories = set()
+        try:
+            for filename in sorted(pending_writes):
+                pending_stamp, lines = pending_writes.pop(filename)
+                self.write_atomically(filename, ''.join(lines), sync_directory=False)
+                directories.add(os.path.dirname(os.path.realpath(filename)))
+                # Definition index is already up to date with the new contents
+                index = self._definition_index.get(filename)
+                if index is not None and index['stamp'] == pending_stamp:
+                    index['stamp'] = self._get_file_stamp(filename)
+        finally:
+            # If one file could not be written, changes to the rest are lost
+            for filename in pending_writes:
+                self._definition_index.pop(filename, None)
+            self._is_dirty = True
+            if self.durable:
+                for directory in sorted(directories):
+                    self._sync_directory(directory)
+
+    def _discard_pending_writes(self):
+        """ Forget all changes made in a transaction """
+        for filename in self._pending_writes:
+            self._definition_index.pop(filename, None)
+        if self._pending_writes:
+            # Items in memory might have been changed already
+            self._is_dirty = True
+        self._pending_writes = {}
+
+    def write_atomically(self, filename, string, sync_directory=True):
+        """ Writes string to filename, readers of filename either see its old or new contents
+
+        The string is written to a temporary file in the same directory, which
+        is then renamed to filename. Mode, owner and group of filename are
+        kept, and if filename is a symlink, the file it points to is replaced.
+
+        Replacing filename would break its hardlinks, or take it away from its
+        owner if we may not give the temporary file to them. If we may not
+        create files in its directory, there is no temporary file to rename.
+        In those cases filename is rewritten in place, and readers might see
+        it half written.
+
+        string can also be an iterable of strings, which are written one at a
+        time.
+
+        If self.durable is True, the file is synced to disk before it is
+        renamed, and the directory after it is renamed unless sync_directory
+        is False. In that case the caller must sync the directory to make the
+        rename durable.
+
         Returns:
 
             Return code as returned by :py:meth:`os.write`
+        """
+        filename = os.path.realpath(filename)
+        directory, basename = os.path.split(filename)
+        try:
+            file_stat = self.stat(filename)
+            mode = stat.S_IMODE(file_stat.st_mode)
+        except (IOError, OSError):
+            file_stat = None
+            mode = new_file_mode
+        if file_stat is not None and file_stat.st_nlink > 1:
+            return self._write_in_place(filename, string)
+        try:
+            fd, tmp_filename = tempfile.mkstemp(dir=directory, prefix='.%s.' % basename, suffix='.tmp')
+        except (IOError, OSError):
+            # We may write to filename, but not make new files next to it
+            if file_stat is None:
+                raise
+            return self._write_in_place(filename, string)
+        try:
+            fh = os.fdopen(fd, 'w')
+            try:
+                replace = file_stat is None or self._copy_owner(fh.fileno(), file_stat)
+                if replace:
+                    return_code = self._write_to(fh, string)
+            finally:
+                fh.close()
+            if replace:
+                os.chmod(tmp_filename, mode)
+                self.rename(tmp_filename, filename)
+            else:
+                os.remove(tmp_filename)
+        except:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        if not replace:
+            return self._write_in_place(filename, string)
+        if self.durable and sync_directory:
+            self._sync_directory(directory)
+        return return_code
+
+    @staticmethod
+    def _copy_owner(fd, file_stat):
+        """ Gives the file open as fd the owner and group in file_stat
+
+        Returns:
 
+            False if we are not allowed to, otherwise True
+        """
+        fd_stat = os.fstat(fd)
+        if (fd_stat.st_uid, fd_stat.st_gid) == (file_stat.st_uid, file_stat.st_gid):
+            return True
+        try:
+            os.fchown(fd, file_stat.st_uid, file_stat.st_gid)
+        except OSError:
+            return False
+        return True
+
+    def _write_in_place(self, filename, string):
+        """ Rewrites filename with string, for when it cannot be replaced by another file
+
+        Returns:
+
+            Return code as returned by :py:meth:`os.write`
         """
         fh = self.open(filename, 'w')
-        return_code = fh.write(string)
+        try:
+            return self._write_to(fh, string)
+        finally:
+            fh.close()
+
+    def _write_to(self, fh, string):
+        """ Writes string (or an iterable of strings) to fh, synced to disk if self.durable is True
+
+        Returns:
+
+            Return code as returned by :py:meth:`os.write`
+        """
+        if isinstance(string, basestring):
+            return_code = fh.write(string)
+        else:
+            return_code = fh.writelines(string)
         fh.flush()
-        # os.fsync(fh)
-        fh.close()
-        self._is_dirty = True
+        if self.durable:
+            self.fsync(fh.fileno())
         return return_code
 
+    def _sync_directory(self, directory):
+        """ Syncs directory to disk, so files renamed into it stay renamed after a crash """
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            # Directories cannot be opened on some platforms
+            return
+        try:
+            try:
+                self.fsync(fd)
+            except OSError:
+                # Not every file system can sync a directory
+                pass
+        finally:
+            os.close(fd)
+
     def item_rewrite(self, item, str_new_item):
         """ Completely rewrites item with string provided.
 
@@ -802,7 +1884,13 @@ class Config(object):
 
             :py:class:`IOError` if save fails
         """
-        return self._modify_object(item=item, new_item="")
+        result = self._modify_object(item=item, new_item="")
+        items_in_file = self._get_filename_index().get(item['meta']['filename'], [])
+        for i, existing_item in enumerate(items_in_file):
+            if existing_item is item:
+                del items_in_file[i]
+                break
+        return result
 
     def item_edit_field(self, item, field_name, new_value):
         """ Modifies one field of a (currently existing) object.
@@ -911,10 +1999,27 @@ class Config(object):
         if not self.isdir(dirname):
             os.makedirs(dirname)
 
+        self._get_filename_index().setdefault(filename, []).append(item)
         str_buffer = self.print_conf(item)
+        if self._transaction_depth:
+            if filename in self._pending_writes:
+                str_buffer = ''.join(self._pending_writes[filename][1]) + str_buffer
+            elif self.exists(filename):
+                str_buffer = self.open(filename).read() + str_buffer
+            self.write(filename, str_buffer)
+            return True
+        is_new_file = not self.exists(filename)
         fh = self.open(filename, 'a')
-        fh.write(str_buffer)
-        fh.close()
+        try:
+            fh.write(str_buffer)
+            if self.durable:
+                fh.flush()
+                self.fsync(fh.fileno())
+        finally:
+            fh.close()
+        if self.durable and is_new_file:
+            self._sync_directory(dirname)
+        self._dirty_files.add(filename)
         return True
 
     def edit_object(self, item, field_name, new_value):
@@ -979,6 +2084,121 @@ class Config(object):
             return False
         return True
 
+    def diff(self, other):
+        """ Compares every object in this configuration with the ones in other
+
+        Objects are matched by object type and key (see :py:attr:`diff_keys`),
+        and compared by their defined and effective attributes. Where they
+        are defined does not matter. Differences are found one object type
+        at a time, so the first ones are available before all objects have
+        been compared.
+
+        Args:
+
+            other (Config): Another parsed configuration, i.e. a newer one.
+
+        Yields:
+
+            A dict for every object that was added, removed or changed::
+
+                {
+                    'change': 'added', 'removed' or 'changed',
+                    'object_type': 'host',
+                    'key': The key the objects were matched with, i.e. 'localhost',
+                    'old': The item in self, None if it was added,
+                    'new': The item in other, None if it was removed,
+                    # (old value, new value) of every attribute that is different,
+                    # None for attributes that are not there
+                    'defined_attributes': {'address': ('127.0.0.1', '127.0.0.2')},
+                    'effective_attributes': {'address': ('127.0.0.1', '127.0.0.2')},
+                }
+        """
+        for data_key in sorted(set(self.data).union(other.data)):
+            object_type = data_key[len('all_'):]
+            old_items = self.data.get(data_key, ())
+            new_items = other.data.get(data_key, ())
+
+            old_keys, new_items_by_key = self._get_diff_index(object_type, old_items, new_items)
+            for key, old_item in itertools.izip(old_keys, old_items):
+                candidates = new_items_by_key.get(key)
+                if not candidates:
+                    yield self._get_difference('removed', object_type, key, old_item, None)
+                    continue
+                new_item = candidates.pop(0)
+                if not candidates:
+                    del new_items_by_key[key]
+                if new_item is old_item:
+                    continue
+                old_meta = old_item['meta']
+                new_meta = new_item['meta']
+                if old_meta['defined_attributes'] == new_meta['defined_attributes'] and \
+                        old_meta['inherited_attributes'] == new_meta['inherited_attributes']:
+                    continue
+                difference = self._get_difference('changed', object_type, key, old_item, new_item)
+                if difference['defined_attributes'] or difference['effective_attributes']:
+                    yield difference
+
+            # Whatever is left has been added
+            if new_items_by_key:
+                unmatched = set()
+                for items in new_items_by_key.itervalues():
+                    unmatched.update(id(i) for i in items)
+                for new_item in new_items:
+                    if id(new_item) in unmatched:
+                        key = self._get_diff_key(object_type, new_item)
+                        yield self._get_difference('added', object_type, key, None, new_item)
+
+    def _get_diff_index(self, object_type, old_items, new_items):
+        """ Returns a list of keys of old_items, and a dict of key -> list of new items with that key
+
+        Keys are the ones from :py:meth:`_get_diff_key`
+        """
+        get_key = self._get_diff_key
+        old_keys = [get_key(object_type, item) for item in old_items]
+        new_items_by_key = {}
+        for item in new_items:
+            key = get_key(object_type, item)
+            if key in new_items_by_key:
+                new_items_by_key[key].append(item)
+            else:
+                new_items_by_key[key] = [item]
+        return old_keys, new_items_by_key
+
+    def _get_diff_key(self, object_type, item):
+        """ Returns what identifies item when configurations are compared with diff() """
+        if item.get('register') == '0':
+            return 'template', item.get('name')
+        key_attributes = self.diff_keys.get(object_type)
+        if key_attributes is None:
+            return item.get('%s_name' % object_type)
+        return tuple([item.get(i) for i in key_attributes])
+
+    def _get_difference(self, change, object_type, key, old_item, new_item):
+        """ Returns a dict like diff() yields """
+        difference = {
+            'change': change,
+            'object_type': object_type,
+            'key': key,
+            'old': old_item,
+            'new': new_item,
+            'defined_attributes': {},
+            'effective_attributes': {},
+        }
+        if old_item is None or new_item is None:
+            return difference
+        for attributes, old, new in (
+                ('defined_attributes', old_item['meta']['defined_attributes'], new_item['meta']['defined_attributes']),
+                ('effective_attributes', old_item, new_item)):
+            changes = difference[attributes]
+            for k in set(old.keys()).union(new.keys()):
+                if k == 'meta':
+                    continue
+                old_value = old.get(k)
+                new_value = new.get(k)
+                if old_value != new_value:
+                    changes[k] = (old_value, new_value)
+        return difference
+
     def edit_service(self, target_host, service_description, field_name, new_value):
         """ Edit a service's attributes
 
@@ -1038,7 +2258,7 @@ class Config(object):
 
             :py:class:`ParserError` if item is not a dict
         """
-        if not isinstance(item, dict):
+        if not isinstance(item, (dict, CompactItem)):
             raise ParserError("%s is not a dictionary\n" % item)
             # return []
         if not key in item:
@@ -1151,10 +2371,94 @@ class Config(object):
 
         """
         object_key = self._get_key(object_type, user_key)
-        for item in self.data['all_%s' % object_type]:
-            if item.get(object_key, None) == object_name:
-                return item
-        return None
+        return self._get_key_index(object_type, object_key).get(object_name, None)
+
+    def _get_key_index(self, object_type, key):
+        """ Returns a dict of key value -> first item in self.data with that value
+
+        Indexes are made from self.data the first time they are needed, and
+        made again if the list of items changes. Edits made with
+        :py:meth:`item_edit_field` and friends drop the indexes they affect.
+
+        Args:
+
+            object_type (str): Type of the items, i.e. 'host'
+
+            key (str or tuple): Attribute to index by. If a tuple of
+            attributes, the index is keyed by a tuple of their values.
+
+        Raises:
+
+            :py:class:`KeyError` if there are no items of object_type
+        """
+        items = self.data['all_%s' % object_type]
+        indexes = self._items_by_key.setdefault(object_type, {})
+        cached = indexes.get(key)
+        if cached is not None and cached[0] is items and cached[1] == len(items):
+            return cached[2]
+        index = {}
+        if isinstance(key, tuple):
+            for item in items:
+                value = tuple([item.get(k, None) for k in key])
+                if value not in index:
+                    index[value] = item
+        else:
+            for item in items:
+                value = item.get(key, None)
+                if value not in index:
+                    index[value] = item
+        indexes[key] = (items, len(items), index)
+        return index
+
+    def _forget_key_indexes(self, object_type, *field_names):
+        """ Drop indexes of object_type that are keyed by any of field_names """
+        indexes = self._items_by_key.get(object_type)
+        if not indexes:
+            return
+        for key in indexes.keys():
+            if isinstance(key, tuple):
+                fields = key
+            else:
+                fields = (key,)
+            for field_name in field_names:
+                if field_name in fields:
+                    del indexes[key]
+                    break
+
+    def get_impacted_objects(self, item, attribute_names=None):
+        """ Returns every item whose effective configuration can change when item is edited
+
+        This includes items that inherit the edited attributes from item (and
+        items that inherit them from those), items that refer to item by name
+        (i.e. in check_command, contact_groups or host_name) and groups whose
+        members change. If item is a group, its members are included.
+
+        The dependencies are found the first time they are needed, and again
+        after any change to the configuration. This is for callers that want
+        to know what an edit affects, pynag itself does not use it to decide
+        what to reload: parse(), pynag.Model.ObjectFetcher.reload_cache() and
+        pynag.Model.precompiled have their own, coarser, ways of finding out.
+
+        Args:
+
+            item: An item in self.data
+
+            attribute_names: List of attributes of item that are edited. If
+            None, item may have changed in any way (or been removed).
+
+        Returns:
+
+            List of items, without item itself.
+        """
+        return self._get_dependency_graph().get_impacted_objects(item, attribute_names)
+
+    def _get_dependency_graph(self):
+        """ Returns a :py:class:`pynag.Parsers.dependencies.DependencyGraph` of every item in self.data """
+        if self._dependency_graph is None:
+            always_use_regex = self.get_cfg_value('use_true_regexp_matching') == '1'
+            items = itertools.chain.from_iterable(self.data.values())
+            self._dependency_graph = DependencyGraph(items, always_use_regex=always_use_regex)
+        return self._dependency_graph
 
     def get_host(self, object_name, user_key=None):
         """ Return a host object
@@ -1326,10 +2630,8 @@ class Config(object):
             The item found to match all the criterias.
 
         """
-        for item in self.data['all_service']:
-            if item.get('service_description') == service_description and item.get('host_name') == target_host:
-                return item
-        return None
+        index = self._get_key_index('service', ('host_name', 'service_description'))
+        return index.get((target_host, service_description), None)
 
     def _append_use(self, source_item, name):
         """ Append attributes to source_item that are inherited via 'use' attribute'
@@ -1370,12 +2672,19 @@ class Config(object):
                         source_item[k] = v
         return source_item
 
-    def _post_parse(self):
+    @instrumentation.instrumented('Config._post_parse')
+    def _post_parse(self, items_to_resolve=None):
         """ Creates a few optimization tweaks and easy access lists in self.data
 
         Creates :py:attr:`config.item_apply_cache` and fills the all_object
         item lists in self.data.
 
+        Args:
+
+            items_to_resolve: set of id() of items in self.pre_object_list
+            that need templates applied. Other items are assumed to be already
+            resolved by a previous parse. If None, resolve every item.
+
         """
         self.item_list = None
         self.item_apply_cache = {}  # This is performance tweak used by _apply_template
@@ -1385,9 +2694,37 @@ class Config(object):
             if not object_type in self.item_apply_cache:
                 self.item_apply_cache[object_type] = {}
                 # Tweak ends
-            if "use" in raw_item:
-                raw_item = self._apply_template(raw_item)
-            self.post_object_list.append(raw_item)
+            # Templates that were resolved during previous parse, do not need to be resolved again
+            if items_to_resolve is not None and id(raw_item) not in items_to_resolve and 'name' in raw_item:
+                self.item_apply_cache[object_type][self._get_template_cache_key(raw_item)] = raw_item
+
+        errors_before = len(self.errors)
+        if items_to_resolve is None:
+            self.post_object_list += self._resolve_templates(self.pre_object_list)
+        else:
+            for raw_item in self.pre_object_list:
+                if id(raw_item) in items_to_resolve:
+                    raw_item = self._apply_template(raw_item)
+                self.post_object_list.append(raw_item)
+
+        # Keep track of which item every template error belongs to, so errors
+        # of items that were not resolved this time are still reported
+        previous_errors = self._template_errors
+        self._template_errors = {}
+        new_errors = self.errors[errors_before:]
+        del self.errors[errors_before:]
+        for error in new_errors:
+            item_id = id(getattr(error, 'item', None))
+            self._template_errors.setdefault(item_id, []).append(error)
+        orphan_errors = self._template_errors.copy()
+        for raw_item in self.pre_object_list:
+            item_id = id(raw_item)
+            if items_to_resolve is not None and item_id not in items_to_resolve and item_id in previous_errors:
+                self._template_errors[item_id] = previous_errors[item_id]
+            self.errors += self._template_errors.get(item_id, [])
+            orphan_errors.pop(item_id, None)
+        for errors in orphan_errors.values():
+            self.errors += errors
             # Add the items to the class lists.
         for list_item in self.post_object_list:
             type_list_name = "all_%s" % list_item['meta']['object_type']
@@ -1395,41 +2732,32 @@ class Config(object):
                 self.data[type_list_name] = []
 
             self.data[type_list_name].append(list_item)
+        instrumentation.count('Config._post_parse', objects=len(self.post_object_list))
 
     def commit(self):
-        """ Write any changes that have been made to it's appropriate file """
-        # Loops through ALL items
-        for k in self.data.keys():
-            for item in self[k]:
+        """ Write any changes that have been made to it's appropriate file
 
-                # If the object needs committing, commit it!
+        Every file that has items with needs_commit set is written once, with
+        all the items in that file that are not flagged with delete_me.
+        """
+        index = self._get_filename_index()
+        filenames = set()
+        for filename, items in index.items():
+            for item in items[:]:
+                if item['meta']['filename'] != filename:
+                    # Item has been moved to another file
+                    items.remove(item)
+                    index.setdefault(item['meta']['filename'], []).append(item)
+                    filenames.add(filename)
                 if item['meta']['needs_commit']:
-                    # Create file contents as an empty string
-                    file_contents = ""
-
-                    # find any other items that may share this config file
-                    extra_items = self._get_items_in_file(item['meta']['filename'])
-                    if len(extra_items) > 0:
-                        for commit_item in extra_items:
-                            # Ignore files that are already set to be deleted:w
-                            if commit_item['meta']['delete_me']:
-                                continue
-                                # Make sure we aren't adding this thing twice
-                            if item != commit_item:
-                                file_contents += self.print_conf(commit_item)
-
-                    # This is the actual item that needs commiting
-                    if not item['meta']['delete_me']:
-                        file_contents += self.print_conf(item)
-
-                    # Write the file
-                    filename = item['meta']['filename']
-                    self.write(filename, file_contents)
-
-                    # Recreate the item entry without the commit flag
-                    self.data[k].remove(item)
-                    item['meta']['needs_commit'] = None
-                    self.data[k].append(item)
+                    filenames.add(item['meta']['filename'])
+
+        for filename in sorted(filenames):
+            items = index.get(filename, [])
+            file_contents = ''.join([self.print_conf(item) for item in items if not item['meta']['delete_me']])
+            self.write(filename, file_contents)
+            for item in items:
+                item['meta']['needs_commit'] = None
 
     def flag_all_commit(self):
         """ Flag every item in the configuration to be committed
@@ -1630,6 +2958,9 @@ class Config(object):
         if self._is_dirty is True:
             return True
 
+        if self._watcher is not None:
+            return self._watcher.has_changed()
+
         # If we get here, we check the timestamps of the configs
         new_timestamps = self.get_timestamps()
         if len(new_timestamps) != len(self.timestamps):
@@ -1639,6 +2970,41 @@ class Config(object):
                 return True
         return False
 
+    def get_changed_files(self):
+        """ Returns a set of configuration files that have changed since last parse()
+
+        Files that have been added or removed count as changed. parse() uses
+        this to avoid looking at files that a watcher saw no changes to.
+
+        Returns:
+
+            set of filenames, or None if it is not known which files changed
+        """
+        if self._watcher is not None:
+            return self._watcher.get_changed_files()
+        return watcher.PollingWatcher(self).get_changed_files()
+
+    def _start_watcher(self):
+        """ Start watching the files found by parse() for changes, see needs_reparse()
+
+        The new watcher is started before the previous one is stopped, so
+        that no change can fall between them.
+
+        Returns:
+
+            set of files that the previous watcher saw change, or None if
+            there was no previous inotify watcher or it does not know which
+            files changed.
+        """
+        previous_watcher = self._watcher
+        self._watcher = watcher.get_watcher(self)
+        changed_files = None
+        if isinstance(previous_watcher, watcher.InotifyWatcher):
+            changed_files = previous_watcher.get_changed_files()
+        if previous_watcher is not None:
+            previous_watcher.close()
+        return changed_files
+
     @pynag.Utils.synchronized(pynag.Utils.rlock)
     def parse_maincfg(self):
         """ Parses your main configuration (nagios.cfg) and stores it as key/value pairs in self.maincfg_values
@@ -1665,6 +3031,10 @@ class Config(object):
         then moving on to your object configuration files (as defined via
         cfg_file and cfg_dir) and and your resource_file as well.
 
+        If parse() has been run before, only files that have changed since
+        then are re-read, and templates are only re-applied to objects that
+        are defined in those files or inherit from templates in them.
+
         Returns:
 
           None
@@ -1691,13 +3061,18 @@ class Config(object):
             t, e = sys.exc_info()[:2]
             self.errors.append(str(e))
 
+        # Start watching before taking timestamps and reading the files, so
+        # that nothing that changes meanwhile goes unnoticed
+        changed_files = None
+        if self.watch:
+            changed_files = self._start_watcher()
+
         self.timestamps = self.get_timestamps()
 
-        # This loads everything into
-        for cfg_file in self.cfg_files:
-            self._load_file(cfg_file)
+        # This loads everything into self.pre_object_list
+        items_to_resolve = self._load_files(self.cfg_files, changed_files)
 
-        self._post_parse()
+        self._post_parse(items_to_resolve)
 
         self._is_dirty = False
 
@@ -1727,20 +3102,29 @@ class Config(object):
 
     def get_timestamps(self):
         """ Returns hash map of all nagios related files and their timestamps"""
-        files = {}
-        files[self.cfg_file] = None
-        for k, v in self.maincfg_values:
-            if k in ('resource_file', 'lock_file', 'object_cache_file'):
-                files[v] = None
-        for i in self.get_cfg_files():
-            files[i] = None
+        files = dict.fromkeys(self._get_timestamp_files(self.get_cfg_files()))
+        # get_cfg_files() already looked at most of the files, no need to
+        # stat them again
+        cfg_file_timestamps = self._cfg_file_timestamps
         # Now lets lets get timestamp of every file
         for k, v in files.items():
+            if k in cfg_file_timestamps:
+                files[k] = cfg_file_timestamps[k]
+                continue
             if not self.isfile(k):
                 continue
             files[k] = self.stat(k).st_mtime
         return files
 
+    def _get_timestamp_files(self, cfg_files):
+        """ Returns a list of nagios.cfg, cfg_files and every other file that get_timestamps() looks at """
+        files = [self.cfg_file]
+        for k, v in self.maincfg_values:
+            if k in ('resource_file', 'lock_file', 'object_cache_file'):
+                files.append(v)
+        files.extend(cfg_files)
+        return files
+
     def isfile(self, *args, **kwargs):
         """ Wrapper around os.path.isfile """
         return os.path.isfile(*args, **kwargs)
@@ -1765,6 +3149,14 @@ class Config(object):
         """ Wrapper around os.remove """
         return os.remove(*args, **kwargs)
 
+    def rename(self, *args, **kwargs):
+        """ Wrapper around os.rename """
+        return os.rename(*args, **kwargs)
+
+    def fsync(self, *args, **kwargs):
+        """ Wrapper around os.fsync """
+        return os.fsync(*args, **kwargs)
+
     def access(self, *args, **kwargs):
         """ Wrapper around os.access """
         return os.access(*args, **kwargs)
@@ -1774,6 +3166,16 @@ class Config(object):
 
         return os.listdir(*args, **kwargs)
 
+    def scandir(self, path):
+        """ Wrapper around os.scandir
+
+        Falls back to os.listdir() and os.lstat() if neither os.scandir nor
+        the scandir module are available.
+        """
+        if scandir is not None:
+            return scandir(path)
+        return [_DirEntry(path, name) for name in os.listdir(path)]
+
     def exists(self, *args, **kwargs):
         """ Wrapper around os.path.exists """
         return os.path.exists(*args, **kwargs)
@@ -1794,69 +3196,62 @@ class Config(object):
         # Do the initial parsing
         self.parse()
 
-        # First, cycle through the hosts, and append hostgroup information
-        index = 0
+        # Items of files that did not change are reused by parse(), forget
+        # what the previous extended_parse() added to them
         for host in self.data['all_host']:
-            if host.get("register", None) == "0":
+            host['meta'].pop('hostgroup_list', None)
+            host['meta'].pop('service_list', None)
+
+        # Members of every hostgroup, by hostgroup_name. First definition
+        # wins, just like in get_hostgroup()
+        hostgroup_members = {}
+        for hostgroup in self.data['all_hostgroup']:
+            if not "hostgroup_name" in hostgroup:
+                continue
+            if hostgroup['hostgroup_name'] not in hostgroup_members:
+                hostgroup_members[hostgroup['hostgroup_name']] = self._get_list(hostgroup, 'members')
+
+        # Expand service membership, and make a list of services for every host
+        services_by_host = {}
+        for service in self.data['all_service']:
+            active_hosts = self._get_active_hosts(service, hostgroup_members)
+            service['meta']['service_members'] = active_hosts
+            if service.get("register", None) == "0":
+                continue
+            if not "service_description" in service:
                 continue
+            service_description = service['service_description']
+            for host_name in set(active_hosts):
+                services_by_host.setdefault(host_name, []).append(service_description)
+
+        # Cycle through the hosts, and append hostgroup and service information
+        hosts_by_name = {}
+        for host in self.data['all_host']:
             if not "host_name" in host:
                 continue
-            if not "hostgroup_list" in self.data['all_host'][index]['meta']:
-                self.data['all_host'][index]['meta']['hostgroup_list'] = []
+            hosts_by_name.setdefault(host['host_name'], []).append(host)
+            if host.get("register", None) == "0":
+                continue
+            hostgroup_list = host['meta']['hostgroup_list'] = []
 
             # Append any hostgroups that are directly listed in the host definition
             if "hostgroups" in host:
                 for hostgroup_name in self._get_list(host, 'hostgroups'):
-                    if not "hostgroup_list" in self.data['all_host'][index]['meta']:
-                        self.data['all_host'][index]['meta']['hostgroup_list'] = []
-                    if hostgroup_name not in self.data['all_host'][index]['meta']['hostgroup_list']:
-                        self.data['all_host'][index]['meta']['hostgroup_list'].append(hostgroup_name)
+                    if hostgroup_name not in hostgroup_list:
+                        hostgroup_list.append(hostgroup_name)
 
             # Append any services which reference this host
-            service_list = []
-            for service in self.data['all_service']:
-                if service.get("register", None) == "0":
-                    continue
-                if not "service_description" in service:
-                    continue
-                if host['host_name'] in self._get_active_hosts(service):
-                    service_list.append(service['service_description'])
-            self.data['all_host'][index]['meta']['service_list'] = service_list
-
-            # Increment count
-            index += 1
+            host['meta']['service_list'] = list(services_by_host.get(host['host_name'], []))
 
         # Loop through all hostgroups, appending them to their respective hosts
         for hostgroup in self.data['all_hostgroup']:
             for member in self._get_list(hostgroup, 'members'):
-                index = 0
-                for host in self.data['all_host']:
-                    if not "host_name" in host:
-                        continue
-
-                    # Skip members that do not match
-                    if host['host_name'] == member:
-
-                        # Create the meta var if it doesn' exist
-                        if not "hostgroup_list" in self.data['all_host'][index]['meta']:
-                            self.data['all_host'][index]['meta']['hostgroup_list'] = []
-
-                        if hostgroup['hostgroup_name'] not in self.data['all_host'][index]['meta']['hostgroup_list']:
-                            self.data['all_host'][index]['meta']['hostgroup_list'].append(hostgroup['hostgroup_name'])
-
-                    # Increment count
-                    index += 1
-
-        # Expand service membership
-        index = 0
-        for service in self.data['all_service']:
-            # Find a list of hosts to negate from the final list
-            self.data['all_service'][index]['meta']['service_members'] = self._get_active_hosts(service)
+                for host in hosts_by_name.get(member, []):
+                    hostgroup_list = host['meta'].setdefault('hostgroup_list', [])
+                    if hostgroup['hostgroup_name'] not in hostgroup_list:
+                        hostgroup_list.append(hostgroup['hostgroup_name'])
 
-            # Increment count
-            index += 1
-
-    def _get_active_hosts(self, item):
+    def _get_active_hosts(self, item, hostgroup_members=None):
         """ Given an object, return a list of active hosts.
 
         This will exclude hosts that are negated with a "!"
@@ -1865,25 +3260,35 @@ class Config(object):
 
             item: Item to obtain active hosts from.
 
+            hostgroup_members (dict): If set, members of hostgroups are looked
+            up here (by hostgroup_name) before using get_hostgroup()
+
         Returns:
 
             List of all the active hosts for `item`
         """
+        if hostgroup_members is None:
+            hostgroup_members = {}
+
+        def get_members(hostgroup_name):
+            if hostgroup_name in hostgroup_members:
+                return hostgroup_members[hostgroup_name]
+            return self._get_list(self.get_hostgroup(hostgroup_name), 'members')
+
         # First, generate the negation list
-        negate_hosts = []
+        negate_hosts = set()
 
         # Hostgroups
         if "hostgroup_name" in item:
             for hostgroup_name in self._get_list(item, 'hostgroup_name'):
                 if hostgroup_name[0] == "!":
-                    hostgroup_obj = self.get_hostgroup(hostgroup_name[1:])
-                    negate_hosts.extend(self._get_list(hostgroup_obj, 'members'))
+                    negate_hosts.update(get_members(hostgroup_name[1:]))
 
         # Host Names
         if "host_name" in item:
             for host_name in self._get_list(item, 'host_name'):
                 if host_name[0] == "!":
-                    negate_hosts.append(host_name[1:])
+                    negate_hosts.add(host_name[1:])
 
         # Now get hosts that are actually listed
         active_hosts = []
@@ -1892,7 +3297,7 @@ class Config(object):
         if "hostgroup_name" in item:
             for hostgroup_name in self._get_list(item, 'hostgroup_name'):
                 if hostgroup_name[0] != "!":
-                    active_hosts.extend(self._get_list(self.get_hostgroup(hostgroup_name), 'members'))
+                    active_hosts.extend(get_members(hostgroup_name))
 
         # Host Names
         if "host_name" in item:
@@ -1944,6 +3349,8 @@ class Config(object):
 
         """
         cfg_files = []
+        self._cfg_file_timestamps = timestamps = {}
+        self._cfg_dir_timestamps = {}
         for config_object, config_value in self.maincfg_values:
 
             # Add cfg_file objects to cfg file list
@@ -1955,32 +3362,81 @@ class Config(object):
             # Parse all files in a cfg directory
             if config_object == "cfg_dir":
                 config_value = self.abspath(config_value)
-                directories = []
-                raw_file_list = []
-                directories.append(config_value)
-                # Walk through every subdirectory and add to our list
-                while directories:
-                    current_directory = directories.pop(0)
-                    # Nagios doesnt care if cfg_dir exists or not, so why should we ?
-                    if not self.isdir(current_directory):
-                        continue
-                    for item in self.listdir(current_directory):
-                        # Append full path to file
-                        item = "%s" % (os.path.join(current_directory, item.strip()))
-                        if self.islink(item):
-                            item = os.readlink(item)
-                        if self.isdir(item):
-                            directories.append(item)
-                        if raw_file_list.count(item) < 1:
-                            raw_file_list.append(item)
-                for raw_file in raw_file_list:
-                    if raw_file.endswith('.cfg'):
-                        if self.exists(raw_file) and not self.isdir(raw_file):
-                            # Nagios doesnt care if cfg_file exists or not, so we will not throws errors
-                            cfg_files.append(raw_file)
+                for filename, mtime in self._walk_cfg_dir(config_value, self._cfg_dir_timestamps):
+                    # Nagios doesnt care if cfg_file exists or not, so we will not throws errors
+                    timestamps[filename] = mtime
+                    cfg_files.append(filename)
 
         return cfg_files
 
+    def _walk_cfg_dir(self, directory, directory_timestamps=None):
+        """ Find every .cfg file in directory and all of its subdirectories
+
+        Directories are walked breadth first, and every file is only looked
+        at once. Symbolic links are followed, relative ones are resolved
+        from the directory they are in. Every directory is walked only once,
+        so symlink loops are harmless.
+
+        Args:
+
+            directory (str): Full path to a cfg_dir
+
+            directory_timestamps (dict): If set, mtime of every directory
+            that was walked is stored here
+
+        Returns:
+
+            List of (filename, mtime) tuples, in the order they were found.
+        """
+        result = []
+        seen = set()
+        visited_directories = set()
+        directories = [directory]
+        # Nagios doesnt care if cfg_dir exists or not, so why should we ?
+        try:
+            directory_stat = self.stat(directory)
+        except OSError:
+            return result
+        if not stat.S_ISDIR(directory_stat.st_mode):
+            return result
+        visited_directories.add((directory_stat.st_dev, directory_stat.st_ino))
+        if directory_timestamps is not None:
+            directory_timestamps[directory] = directory_stat.st_mtime
+        for current_directory in directories:
+            try:
+                entries = self.scandir(current_directory)
+            except OSError:
+                continue
+            for entry in entries:
+                name = entry.name.strip()
+                item = os.path.join(current_directory, name)
+                try:
+                    if entry.is_symlink():
+                        item = os.path.normpath(os.path.join(current_directory, self.readlink(item)))
+                        if item in seen:
+                            continue
+                        item_stat = self.stat(item)
+                    elif name != entry.name:
+                        item_stat = self.stat(item)
+                    else:
+                        item_stat = entry.stat()
+                except OSError:
+                    # Broken symlinks and files that disappeared under us
+                    continue
+                if item in seen:
+                    continue
+                seen.add(item)
+                if stat.S_ISDIR(item_stat.st_mode):
+                    key = (item_stat.st_dev, item_stat.st_ino)
+                    if key not in visited_directories:
+                        visited_directories.add(key)
+                        directories.append(item)
+                        if directory_timestamps is not None:
+                            directory_timestamps[item] = item_stat.st_mtime
+                elif item.endswith('.cfg'):
+                    result.append((item, item_stat.st_mtime))
+        return result
+
     def abspath(self, path):
         """ Return the absolute path of a given relative path.
 
@@ -2053,6 +3509,26 @@ class Config(object):
 
     def __setitem__(self, key, item):
         self.data[key] = item
+        self._items_by_filename = None
+        self._items_by_key = {}
+        self._dependency_graph = None
 
     def __getitem__(self, key):
         return self.data[key]
+
+
+# Config instance used by worker processes of Config._parse_files()
+_worker_config = None
+
+
+def _init_parse_worker(cfg_file, strict):
+    """ Initializes a worker process that is used by Config._parse_files() """
+    global _worker_config
+    _worker_config = Config(cfg_file=cfg_file, strict=strict)
+
+
+def _parse_file_in_worker(filename):
+    """ Parses one file in a worker process. Returns a (items, errors) tuple """
+    _worker_config.errors = []
+    items = _worker_config.parse_file(filename)
+    return items, _worker_config.errors
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""Which objects depend on which other objects in a parsed configuration.
+
+An object depends on another if editing the other one can change its
+effective configuration. A host, for example, depends on the templates it
+uses, its check_command, check_period and contact groups. A hostgroup
+depends on hosts that make themselves members of it with "hostgroups", and
+those hosts depend on the definition of the hostgroup.
+
+See :py:meth:`pynag.Parsers.config_parser.Config.get_impacted_objects`.
+"""
+
+import re
+from collections import defaultdict
+
+import pynag.Utils
+
+# Attributes that refer to other objects by name, and the object type they refer to
+reference_attributes = {
+    'check_command': 'command',
+    'event_handler': 'command',
+    'host_notification_commands': 'command',
+    'service_notification_commands': 'command',
+    'check_period': 'timeperiod',
+    'notification_period': 'timeperiod',
+    'host_notification_period': 'timeperiod',
+    'service_notification_period': 'timeperiod',
+    'escalation_period': 'timeperiod',
+    'dependency_period': 'timeperiod',
+    'exclude': 'timeperiod',
+    'contacts': 'contact',
+    'contact_groups': 'contactgroup',
+    'host_name': 'host',
+    'dependent_host_name': 'host',
+    'hostgroup_name': 'hostgroup',
+    'dependent_hostgroup_name': 'hostgroup',
+}
+
+# Attributes that refer to commands, whose values may have arguments after a '!'
+command_attributes = ('check_command', 'event_handler', 'host_notification_commands', 'service_notification_commands')
+
+# groups[group_type] = (member_type, attribute of group with members,
+#                       attribute of group with subgroups, attribute of member with groups)
+groups = {
+    'hostgroup': ('host', 'members', 'hostgroup_members', 'hostgroups'),
+    'contactgroup': ('contact', 'members', 'contactgroup_members', 'contactgroups'),
+    'servicegroup': ('service', 'members', 'servicegroup_members', 'servicegroups'),
+}
+
+# The attribute of every member type that lists its groups
+_member_group_attributes = dict((v[0], (k, v[3])) for k, v in groups.items())
+
+
+def _is_regex(name, always_use_regex=False):
+    """ Returns True if name should be treated like a regular expression, same as pynag.Model does """
+    return always_use_regex or '*' in name or '?' in name or '+' in name or '\\.' in name
+
+
+class DependencyGraph(object):
+
+    """ A graph of dependencies between every item in a configuration
+
+    Items are identified by identity, so the graph is only valid until the
+    items or their attributes change.
+
+    Args:
+
+        items: Iterable of every parsed item, templates included
+
+        always_use_regex (bool): True if every object name is a regular
+        expression, like use_true_regexp_matching=1 in nagios.cfg
+    """
+
+    def __init__(self, items, always_use_regex=False):
+        self.always_use_regex = always_use_regex
+
+        # _items[id(item)] = (position, item)
+        self._items = {}
+
+        # All of the following are dicts of id(item) -> list of id() of other items
+
+        # Items that use item as a template
+        self._children = defaultdict(list)
+        # Items that refer to item by name in one of reference_attributes
+        self._referrers = defaultdict(list)
+        # Groups that item says it is a member of, i.e. with hostgroups
+        self._declared_groups = defaultdict(list)
+        # Groups that say item is a member, i.e. with members
+        self._listing_groups = defaultdict(list)
+        # Direct members of a group, no matter which one says so
+        self._members = defaultdict(list)
+        # Groups that a group is a member of, with *_members
+        self._supergroups = defaultdict(list)
+        # Groups that are members of a group, with *_members
+        self._subgroups = defaultdict(list)
+
+        # _names[object_type][name] = [item, ...]
+        self._names = defaultdict(lambda: defaultdict(list))
+
+        # _templates[object_type][name] = [item, ...]
+        self._templates = defaultdict(lambda: defaultdict(list))
+
+        # _services[(host_name, service_description)] = [service, ...]
+        self._services = defaultdict(list)
+
+        self._regex_cache = {}
+        self._fields_cache = {}
+
+        items = list(items)
+        for position, item in enumerate(items):
+            self._items[id(item)] = (position, item)
+            self._add_names(item)
+        for item in items:
+            self._add_dependencies(item)
+
+    def _add_names(self, item):
+        object_type = item['meta']['object_type']
+        name = item.get('name')
+        if name is not None:
+            self._templates[object_type][name].append(item)
+        if object_type == 'service':
+            service_description = item.get('service_description')
+            for host_name in self._get_fields(item.get('host_name')):
+                self._services[(host_name, service_description)].append(item)
+        else:
+            name = item.get('%s_name' % object_type)
+            if name is not None:
+                self._names[object_type][name].append(item)
+
+    def _add_dependencies(self, item):
+        object_type = item['meta']['object_type']
+        item_id = id(item)
+
+        for parent in self._get_fields(item.get('use')):
+            for i in self._templates[object_type].get(parent, ()):
+                self._children[id(i)].append(item_id)
+
+        for attribute_name, value in item.iteritems():
+            target_type = reference_attributes.get(attribute_name)
+            if target_type is None or target_type == object_type:
+                # host_name of a host is its own name
+                continue
+            names = self._get_fields(value)
+            if attribute_name in command_attributes:
+                names = [i.split('!', 1)[0] for i in names]
+            for i in self._find(target_type, names):
+                self._referrers[id(i)].append(item_id)
+
+        if object_type in _member_group_attributes:
+            group_type, attribute_name = _member_group_attributes[object_type]
+            for group in self._find(group_type, self._get_fields(item.get(attribute_name))):
+                self._declared_groups[item_id].append(id(group))
+                self._members[id(group)].append(item_id)
+
+        if object_type in groups:
+            member_type, members_attribute, subgroups_attribute, groups_attribute = groups[object_type]
+            members = self._get_fields(item.get(members_attribute))
+            if member_type == 'service':
+                members = self._find_services(members)
+            else:
+                members = self._find(member_type, members)
+            for member in members:
+                self._listing_groups[id(member)].append(item_id)
+                self._members[item_id].append(id(member))
+            for subgroup in self._find(object_type, self._get_fields(item.get(subgroups_attribute))):
+                self._supergroups[id(subgroup)].append(item_id)
+                self._subgroups[item_id].append(id(subgroup))
+
+    def _get_fields(self, value):
+        """ Returns a list of names in a comma seperated attribute value, without any operator """
+        if not value:
+            return []
+        # The same values, like contact_groups of hosts, tend to be repeated a lot
+        fields = self._fields_cache.get(value)
+        if fields is None:
+            fields = []
+            for i in pynag.Utils.AttributeList(value).fields:
+                i = i.strip().lstrip('!')
+                if i:
+                    fields.append(i)
+            self._fields_cache[value] = fields
+        return fields
+
+    def _find(self, object_type, names):
+        """ Returns a list of items of object_type that any of names refer to """
+        items_by_name = self._names[object_type]
+        result = []
+        for name in names:
+            if name in items_by_name:
+                result += items_by_name[name]
+            elif name == '*':
+                for items in items_by_name.values():
+                    result += items
+            elif _is_regex(name, self.always_use_regex):
+                for i in self._match(name, items_by_name):
+                    result += items_by_name[i]
+        return result
+
+    def _match(self, regex, names):
+        if regex not in self._regex_cache:
+            try:
+                self._regex_cache[regex] = re.compile(regex).search
+            except re.error:
+                self._regex_cache[regex] = lambda name: False
+        search = self._regex_cache[regex]
+        return [name for name in names if search(name)]
+
+    def _find_services(self, members):
+        """ Returns a list of services in servicegroup members, i.e. ['host1', 'service1', 'host2', 'service2'] """
+        result = []
+        for host_name, service_description in zip(members[::2], members[1::2]):
+            result += self._services.get((host_name, service_description), ())
+        return result
+
+    def get_impacted_objects(self, item, attribute_names=None):
+        """ Returns every item whose effective configuration can change when item is edited
+
+        Changes are followed attribute by attribute. A child of a template
+        is only impacted by attributes it does not define itself, and a
+        group is only impacted when something changes who its members are.
+
+        Args:
+
+            item: A parsed item, one of the items the graph was made from
+
+            attribute_names: List of attributes of item that are edited. If
+            None, item may have changed in any way (or been removed).
+
+        Returns:
+
+            List of items, in the same order as they were given to the
+            graph. item itself is not included.
+        """
+        item_id = id(item)
+        if item_id not in self._items:
+            return []
+        if attribute_names is not None:
+            attribute_names = frozenset(attribute_names)
+
+        # changes[id(item)] = attributes whose effective value changes. None means
+        # any of them for item itself, and any attribute that they do not define
+        # themselves for others. An empty set means that they are impacted
+        # through their relations to other items.
+        changes = {item_id: attribute_names}
+        unchecked = [item_id]
+
+        def impact(i, attribute_names):
+            if i not in changes:
+                changes[i] = attribute_names
+            elif changes[i] is None:
+                return
+            elif attribute_names is None:
+                changes[i] = None
+            elif attribute_names - changes[i]:
+                changes[i] = changes[i] | attribute_names
+            else:
+                return
+            unchecked.append(i)
+
+        members = frozenset(['members'])
+        while unchecked:
+            i = unchecked.pop()
+            attribute_names = changes[i]
+            if attribute_names is not None and not attribute_names:
+                continue
+            position, current = self._items[i]
+            object_type = current['meta']['object_type']
+            if attribute_names is None and i != item_id:
+                defined_attributes = current['meta']['defined_attributes']
+                is_changed = lambda attribute_name: attribute_name not in defined_attributes
+            elif attribute_names is None:
+                is_changed = lambda attribute_name: True
+            else:
+                is_changed = attribute_names.__contains__
+
+            for child in self._children.get(i, ()):
+                if attribute_names is None:
+                    impact(child, None)
+                else:
+                    defined_attributes = self._items[child][1]['meta']['defined_attributes']
+                    inherited = frozenset(k for k in attribute_names if k not in defined_attributes)
+                    if inherited:
+                        impact(child, inherited)
+
+            for referrer in self._referrers.get(i, ()):
+                impact(referrer, frozenset())
+
+            key_attributes = ('%s_name' % object_type, 'service_description', 'register')
+            renamed = any(is_changed(k) for k in key_attributes)
+            if object_type in _member_group_attributes:
+                group_type, groups_attribute = _member_group_attributes[object_type]
+                if renamed or is_changed(groups_attribute):
+                    for group in self._declared_groups.get(i, ()):
+                        impact(group, members)
+                if renamed:
+                    for group in self._listing_groups.get(i, ()):
+                        impact(group, members)
+
+            if object_type in groups:
+                member_type, members_attribute, subgroups_attribute, groups_attribute = groups[object_type]
+                if renamed or is_changed(members_attribute) or is_changed(subgroups_attribute):
+                    for group in self._supergroups.get(i, ()):
+                        impact(group, members)
+                    if i == item_id:
+                        # Everything in the group, and its subgroups, may be
+                        # in different groups now
+                        for member in self._get_all_members(i):
+                            impact(member, frozenset())
+
+        del changes[item_id]
+        result = sorted(self._items[i] for i in changes)
+        return [i for position, i in result]
+
+    def _get_all_members(self, group_id):
+        """ Returns a set of id() of every member of a group and its subgroups """
+        result = set()
+        checked_groups = set()
+        unchecked_groups = [group_id]
+        while unchecked_groups:
+            i = unchecked_groups.pop()
+            if i in checked_groups:
+                continue
+            checked_groups.add(i)
+            result.update(self._members.get(i, ()))
+            unchecked_groups += self._subgroups.get(i, ())
+        return result
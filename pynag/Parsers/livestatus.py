@@ -8,6 +8,7 @@ import time
 import pynag.Parsers.errors
 import pynag.Parsers.main
 import pynag.Utils.paths
+from pynag.Utils import instrumentation
 
 # TODO remove this and raise proper exceptions
 from pynag.Parsers.errors import ParserError
@@ -803,6 +804,7 @@ class Livestatus(object):
             msg = "%s while connecting to '%s'. Make sure nagios is running and mk_livestatus loaded."
             raise ParserError(msg % (e, self.livestatus_socket_path))
 
+    @instrumentation.instrumented('Livestatus.write', bytes=len)
     def write(self, livestatus_query):
         """ Send a raw livestatus query to livestatus socket.
 
@@ -934,6 +936,7 @@ class Livestatus(object):
             result.append(current_row)
         return result
 
+    @instrumentation.instrumented('Livestatus.query', objects=len)
     def query(self, query, *args, **kwargs):
         """ Performs LQL queries on the livestatus socket.
 
@@ -7,6 +7,7 @@ import time
 
 import pynag.Parsers.main
 import pynag.Utils.states
+from pynag.Utils import instrumentation
 
 
 class LogFiles(object):
@@ -198,6 +199,7 @@ class LogFiles(object):
             result.append(line)
         return result
 
+    @instrumentation.instrumented('LogFiles._parse_log_file', objects=len)
     def _parse_log_file(self, filename=None):
         """ Parses one particular nagios logfile into arrays of dicts.
 
@@ -1,14 +1,186 @@
 # -*- coding: utf-8 -*-
 """Module for parsing and filtering object_cache files."""
 
+import re
+import sys
+
+import pynag.Utils
 from pynag.Parsers import config_parser
+from pynag.Parsers.errors import ParserError
 
 
 class ObjectCache(config_parser.Config):
 
-    """ Loads the configuration as it appears in objects.cache file """
+    """ Loads the configuration as it appears in objects.cache file
+
+    Nagios writes every object to objects.cache when it starts, with all
+    templates already applied. This makes it a lot faster to load than the
+    configuration files themselves, but it is read-only.
+    """
+
+    # A complete object definition, as nagios writes them
+    __object_definition = re.compile(
+        r"^define[ \t]+(\w+)[ \t]*\{[^\n]*\n"
+        r"((?:(?![ \t]*\}[ \t]*\n)[^\n]*\n)*)"
+        r"[ \t]*\}[ \t]*\n", re.M)
+
+    # One attribute line of an object definition, with a value
+    __attribute = re.compile(r"[ \t]*(\S+)[ \t]+([^\n]*)\n")
+
+    # How much of objects.cache is read at a time
+    chunk_size = 1024 * 1024
 
     def get_cfg_files(self):
+        """ Returns a list with the object_cache_file from nagios.cfg
+
+        Raises:
+
+            :py:class:`ParserError` if nagios.cfg has no object_cache_file
+        """
         for k, v in self.maincfg_values:
             if k == 'object_cache_file':
                 return [v]
+        raise ParserError("No object_cache_file in %s" % self.cfg_file)
+
+    @pynag.Utils.synchronized(pynag.Utils.rlock)
+    def parse(self):
+        """ Load every object definition in objects.cache into self.data
+
+        Objects in objects.cache have no templates, so no templates are
+        applied. Items do not have raw_definition or line numbers in their
+        meta information.
+        """
+        self.reset()
+
+        self.parse_maincfg()
+
+        self.cfg_files = self.get_cfg_files()
+
+        try:
+            self._resource_values = self.get_resources()
+        except IOError:
+            t, e = sys.exc_info()[:2]
+            self.errors.append(str(e))
+
+        if self.watch:
+            self._start_watcher()
+
+        self.timestamps = self.get_timestamps()
+
+        data = self.data
+        for filename in self.cfg_files:
+            for item in self.iter_object_cache(filename):
+                type_list_name = "all_%s" % item['meta']['object_type']
+                if type_list_name not in data:
+                    data[type_list_name] = []
+                data[type_list_name].append(item)
+                self.post_object_list.append(item)
+        self.pre_object_list = self.post_object_list
+
+        self._is_dirty = False
+
+    def iter_object_cache(self, filename, object_types=None):
+        """ Iterate through object definitions in an objects.cache file, one at a time
+
+        Objects.cache is written by nagios, so unlike :py:meth:`parse_file`
+        this does not handle line continuations or anything else that only
+        people write. The file is read a chunk at a time.
+
+        Args:
+
+            filename (str): Path to objects.cache
+
+            object_types (optional): List of object types (i.e. ['host', 'service']).
+            If provided, definitions of any other type are skipped.
+
+        Yields:
+
+            Items (dicts) like the ones in self.data
+        """
+        try:
+            fh = self.open(filename, 'rb')
+        except IOError:
+            t, e = sys.exc_info()[:2]
+            parser_error = ParserError(e.strerror)
+            parser_error.filename = e.filename
+            self.errors.append(parser_error)
+            return
+        if object_types is not None:
+            object_types = set(object_types)
+        try:
+            remainder = ''
+            chunk = True
+            while chunk:
+                chunk = fh.read(self.chunk_size)
+                if chunk:
+                    string = remainder + chunk
+                else:
+                    string = remainder + '\n'
+                end = 0
+                for match in self.__object_definition.finditer(string):
+                    end = match.end()
+                    object_type, body = match.groups()
+                    if object_types is not None and object_type not in object_types:
+                        continue
+                    attributes = self._get_attributes(object_type, body)
+                    item = attributes.copy()
+                    item['meta'] = {
+                        'object_type': object_type,
+                        'filename': filename,
+                        'template_fields': [],
+                        'needs_commit': None,
+                        'delete_me': None,
+                        'defined_attributes': attributes,
+                        'inherited_attributes': {},
+                    }
+                    yield item
+                remainder = string[end:]
+        finally:
+            fh.close()
+
+    @staticmethod
+    def _get_attributes(object_type, body):
+        """ Returns a dict with the attributes in body of an object definition """
+        # Common case, every line is a key and a value
+        plain = ';' not in body and ' \n' not in body and '\t\n' not in body and '\r' not in body
+        if plain and object_type != 'timeperiod':
+            attributes = ObjectCache.__attribute.findall(body)
+            if len(attributes) == body.count('\n'):
+                attributes = dict(attributes)
+                if object_type != 'service' or 'description' not in attributes:
+                    return attributes
+
+        # Same special cases as in Config.parse_string()
+        attributes = {}
+        for line in body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            key_value = line.split(None, 1)
+            if len(key_value) == 2:
+                key, value = key_value
+                if ';' in value:
+                    value = value.split(';', 1)[0].strip()
+            else:
+                key = line
+                value = ''
+            if object_type == 'service':
+                if key == 'description':
+                    key = 'service_description'
+            elif object_type == 'timeperiod' and key != 'timeperiod_name' and key != 'alias':
+                key = line
+                value = ''
+            attributes[key] = value
+        return attributes
+
+    def commit(self):
+        """ objects.cache is read-only, this raises :py:class:`ParserError` """
+        raise ParserError("objects.cache is read-only, make changes to the configuration files instead")
+
+    def item_add(self, item, filename):
+        """ objects.cache is read-only, this raises :py:class:`ParserError` """
+        raise ParserError("Objects cannot be added to objects.cache")
+
+    def _modify_object(self, item, *args, **kwargs):
+        """ objects.cache is read-only, this raises :py:class:`ParserError` """
+        raise ParserError("Objects in objects.cache cannot be changed")
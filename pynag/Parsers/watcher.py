@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""Notice changes to nagios configuration files without looking at every file.
+
+:py:meth:`pynag.Parsers.config_parser.Config.needs_reparse` normally walks
+every cfg_dir and stats every configuration file. With a watcher that is
+only done when parse() is called. On Linux, the kernel tells us (via inotify)
+when something changes, elsewhere we fall back to comparing timestamps.
+
+Usage::
+
+    config = Config(cfg_file="/etc/nagios/nagios.cfg", watch=True)
+"""
+
+import errno
+import os
+import struct
+import sys
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+IN_NONBLOCK = 0x00000800
+
+# Everything that might change the contents or the list of configuration files
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+# Events after which we cannot tell which files have changed
+UNKNOWN_CHANGES = IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT | IN_Q_OVERFLOW | IN_IGNORED
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_event_header = struct.Struct('iIII')
+
+_libc = None
+
+
+def _get_libc():
+    """ Returns libc with the inotify functions, raises OSError if there is none """
+    global _libc
+    if _libc is None:
+        if ctypes is None:
+            raise OSError(errno.ENOSYS, "inotify is not available without ctypes")
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        _libc = libc
+    return _libc
+
+
+class Inotify(object):
+
+    """ Thin wrapper around the inotify API of the linux kernel """
+
+    def __init__(self):
+        self._libc = _get_libc()
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise_errno()
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """ Start watching path, returns a watch descriptor
+
+        Watching the same file or directory twice returns the same watch
+        descriptor.
+        """
+        if isinstance(path, unicode):
+            path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+        wd = self._libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            self._raise_errno(path)
+        return wd
+
+    def read_events(self):
+        """ Returns a list of (wd, mask, name) for every event waiting to be read
+
+        Never blocks, returns an empty list if nothing has happened.
+        """
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except OSError:
+                t, e = sys.exc_info()[:2]
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.EAGAIN:
+                    return events
+                raise
+            position = 0
+            while position < len(buf):
+                wd, mask, cookie, length = _event_header.unpack_from(buf, position)
+                position += _event_header.size
+                name = buf[position:position + length].rstrip('\0')
+                position += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        """ Stop watching everything """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _raise_errno(self, filename=None):
+        error = ctypes.get_errno()
+        if filename is None:
+            raise OSError(error, os.strerror(error))
+        raise OSError(error, os.strerror(error), filename)
+
+
+class PollingWatcher(object):
+
+    """ Finds changed files by comparing their timestamps with those of last parse()
+
+    This works everywhere, but every check walks every cfg_dir and stats every
+    file.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+    def has_changed(self):
+        """ Returns True if anything has changed since last parse() """
+        return bool(self.get_changed_files())
+
+    def get_changed_files(self):
+        """ Returns a set of files that were changed, added or removed since last parse() """
+        old_timestamps = self.config.timestamps
+        new_timestamps = self.config.get_timestamps()
+        changed_files = set()
+        for filename in set(old_timestamps).union(new_timestamps):
+            if old_timestamps.get(filename) != new_timestamps.get(filename):
+                changed_files.add(filename)
+        return changed_files
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+
+    """ Gets notified by the kernel when configuration files change
+
+    Watches the directories of nagios.cfg, config.cfg_files and the other
+    files in config.timestamps, and every directory in every cfg_dir, as of
+    last parse(). It is started before parse() takes timestamps, so it only
+    relies on config.cfg_files being up to date. Watching directories
+    instead of files means we also notice files that are replaced (like
+    :py:meth:`pynag.Parsers.config_parser.Config.write` does) or created.
+
+    Raises:
+
+        OSError if inotify is not available or a directory cannot be watched.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.inotify = Inotify()
+        # _watches[wd] = [is_cfg_dir, directory, {name: filename}]
+        self._watches = {}
+        self._changed = False
+        self._changed_files = set()
+        try:
+            self._watch()
+        except Exception:
+            self.close()
+            raise
+
+    def _watch(self):
+        config = self.config
+        for directory, mtime in config._cfg_dir_timestamps.items():
+            watch = self._add_watch(directory)
+            watch[0] = True
+            # Catch everything that happened after get_cfg_files() looked
+            # at the directory and before we started watching it
+            if os.stat(directory).st_mtime != mtime:
+                self._set_unknown_changes()
+
+        for filename in config._get_timestamp_files(config.cfg_files):
+            names = [os.path.abspath(filename)]
+            if os.path.islink(filename):
+                names.append(os.path.realpath(filename))
+            for name in names:
+                try:
+                    watch = self._add_watch(os.path.dirname(name))
+                except OSError:
+                    t, e = sys.exc_info()[:2]
+                    # Nagios is fine with missing lock_file or resource_file,
+                    # so are we
+                    if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                        continue
+                    raise
+                watch[2][os.path.basename(name)] = filename
+
+    def _add_watch(self, directory):
+        wd = self.inotify.add_watch(directory)
+        if wd not in self._watches:
+            self._watches[wd] = [False, directory, {}]
+        return self._watches[wd]
+
+    def _set_unknown_changes(self):
+        self._changed = True
+        self._changed_files = None
+
+    def _read_events(self):
+        for wd, mask, name in self.inotify.read_events():
+            if mask & UNKNOWN_CHANGES:
+                self._set_unknown_changes()
+                continue
+            watch = self._watches.get(wd)
+            if watch is None:
+                continue
+            is_cfg_dir, directory, names = watch
+            if name in names:
+                self._changed = True
+                if self._changed_files is not None:
+                    self._changed_files.add(names[name])
+                continue
+            if not is_cfg_dir:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR or os.path.islink(path):
+                # We do not know what is in there
+                self._set_unknown_changes()
+            elif name.endswith('.cfg'):
+                self._changed = True
+                if self._changed_files is not None:
+                    self._changed_files.add(path)
+
+    def has_changed(self):
+        """ Returns True if anything has changed since last parse() """
+        self._read_events()
+        return self._changed
+
+    def get_changed_files(self):
+        """ Returns a set of files that were changed, added or removed since last parse()
+
+        Returns None if it is not known which files have changed, for example
+        if a directory was added.
+        """
+        self._read_events()
+        if self._changed_files is None:
+            return None
+        return set(self._changed_files)
+
+    def close(self):
+        """ Stop watching """
+        self.inotify.close()
+
+
+def get_watcher(config):
+    """ Returns an InotifyWatcher for config if possible, otherwise a PollingWatcher
+
+    Args:
+
+        config (Config): A :py:class:`pynag.Parsers.config_parser.Config`
+        whose cfg_files have been found, see parse().
+    """
+    try:
+        return InotifyWatcher(config)
+    except OSError:
+        return PollingWatcher(config)
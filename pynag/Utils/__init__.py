@@ -30,6 +30,7 @@ import re
 import subprocess
 
 from pynag import errors
+from pynag.Utils import instrumentation
 
 
 class UtilsError(errors.PynagError):
@@ -418,6 +419,7 @@ def is_macro(macro):
     return True
 
 
+@instrumentation.instrumented('Utils.grep', objects=len)
 def grep(objects, **kwargs):
     """ Returns all the elements from array that match the keywords in **kwargs
 
@@ -439,8 +441,20 @@ def grep(objects, **kwargs):
         grep_dict(array, state=0)
         # should return [{'host_name': 'examplehost', 'state':0},]
 
+    The search arguments are tested cheapest and most selective first, see
+    :py:class:`GrepQuery`.
     """
+    if not kwargs:
+        return objects
+    return GrepQuery.get(kwargs).filter(objects)
 
+
+def _grep_sequential(objects, kwargs):
+    """ Same as :py:func:`grep`, filtering objects with one search argument at a time
+
+    This is how grep() used to work. It is left to decide what happens when
+    testing an object against a GrepQuery raises an exception.
+    """
     # Input comes to us as a key/value dict.
     # We will flatten this out into a tuble, because if value
     # is a list, it means the calling function is doing multible search on
@@ -507,6 +521,211 @@ def grep(objects, **kwargs):
     return matching_objects
 
 
+
+# AttributeList(value).fields of values with more than one field, that
+# have been looked at with __has_field
+_fields_cache = {}
+
+
+def _has_field(field, value):
+    """ Returns True if field is in AttributeList(value).fields """
+    if value.__class__ is not str:
+        return field in AttributeList(value).fields
+    if ',' not in value:
+        # Only one field, no need to split anything
+        if not value or value == 'null':
+            return False
+        if value[0] in '+-!':
+            value = value[1:]
+        return field == value.strip()
+    fields = _fields_cache.get(value)
+    if fields is None:
+        if len(_fields_cache) > 10000:
+            _fields_cache.clear()
+        fields = _fields_cache[value] = frozenset(AttributeList(value).fields)
+    return field in fields
+
+
+class GrepQuery(object):
+
+    """ Search arguments of :py:func:`grep`, as a list of functions that test an object
+
+    Every search argument becomes one condition, a function in self.tests.
+    Conditions are tested with the cheapest and most selective ones first,
+    and an object that fails one is not tested against the rest.
+
+    Objects that match are the same as if every search argument was tested
+    one after the other, as long as no test raises an exception. If one
+    does, the whole search is done one argument at a time instead. That
+    does not make the two the same in every case: an object that fails one
+    condition never gets to the ones after it, so a search that raises when
+    done one argument at a time may not raise here. For example __has_field raises TypeError on an int value,
+    but not if another condition has already ruled that object out.
+
+    Example:
+
+        >>> query = GrepQuery(host_name='localhost', service_description__startswith='Ping')
+        >>> query.matches({'host_name': 'localhost', 'service_description': 'Ping6'})
+        True
+        >>> query.filter([{'host_name': 'localhost'}, {'host_name': 'remotehost'}])
+        []
+    """
+
+    # Order in which conditions are tested, lowest first. Exact matches
+    # rule out most objects, negations rule out few and regular
+    # expressions and 'search' are the most expensive to test.
+    ranks = {
+        'exact': 0,
+        'register': 1,
+        'in': 2,
+        'startswith': 3,
+        'endswith': 3,
+        'exists': 4,
+        'contains': 5,
+        'has_field': 6,
+        'isnot': 7,
+        'notin': 7,
+        'notstartswith': 7,
+        'notendswith': 7,
+        'notcontains': 8,
+        'regex': 9,
+        'search': 10,
+    }
+
+    # Suffixes of search arguments, in the same order that grep() looks for them
+    suffixes = ('contains', 'notcontains', 'startswith', 'notstartswith', 'endswith', 'notendswith',
+                'exists', 'isnot', 'regex', 'in', 'notin', 'has_field')
+
+    # Queries made before, by repr() of their search arguments. See get()
+    _cache = {}
+    _cache_size = 1000
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.conditions = self._get_conditions(kwargs)
+        self.tests = [self._get_test(*condition) for condition in self.conditions]
+        self.matches = self._combine(self.tests)
+
+    @classmethod
+    def get(cls, kwargs):
+        """ Returns a GrepQuery for kwargs, one that was made before if possible """
+        cache_key = cls._get_cache_key(kwargs)
+        if cache_key is None:
+            return cls(**kwargs)
+        query = cls._cache.get(cache_key)
+        if query is None:
+            if len(cls._cache) >= cls._cache_size:
+                cls._cache.clear()
+            # Lists of values are copied, so changes to them made by the caller do not affect us
+            kwargs = dict((k, list(v) if isinstance(v, list) else v) for k, v in kwargs.items())
+            query = cls._cache[cache_key] = cls(**kwargs)
+        return query
+
+    @staticmethod
+    def _get_cache_key(kwargs):
+        """ Returns a key that identifies kwargs, or None if they contain anything but plain values """
+        plain_types = (str, unicode, int, long, float, bool, type(None))
+        for v in kwargs.values():
+            if isinstance(v, list):
+                if not all(type(i) in plain_types for i in v):
+                    return None
+            elif type(v) not in plain_types:
+                return None
+        return repr(sorted(kwargs.items()))
+
+    def filter(self, objects):
+        """ Returns every object in objects that matches, same as grep(objects, **self.kwargs) """
+        if not isinstance(objects, (list, tuple)):
+            objects = list(objects)
+        matching_objects = objects
+        try:
+            for test in self.tests:
+                matching_objects = filter(test, matching_objects)
+        except Exception:
+            return _grep_sequential(objects, self.kwargs)
+        return matching_objects
+
+    def _get_conditions(self, kwargs):
+        """ Returns a list of (kind, attribute_name, value, str(value)), in the order they are tested """
+        # Same as in grep(), a list of values means every one of them must match
+        search = []
+        for k, v in kwargs.items():
+            if isinstance(v, type([])) and not (k.endswith('__in') or k.endswith('__notin')):
+                for i in v:
+                    search.append((k, i))
+            else:
+                search.append((k, v))
+        conditions = []
+        for k, v in search:
+            v_str = str(v)
+            for suffix in self.suffixes:
+                if k.endswith('__' + suffix):
+                    kind = suffix
+                    k = k[:-len(suffix) - 2]
+                    break
+            else:
+                if k == 'register' and v_str == '1':
+                    kind = 'register'
+                elif k in ('search', 'q'):
+                    kind = 'search'
+                else:
+                    kind = 'exact'
+            conditions.append((kind, k, v, v_str))
+        conditions.sort(key=lambda x: self.ranks[x[0]])
+        return conditions
+
+    @staticmethod
+    def _combine(tests):
+        """ Returns a function that returns True if an object passes every test """
+        def matches(x):
+            for test in tests:
+                if not test(x):
+                    return False
+            return True
+        return matches
+
+    @staticmethod
+    def _get_test(kind, k, v, v_str):
+        """ Returns a function that returns True if an object matches one condition """
+        if kind == 'exact':
+            if isinstance(v, str):
+                def test(x):
+                    value = x.get(k)
+                    return str(value) == v_str or isinstance(value, list) and v in value
+            else:
+                test = lambda x: str(x.get(k)) == v_str
+        elif kind == 'contains':
+            test = lambda x: x.get(k) and v_str in str(x.get(k))
+        elif kind == 'notcontains':
+            test = lambda x: v_str not in str(x.get(k))
+        elif kind == 'startswith':
+            test = lambda x: str(x.get(k)).startswith(v_str)
+        elif kind == 'notstartswith':
+            test = lambda x: not str(x.get(k)).startswith(v_str)
+        elif kind == 'endswith':
+            test = lambda x: str(x.get(k)).endswith(v_str)
+        elif kind == 'notendswith':
+            test = lambda x: not str(x.get(k)).endswith(v_str)
+        elif kind == 'exists':
+            test = lambda x: str(k in x) == v_str
+        elif kind == 'isnot':
+            test = lambda x: v_str != str(x.get(k))
+        elif kind == 'regex':
+            search = re.compile(v_str).search
+            test = lambda x: search(str(x.get(k)))
+        elif kind == 'in':
+            test = lambda x: str(x.get(k)) in v
+        elif kind == 'notin':
+            test = lambda x: str(x.get(k)) not in v
+        elif kind == 'has_field':
+            test = lambda x: _has_field(v_str, x.get(k))
+        elif kind == 'register':
+            test = lambda x: x.get(k) in (v, None)
+        else:
+            test = lambda x: v_str in str(x)
+        return test
+
+
 def grep_to_livestatus(*args, **kwargs):
     """ Converts from pynag style grep syntax to livestatus filter syntax.
 
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Counts calls, time, objects and bytes spent in the busiest parts of pynag.
+
+Instrumentation is off by default and costs next to nothing then. Turn it on
+for the whole process by setting the environment variable
+PYNAG_INSTRUMENTATION=1, or with :py:func:`enable`. Use :py:func:`recording`
+to see what one piece of code, like a single web request, spends its time on::
+
+    >>> from pynag.Utils import instrumentation
+    >>> with instrumentation.recording() as stats:  # doctest: +SKIP
+    ...     hosts = pynag.Model.Host.objects.filter(host_name__contains='www')
+    >>> print instrumentation.report(stats)  # doctest: +SKIP
+    name                                   calls    seconds   objects     bytes
+    ObjectFetcher.reload_cache                 1      1.204     44012         0
+    Config.parse_file                         12      0.731     44012   9312004
+    ...
+
+Stats are a dict with an entry per instrumented function, like
+{'Config.parse_file': {'calls': 12, 'seconds': 0.731, 'objects': 44012, 'bytes': 9312004}}.
+Time of a call includes time spent in any instrumented functions it calls.
+"""
+
+import contextlib
+import functools
+import os
+import threading
+import time
+
+# Names of the things we count for every instrumented function
+fields = ('calls', 'seconds', 'objects', 'bytes')
+
+# True if calls in every thread are counted in _stats
+_enabled = os.environ.get('PYNAG_INSTRUMENTATION', '') not in ('', '0')
+
+# Number of recording() blocks in progress, in any thread
+_recordings = 0
+
+# True if anything needs to be counted at all
+_active = _enabled
+
+# Stats of every thread since instrumentation was enabled
+_stats = {}
+
+_lock = threading.Lock()
+
+# _local.recorders is a list of stats of recording() blocks in this thread
+_local = threading.local()
+
+
+def enable():
+    """ Count calls to instrumented functions in every thread """
+    global _enabled
+    _lock.acquire()
+    try:
+        _enabled = True
+        _update_active()
+    finally:
+        _lock.release()
+
+
+def disable():
+    """ Stop counting calls in every thread, except inside :py:func:`recording` """
+    global _enabled
+    _lock.acquire()
+    try:
+        _enabled = False
+        _update_active()
+    finally:
+        _lock.release()
+
+
+def is_enabled():
+    """ Returns True if calls in every thread are being counted """
+    return _enabled
+
+
+def reset():
+    """ Forget everything that has been counted by :py:func:`enable` """
+    _lock.acquire()
+    try:
+        _stats.clear()
+    finally:
+        _lock.release()
+
+
+def get_stats():
+    """ Returns a copy of everything counted since instrumentation was enabled
+
+    Returns:
+
+        dict of function name -> dict with calls, seconds, objects and bytes
+    """
+    _lock.acquire()
+    try:
+        return dict((name, stats.copy()) for name, stats in _stats.items())
+    finally:
+        _lock.release()
+
+
+@contextlib.contextmanager
+def recording():
+    """ Context manager that counts calls made by the current thread inside it
+
+    This works whether instrumentation is enabled or not, and recordings
+    can be nested.
+
+    Yields:
+
+        A dict like the one returned by :py:func:`get_stats`, that is filled
+        as instrumented functions return
+    """
+    global _recordings
+    stats = {}
+    recorders = getattr(_local, 'recorders', None)
+    if recorders is None:
+        recorders = _local.recorders = []
+    recorders.append(stats)
+    _lock.acquire()
+    try:
+        _recordings += 1
+        _update_active()
+    finally:
+        _lock.release()
+    try:
+        yield stats
+    finally:
+        recorders.remove(stats)
+        _lock.acquire()
+        try:
+            _recordings -= 1
+            _update_active()
+        finally:
+            _lock.release()
+
+
+def count(name, calls=0, seconds=0, objects=0, bytes=0):
+    """ Adds to the stats of name, if anything is being counted
+
+    Instrumented functions can use this to count objects or bytes that
+    cannot be told from their return value.
+    """
+    if not _active:
+        return
+    if _enabled:
+        _lock.acquire()
+        try:
+            _add(_stats, name, calls, seconds, objects, bytes)
+        finally:
+            _lock.release()
+    for stats in getattr(_local, 'recorders', ()):
+        _add(stats, name, calls, seconds, objects, bytes)
+
+
+def instrumented(name, objects=None, bytes=None):
+    """ Decorator that counts calls to a function, and the time spent in it
+
+    Args:
+
+        name (str): Name of the function in stats, i.e. 'Config.parse_file'
+
+        objects: Function that returns the number of objects that the
+        decorated function handled, given what it returned
+
+        bytes: Function that returns the number of bytes that the decorated
+        function handled, given what it returned
+
+    Use the decorator like so::
+
+        @instrumentation.instrumented('Utils.grep', objects=len)
+    """
+    def wrap(f):
+        @functools.wraps(f)
+        def newFunction(*args, **kwargs):
+            if not _active:
+                return f(*args, **kwargs)
+            start_time = time.time()
+            try:
+                result = f(*args, **kwargs)
+            except:
+                count(name, calls=1, seconds=time.time() - start_time)
+                raise
+            seconds = time.time() - start_time
+            number_of_objects = 0
+            number_of_bytes = 0
+            if objects is not None and result is not None:
+                number_of_objects = objects(result)
+            if bytes is not None and result is not None:
+                number_of_bytes = bytes(result)
+            count(name, calls=1, seconds=seconds, objects=number_of_objects, bytes=number_of_bytes)
+            return result
+        return newFunction
+    return wrap
+
+
+def report(stats=None):
+    """ Returns stats as a printable table, with the most time consuming function first
+
+    Args:
+
+        stats (dict): Stats from :py:func:`recording`. If None, use
+        :py:func:`get_stats`
+
+    Returns:
+
+        A string
+    """
+    if stats is None:
+        stats = get_stats()
+    width = max([len('name')] + [len(name) for name in stats]) + 2
+    lines = ['name'.ljust(width) + '%8s %10s %9s %9s' % fields]
+    ordered = sorted(stats.items(), key=lambda x: (-x[1]['seconds'], x[0]))
+    for name, i in ordered:
+        line = '%8d %10.3f %9d %9d' % (i['calls'], i['seconds'], i['objects'], i['bytes'])
+        lines.append(name.ljust(width) + line)
+    return '\n'.join(lines)
+
+
+def _add(stats, name, calls, seconds, objects, bytes):
+    current = stats.get(name)
+    if current is None:
+        current = stats[name] = dict.fromkeys(fields, 0)
+    current['calls'] += calls
+    current['seconds'] += seconds
+    current['objects'] += objects
+    current['bytes'] += bytes
+
+
+def _update_active():
+    global _active
+    _active = _enabled or _recordings > 0
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+# Benchmark for the object definition tokenizer in pynag.Parsers.config
+#
+# Generates a large nagios object configuration and measures how many
+# lines per second config.parse_string() handles, compared to the line by
+# line tokenizer that parse_string() used before.
+#
+# Usage: python tests/benchmark_parser.py [number_of_hosts] [rounds]
+
+import os
+import re
+import sys
+import time
+
+tests_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.realpath(tests_dir + "/.."))
+
+import pynag.Parsers
+from pynag.Parsers import ParserError
+
+beginning_of_object = re.compile("^\s*define\s+(\w+)\s*\{?(.*)$")
+
+
+def generate_config(number_of_hosts, services_per_host=10):
+    """ Returns a string with a generated object configuration """
+    result = []
+    result.append("define timeperiod {\n  timeperiod_name 24x7\n  alias 24 Hours A Day, 7 Days A Week\n")
+    for day in ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday'):
+        result.append("  %s 00:00-24:00\n" % day)
+    result.append("}\n\n")
+    result.append("define host {\n  name generic-host\n  check_interval 5\n  register 0\n}\n\n")
+    for i in range(number_of_hosts):
+        result.append("# Host number %s\n" % i)
+        result.append("define host {\n")
+        result.append("  use generic-host\n")
+        result.append("  host_name host%s.example.com\n" % i)
+        result.append("  alias Host number %s ; inline comment\n" % i)
+        result.append("  address 10.0.%s.%s\n" % (i // 256 % 256, i % 256))
+        result.append("  contact_groups admins,\\\n    operators\n")
+        result.append("}\n\n")
+        for j in range(services_per_host):
+            result.append("define service {\n")
+            result.append("  use generic-service\n")
+            result.append("  host_name host%s.example.com\n" % i)
+            result.append("  service_description Service %s\n" % j)
+            result.append("  check_command check_dummy!0!Everything is OK\n")
+            result.append("  max_check_attempts 3\n")
+            result.append("}\n\n")
+    return ''.join(result)
+
+
+def original_parse_string(config, string, filename='None'):
+    """ Same as config.parse_string(), the way it was written before it was optimized
+
+    Strict mode is left out.
+    """
+    append = ""
+    current = None
+    in_definition = {}
+    tmp_buffer = []
+    result = []
+
+    for sequence_no, line in enumerate(string.splitlines(False)):
+        line_num = sequence_no + 1
+
+        # If previous line ended with backslash, treat this line as a
+        # continuation of previous line
+        if append:
+            line = append + line
+            append = None
+
+        # Cleanup and line skips
+        line = line.strip()
+        if line == "":
+            continue
+        if line[0] == "#" or line[0] == ';':
+            continue
+
+        # If this line ends with a backslash, continue directly to next line
+        if line.endswith('\\'):
+            append = line.strip('\\')
+            continue
+
+        if line.startswith('}'):  # end of object definition
+
+            if not in_definition:
+                p = ParserError("Unexpected '}' found outside object definition in line %s" % line_num)
+                p.filename = filename
+                p.line_start = line_num
+                raise p
+
+            in_definition = None
+            current['meta']['line_end'] = line_num
+            # Looks to me like nagios ignores everything after the } so why shouldn't we ?
+            rest = line.split("}", 1)[1]
+
+            tmp_buffer.append(line)
+            try:
+                current['meta']['raw_definition'] = '\n'.join(tmp_buffer)
+            except Exception:
+                raise ParserError("Encountered Unexpected end of object definition in file '%s'." % filename)
+            result.append(current)
+
+            # Destroy the Nagios Object
+            current = None
+            continue
+
+        elif line.startswith('define'):  # beginning of object definition
+            if in_definition:
+                msg = "Unexpected 'define' in {filename} on line {line_num}. was expecting '}}'."
+                msg = msg.format(**locals())
+                config.errors.append(ParserError(msg, item=current))
+
+            m = beginning_of_object.search(line)
+
+            tmp_buffer = [line]
+            object_type = m.groups()[0]
+            current = config.get_new_item(object_type, filename)
+            current['meta']['line_start'] = line_num
+
+            # Start off an object
+            in_definition = True
+
+            # Looks to me like nagios ignores everything after the {, so why shouldn't we ?
+            rest = m.groups()[1]
+            continue
+        else:  # In the middle of an object definition
+            tmp_buffer.append('    ' + line)
+
+        # save whatever's left in the buffer for the next iteration
+        if not in_definition:
+            append = line
+            continue
+
+        # this is an attribute inside an object definition
+        if in_definition:
+            tmp = line.split(None, 1)
+            if len(tmp) > 1:
+                (key, value) = tmp
+            else:
+                key = tmp[0]
+                value = ""
+
+            # Strip out in-line comments
+            if value.find(";") != -1:
+                value = value.split(";", 1)[0]
+
+            # Clean info
+            key = key.strip()
+            value = value.strip()
+
+            # Rename some old values that may be in the configuration
+            if (current['meta']['object_type'] == 'service') and key == 'description':
+                key = 'service_description'
+
+            # Special hack for timeperiods as they are not consistent with other objects
+            # We will treat whole line as a key with an empty value
+            if (current['meta']['object_type'] == 'timeperiod') and key not in ('timeperiod_name', 'alias'):
+                key = line
+                value = ''
+            current[key] = value
+            current['meta']['defined_attributes'][key] = value
+        # Something is wrong in the config
+        else:
+            raise ParserError("Error: Unexpected token in file '%s'" % filename)
+
+    # Something is wrong in the config
+    if in_definition:
+        raise ParserError("Error: Unexpected EOF in file '%s'" % filename)
+
+    return result
+
+
+def benchmark(parse_string, string, rounds):
+    """ Returns the best time (in seconds) parse_string took to parse string """
+    result = None
+    for i in range(rounds):
+        start = time.time()
+        parse_string(string, filename='benchmark.cfg')
+        elapsed = time.time() - start
+        if result is None or elapsed < result:
+            result = elapsed
+    return result
+
+
+def main():
+    number_of_hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    string = generate_config(number_of_hosts)
+    number_of_lines = string.count('\n')
+    config = pynag.Parsers.config(cfg_file='/dev/null')
+
+    def original(string, filename='None'):
+        return original_parse_string(config, string, filename)
+
+    items = config.parse_string(string)
+    if items != original(string):
+        print "parse_string() and the original tokenizer do not agree"
+        sys.exit(1)
+
+    print "%s lines, %s objects, best of %s rounds" % (number_of_lines, len(items), rounds)
+    original_result = benchmark(original, string, rounds)
+    print "original %8.3fs %12.0f lines/sec" % (original_result, number_of_lines / original_result)
+    result = benchmark(config.parse_string, string, rounds)
+    print "current  %8.3fs %12.0f lines/sec" % (result, number_of_lines / result)
+    print "%.2fx faster" % (original_result / result)
+
+
+if __name__ == '__main__':
+    main()
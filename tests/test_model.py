@@ -11,9 +11,11 @@ import string
 import random
 import mock
 import time
+import json
 
 import pynag.Model
 import pynag.Model.EventHandlers
+import pynag.Model.precompiled
 import pynag.Utils.misc
 from tests import tests_dir
 
@@ -564,6 +566,387 @@ class Model(unittest.TestCase):
         h3 = pynag.Model.Host.objects.get_by_shortname('brand_new_host3')
         self.assertEqual(h3, h2)
 
+    def test_source_object_cache(self):
+        """ Test reading objects from objects.cache with pynag.Model.source """
+        object_cache_file = self.environment.config.get_cfg_value('object_cache_file')
+        with open(object_cache_file, 'w') as f:
+            f.write("define host {\n\thost_name\tcached_host\n\taddress\t127.0.0.1\n\t}\n")
+        self.addCleanup(setattr, pynag.Model, 'source', pynag.Model.source)
+
+        pynag.Model.source = 'object_cache'
+        host = pynag.Model.Host.objects.get_by_shortname('cached_host')
+        self.assertEqual('127.0.0.1', host.address)
+        host.address = '127.0.0.2'
+        self.assertRaises(pynag.Parsers.ParserError, host.save)
+
+        pynag.Model.source = 'config'
+        self.assertEqual([], pynag.Model.Host.objects.filter(host_name='cached_host'))
+
+    def test_write_precompiled_config(self):
+        """ Test writing a flattened copy of the configuration with pynag.Model.precompiled """
+        objects_file = os.path.join(self.environment.objects_dir, 'precompiled.cfg')
+        with open(objects_file, 'w') as f:
+            f.write("define host {\n name precompiled-template\n check_interval 7\n register 0\n}\n"
+                    "define host {\n use precompiled-template\n host_name precompiled1\n}\n"
+                    "define host {\n use precompiled-template\n host_name precompiled2\n}\n"
+                    "define hostgroup {\n hostgroup_name precompiled_hosts\n members precompiled.*\n}\n"
+                    "define service {\n hostgroup_name precompiled_hosts\n service_description ping\n}\n")
+        filename = os.path.join(self.environment.tempdir, 'precompiled_output.cfg')
+        regenerated = pynag.Model.precompiled.write_precompiled_config(filename)
+        self.assertTrue(objects_file in regenerated)
+
+        items = pynag.Model.config.parse_file(filename)
+        hosts = dict((i['host_name'], i) for i in items if i['meta']['object_type'] == 'host')
+        self.assertEqual('7', hosts['precompiled1']['check_interval'])
+        self.assertEqual('precompiled_hosts', hosts['precompiled1']['hostgroups'])
+        self.assertFalse('use' in hosts['precompiled1'])
+        self.assertFalse([i for i in items if i.get('name') == 'precompiled-template'])
+        services = [i['host_name'] for i in items if i.get('service_description') == 'ping']
+        self.assertEqual(['precompiled1', 'precompiled2'], services)
+
+        # Nothing has changed, so nothing is written
+        self.assertEqual([], pynag.Model.precompiled.write_precompiled_config(filename))
+
+        # Only objects of the changed file are generated again
+        minimal_config = os.path.join(self.environment.objects_dir, 'minimal_config.cfg')
+        with open(minimal_config, 'a') as f:
+            f.write("define command {\n command_name precompiled_command\n command_line /bin/true\n}\n")
+        mtime = os.stat(minimal_config).st_mtime + 10
+        os.utime(minimal_config, (mtime, mtime))
+        self.assertEqual([minimal_config], pynag.Model.precompiled.write_precompiled_config(filename))
+        incremental_output = open(filename).read()
+        self.assertTrue('precompiled_command' in incremental_output)
+        pynag.Model.precompiled.write_precompiled_config(filename, incremental=False)
+        self.assertEqual(open(filename).read(), incremental_output)
+
+        # Unchanged sections are kept when filename is rewritten in place
+        os.link(filename, filename + '.link')
+        with open(minimal_config, 'a') as f:
+            f.write("define command {\n command_name precompiled_command2\n command_line /bin/true\n}\n")
+        os.utime(minimal_config, (mtime + 10, mtime + 10))
+        self.assertEqual([minimal_config], pynag.Model.precompiled.write_precompiled_config(filename))
+        incremental_output = open(filename + '.link').read()
+        self.assertTrue('precompiled_command2' in incremental_output)
+        self.assertTrue('precompiled1' in incremental_output)
+        pynag.Model.precompiled.write_precompiled_config(filename, incremental=False)
+        self.assertEqual(open(filename).read(), incremental_output)
+
+    def test_get_impacted_objects(self):
+        """ Test ObjectDefinition.get_impacted_objects() """
+        template = pynag.Model.Host(name='impact_template', register='0')
+        template.save()
+        pynag.Model.Host(host_name='impact_host', use='impact_template').save()
+        pynag.Model.Service(host_name='impact_host', service_description='impact_service').save()
+
+        template = pynag.Model.Host.objects.get_by_name('impact_template')
+        impacted = sorted(i.get_shortname() for i in template.get_impacted_objects())
+        self.assertEqual(['impact_host', 'impact_host/impact_service'], impacted)
+        impacted = [i.get_shortname() for i in template.get_impacted_objects(['host_name'])]
+        self.assertEqual([], impacted)
+        host = pynag.Model.Host.objects.get_by_shortname('impact_host')
+        impacted = [i.get_shortname() for i in host.get_impacted_objects(['address'])]
+        self.assertEqual(['impact_host/impact_service'], impacted)
+
+    def test_filter_index(self):
+        """ Test that filter() finds the same objects with an index as grep() does without """
+        filename = os.path.join(self.environment.objects_dir, 'index.cfg')
+        with open(filename, 'w') as f:
+            f.write("define host {\n name index-template\n register 0\n}\n"
+                    "define host {\n use index-template\n host_name index1\n hostgroups group1,group2\n}\n"
+                    "define host {\n use index-template\n host_name index2\n hostgroups group2\n}\n"
+                    "define service {\n host_name index1,index2\n service_description ping\n}\n"
+                    "define service {\n host_name index1\n service_description disk\n}\n")
+        searches = [
+            {'host_name': 'index1'},
+            {'host_name': 'index1,index2', 'service_description': 'ping'},
+            {'host_name': None},
+            {'host_name': ['index1', 'index2']},
+            {'host_name__has_field': 'index2'},
+            {'host_name__has_field': ['index1', 'index2']},
+            {'use': 'index-template', 'register': '1'},
+            {'name': 'index-template'},
+            {'hostgroups__has_field': 'group2', 'host_name__startswith': 'index'},
+            {'service_description': 'nothing'},
+        ]
+        for Class in (pynag.Model.Host, pynag.Model.Service, pynag.Model.ObjectDefinition):
+            for search in searches:
+                self.assertEqual(pynag.Utils.grep(Class.objects.all, **search), Class.objects.filter(**search))
+        self.assertTrue(pynag.Model.Host.objects.get_index('host_name'))
+        self.assertEqual(['index1', 'index2'],
+                         [i.host_name for i in pynag.Model.Host.objects.get_index('use')['index-template']])
+
+        # Indexes are thrown away when objects change
+        host = pynag.Model.Host.objects.get_by_shortname('index2')
+        host.host_name = 'index3'
+        self.assertEqual([host], pynag.Model.Host.objects.filter(host_name='index3'))
+        self.assertEqual([], pynag.Model.Host.objects.filter(host_name='index2'))
+        host.save()
+        self.assertEqual(['index3'], [i.host_name for i in pynag.Model.Host.objects.filter(host_name='index3')])
+
+    def test_queryset(self):
+        """ Test that filter() returns a QuerySet that works like the list grep() returns """
+        filename = os.path.join(self.environment.objects_dir, 'queryset.cfg')
+        with open(filename, 'w') as f:
+            for i in range(10):
+                f.write("define host {\n host_name queryset%s\n address 10.0.0.%s\n alias %s\n}\n" % (i, i, i % 3))
+        hosts = pynag.Utils.grep(pynag.Model.Host.objects.all, host_name__startswith='queryset')
+        queryset = pynag.Model.Host.objects.filter(host_name__startswith='queryset')
+        self.assertTrue(isinstance(queryset, pynag.Model.QuerySet))
+        self.assertEqual(10, queryset.count())
+        self.assertEqual(hosts[0], queryset.first())
+        self.assertTrue(queryset.exists())
+        self.assertEqual(hosts[3], queryset[3])
+        self.assertEqual(hosts[2:5], queryset[2:5])
+        self.assertEqual(hosts[3:4], queryset[2:5][1:2])
+        self.assertEqual(3, queryset[2:5].count())
+        self.assertEqual(0, queryset[20:].count())
+        self.assertRaises(IndexError, lambda: queryset[20])
+        self.assertEqual([hosts[4]], queryset[2:5].filter(alias='1'))
+        self.assertTrue(isinstance(queryset[2:5], pynag.Model.QuerySet))
+        self.assertEqual(hosts, queryset)
+        self.assertEqual(hosts[-1], queryset[-1])
+
+        # Narrowing down
+        self.assertEqual(['queryset1', 'queryset4', 'queryset7'],
+                         [i.host_name for i in queryset.filter(alias='1')])
+        self.assertEqual(['queryset4', 'queryset7'],
+                         [i.host_name for i in queryset.filter(alias='1').exclude(host_name='queryset1')])
+        self.assertEqual(['queryset7'], [i.host_name for i in queryset.filter(alias='1').filter(alias__contains='1',
+                                                                                                 address__endswith='7')])
+        self.assertEqual([], queryset.filter(alias='nothing'))
+        self.assertFalse(queryset.filter(alias='nothing').exists())
+        self.assertEqual(None, queryset.filter(alias='nothing').first())
+        self.assertEqual(len(pynag.Model.Host.objects.all), pynag.Model.Host.objects.filter().count())
+
+        # Ordering and values
+        ordered = queryset.order_by('alias', '-host_name')
+        self.assertEqual(['queryset9', 'queryset6', 'queryset3', 'queryset0', 'queryset7'],
+                         [i.host_name for i in ordered[:5]])
+        self.assertEqual([{'host_name': 'queryset9', 'alias': '0'}], ordered.values('host_name', 'alias')[:1])
+        self.assertEqual('10.0.0.0', queryset.values().first()['address'])
+
+        # List operations
+        result = queryset.filter(alias='2')
+        result += queryset.filter(alias='1')[:1]
+        result.append(hosts[0])
+        self.assertEqual(hosts[2::3] + hosts[1:2] + hosts[:1], result)
+        self.assertEqual(hosts[:1] + hosts[2::3], hosts[:1] + queryset.filter(alias='2'))
+        self.assertTrue(hosts[0] in queryset)
+        self.assertEqual(hosts[::-1], list(reversed(queryset)))
+
+        # It is a list, with the objects that were found when it was made
+        self.assertTrue(isinstance(queryset, list))
+        self.assertEqual('[{"host_name": "queryset0"}]', json.dumps(queryset.values('host_name')[:1]))
+        self.assertEqual('queryset0', ','.join(i['host_name'] for i in queryset.values('host_name')[:1]))
+        queryset[0].delete()
+        self.assertEqual(hosts, queryset)
+        self.assertEqual(9, pynag.Model.Host.objects.filter(host_name__startswith='queryset').count())
+
+    def test_queryset_delete_and_rename(self):
+        """ Test deleting and renaming objects while iterating over a QuerySet """
+        filename = os.path.join(self.environment.objects_dir, 'queryset_changes.cfg')
+        with open(filename, 'w') as f:
+            f.write("define hostgroup {\n hostgroup_name qs_group\n members qs_del0,qs_del1,qs_del2,qs_ren0\n}\n")
+            f.write("define service {\n host_name qs_del0,qs_del1\n service_description shared\n}\n")
+            for name in ('qs_del0', 'qs_del1', 'qs_del2', 'qs_ren0', 'qs_ren1', 'qs_ren2'):
+                f.write("define host {\n host_name %s\n}\n" % name)
+                for description in ('ping', 'ssh'):
+                    f.write("define service {\n host_name %s\n service_description %s\n}\n" % (name, description))
+            f.write("define host {\n host_name qs_child\n parents qs_ren1\n}\n")
+
+        # Methods that return what they found with filter() still return lists
+        parent = pynag.Model.Host.objects.get_by_shortname('qs_ren1')
+        children = parent.get_effective_network_children(recursive=True)
+        self.assertTrue(isinstance(children, list))
+        self.assertEqual(['qs_child'], [i.host_name for i in children])
+
+        for host in pynag.Model.Host.objects.filter(host_name__startswith='qs_del'):
+            host.delete(recursive=True)
+        self.assertEqual([], pynag.Model.Host.objects.filter(host_name__startswith='qs_del'))
+        self.assertEqual([], pynag.Model.Service.objects.filter(host_name__startswith='qs_del'))
+        hostgroup = pynag.Model.Hostgroup.objects.get_by_shortname('qs_group')
+        self.assertEqual('qs_ren0', hostgroup.members)
+
+        for host in pynag.Model.Host.objects.filter(host_name__startswith='qs_ren'):
+            host.rename(host.host_name + '_new')
+        self.assertEqual(['qs_ren0_new', 'qs_ren1_new', 'qs_ren2_new'],
+                         sorted(i.host_name for i in pynag.Model.Host.objects.filter(host_name__startswith='qs_ren')))
+        self.assertEqual(['qs_ren0_new/ping', 'qs_ren0_new/ssh', 'qs_ren1_new/ping', 'qs_ren1_new/ssh', 'qs_ren2_new/ping', 'qs_ren2_new/ssh'],
+                         sorted(i.get_shortname() for i in pynag.Model.Service.objects.filter(host_name__startswith='qs_ren')))
+        hostgroup = pynag.Model.Hostgroup.objects.get_by_shortname('qs_group')
+        self.assertEqual('qs_ren0_new', hostgroup.members)
+
+    def test_reload_cache_incremental(self):
+        """ Test that reload_cache() only makes new objects for items that have changed """
+        first_file = os.path.join(self.environment.objects_dir, 'incremental1.cfg')
+        second_file = os.path.join(self.environment.objects_dir, 'incremental2.cfg')
+        with open(first_file, 'w') as f:
+            f.write("define hostgroup {\n hostgroup_name incremental_hosts\n}\n"
+                    "define host {\n host_name incremental1\n hostgroups incremental_hosts\n}\n")
+        with open(second_file, 'w') as f:
+            f.write("define host {\n host_name incremental2\n}\n"
+                    "define host {\n host_name incremental3\n}\n")
+        host1 = pynag.Model.Host.objects.get_by_shortname('incremental1')
+        host2 = pynag.Model.Host.objects.get_by_shortname('incremental2')
+        hostgroup = pynag.Model.Hostgroup.objects.get_by_shortname('incremental_hosts')
+        self.assertEqual(['incremental1'], [i.host_name for i in hostgroup.get_effective_hosts()])
+
+        with open(second_file, 'w') as f:
+            f.write("define host {\n host_name incremental2\n hostgroups incremental_hosts\n}\n")
+        os.utime(second_file, (time.time() + 10, time.time() + 10))
+        self.assertTrue(pynag.Model.Host.objects.needs_reload())
+        self.assertTrue(host1 is pynag.Model.Host.objects.get_by_shortname('incremental1'))
+        self.assertTrue(hostgroup is pynag.Model.Hostgroup.objects.get_by_shortname('incremental_hosts'))
+        self.assertFalse(host2 is pynag.Model.Host.objects.get_by_shortname('incremental2'))
+        self.assertEqual([], pynag.Model.Host.objects.filter(host_name='incremental3'))
+        self.assertEqual(['incremental1', 'incremental2'],
+                         sorted(i.host_name for i in hostgroup.get_effective_hosts()))
+        self.assertEqual(set(['incremental_hosts']), pynag.Model.ObjectRelations.host_hostgroups['incremental2'])
+
+        # Objects with unsaved changes are replaced as well
+        host1.notes = 'not saved'
+        pynag.Model.config._is_dirty = True
+        new_host1 = pynag.Model.Host.objects.get_by_shortname('incremental1')
+        self.assertFalse(host1 is new_host1)
+        self.assertEqual(None, new_host1.notes)
+
+    def test_get_relations(self):
+        """ Test that ObjectFetcher._get_relations() records relations without touching ObjectRelations """
+        host = pynag.Model.Host(host_name='relations_host', hostgroups='group1,group2', contacts='contact1')
+        host_hostgroups = pynag.Model.ObjectRelations.host_hostgroups
+        with mock.patch.object(host, '_do_relations', wraps=host._do_relations) as do_relations:
+            relations = pynag.Model.Host.objects._get_relations([host])
+            self.assertEqual(1, do_relations.call_count)
+        self.assertTrue(host_hostgroups is pynag.Model.ObjectRelations.host_hostgroups)
+        self.assertFalse('relations_host' in host_hostgroups)
+        self.assertTrue(('host_hostgroups', ('relations_host',), 'group2') in relations[0])
+        self.assertTrue(('hostgroup_hosts', ('group1',), 'relations_host') in relations[0])
+        self.assertTrue(('contact_hosts', ('contact1',), host.get_id()) in relations[0])
+
+    def test_cache_dir(self):
+        """ Test that pynag.Model.cache_dir is used by a config that was made before it was set """
+        cache_dir = os.path.join(self.environment.tempdir, 'parse_cache')
+        original_cache_dir = pynag.Model.cache_dir
+        pynag.Model.cache_dir = cache_dir
+        try:
+            config = pynag.Model.config
+            config._is_dirty = True
+            pynag.Model.Host.objects.all
+            self.assertTrue(config is pynag.Model.config)
+            self.assertEqual(cache_dir, config.cache_dir)
+            self.assertEqual(len(config.cfg_files), len(os.listdir(cache_dir)))
+        finally:
+            pynag.Model.cache_dir = original_cache_dir
+
+    def test_snapshot(self):
+        """ Test that load_snapshot() fills the cache the same way reload_cache() would """
+        filename = os.path.join(self.environment.objects_dir, 'snapshot.cfg')
+        snapshot_file = os.path.join(self.environment.tempdir, 'model.snapshot')
+        with open(os.path.join(self.environment.objects_dir, 'snapshot_groups.cfg'), 'w') as f:
+            f.write("define hostgroup {\n hostgroup_name snapshot_hosts\n}\n")
+        with open(filename, 'w') as f:
+            f.write("define host {\n name snapshot-template\n register 0\n contact_groups admins\n}\n"
+                    "define host {\n use snapshot-template\n host_name snapshot1\n hostgroups snapshot_hosts\n}\n"
+                    "define service {\n use missing-template\n host_name snapshot1\n service_description ping\n}\n")
+
+        def get_state():
+            objects = sorted((i.get_id(), i.get_shortname(), sorted(i.items()), i['meta'])
+                             for i in pynag.Model.ObjectDefinition.objects.all)
+            relations = pynag.Model.ObjectRelations
+            return (objects, dict(relations.host_hostgroups), dict(relations.host_services),
+                    dict(relations.use['host']), sorted(map(str, pynag.Model.config.errors)))
+        pynag.Model.save_snapshot(snapshot_file)
+        expected_state = get_state()
+        self.assertTrue(pynag.Model.config.errors)
+
+        pynag.Model.ObjectFetcher._clear_cache()
+        self.assertTrue(pynag.Model.load_snapshot(snapshot_file))
+        self.assertFalse(pynag.Model.Host.objects.needs_reload())
+        self.assertEqual(expected_state, get_state())
+        host = pynag.Model.Host.objects.get_by_shortname('snapshot1')
+        self.assertEqual('admins', host.contact_groups)
+        self.assertEqual(['ping'], [i.service_description for i in host.get_effective_services()])
+        self.assertEqual([host], pynag.Model.Host.objects.filter(host_name='snapshot1'))
+
+        # Snapshots that someone else could have written are not used
+        os.chmod(snapshot_file, 0620)
+        self.assertFalse(pynag.Model.load_snapshot(snapshot_file))
+        os.chmod(snapshot_file, 0602)
+        self.assertFalse(pynag.Model.load_snapshot(snapshot_file))
+        os.chmod(snapshot_file, 0600)
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertFalse(pynag.Model.load_snapshot(snapshot_file))
+        self.assertTrue(host is pynag.Model.Host.objects.get_by_shortname('snapshot1'))
+
+        # Objects can be changed and saved, and only the changed ones are made again
+        hostgroup = pynag.Model.Hostgroup.objects.get_by_shortname('snapshot_hosts')
+        host.notes = 'after snapshot'
+        host.save()
+        self.assertTrue(hostgroup is pynag.Model.Hostgroup.objects.get_by_shortname('snapshot_hosts'))
+        host = pynag.Model.Host.objects.get_by_shortname('snapshot1')
+        self.assertEqual('after snapshot', host.notes)
+        self.assertEqual(['snapshot1'], [i.host_name for i in hostgroup.get_effective_hosts()])
+
+        # A snapshot of configuration files that have changed since is not used
+        self.assertFalse(pynag.Model.load_snapshot(snapshot_file))
+        self.assertTrue(host is pynag.Model.Host.objects.get_by_shortname('snapshot1'))
+        self.assertFalse(pynag.Model.load_snapshot(os.path.join(self.environment.tempdir, 'does_not_exist')))
+        with open(snapshot_file, 'w') as f:
+            f.write('not a snapshot')
+        self.assertFalse(pynag.Model.load_snapshot(snapshot_file))
+
+        # With snapshot_file set, the first reload_cache() writes a snapshot and uses it after that
+        original_snapshot_file = pynag.Model.snapshot_file
+        pynag.Model.snapshot_file = snapshot_file
+        try:
+            os.remove(snapshot_file)
+            pynag.Model.ObjectFetcher._clear_cache()
+            self.assertEqual('after snapshot', pynag.Model.Host.objects.get_by_shortname('snapshot1').notes)
+            self.assertTrue(os.path.exists(snapshot_file))
+            pynag.Model.ObjectFetcher._clear_cache()
+            with mock.patch.object(pynag.Model.config, 'parse') as parse:
+                self.assertEqual('after snapshot', pynag.Model.Host.objects.get_by_shortname('snapshot1').notes)
+                self.assertFalse(parse.called)
+        finally:
+            pynag.Model.snapshot_file = original_snapshot_file
+
+    def test_batch(self):
+        """ Test that pynag.Model.batch() writes each file once """
+        filename = os.path.join(self.environment.objects_dir, 'batch_hosts.cfg')
+        hosts = []
+        for i in range(3):
+            host = pynag.Model.Host(host_name='batch_host%s' % i, use='generic-host')
+            host.save(filename=filename)
+            hosts.append(host)
+        original_contents = open(filename).read()
+        with mock.patch.object(pynag.Model.config, 'write_atomically',
+                               wraps=pynag.Model.config.write_atomically) as write:
+            with pynag.Model.batch():
+                for host in hosts:
+                    host.address = '127.0.0.1'
+                    host.notes = 'batch'
+                    host.save()
+                hosts[0].delete()
+                pynag.Model.Host(host_name='batch_host3').save(filename=filename)
+                self.assertEqual(original_contents, open(filename).read())
+            self.assertEqual(1, write.call_count)
+            self.assertEqual(filename, write.call_args[0][0])
+        self.assertEqual([], pynag.Model.Host.objects.filter(host_name='batch_host0'))
+        self.assertEqual('batch', pynag.Model.Host.objects.get_by_shortname('batch_host1').notes)
+        self.assertEqual('127.0.0.1', pynag.Model.Host.objects.get_by_shortname('batch_host2').address)
+        self.assertEqual(filename, pynag.Model.Host.objects.get_by_shortname('batch_host3').get_filename())
+
+        # Nothing is written if batch fails
+        try:
+            with pynag.Model.batch():
+                host = pynag.Model.Host.objects.get_by_shortname('batch_host1')
+                host.notes = 'failed batch'
+                host.save()
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual('batch', pynag.Model.Host.objects.get_by_shortname('batch_host1').notes)
+
     def test_get_related_objects(self):
         """ Test objectdefinition.get_related_objects()
         """
@@ -1195,6 +1578,15 @@ class EventHandlersTest(unittest.TestCase):
         self.assertEqual(True, self.mock_eventhandler.write.called)
         self.assertEqual(True, self.mock_eventhandler.save.called)
 
+    def test_eventhandler_save_called_after_batch(self):
+        with pynag.Model.batch():
+            ok_host = pynag.Model.Host.objects.get_by_shortname('ok_host')
+            ok_host.address = 'new ip address'
+            ok_host.save()
+            self.assertEqual(True, self.mock_eventhandler.write.called)
+            self.assertEqual(False, self.mock_eventhandler.save.called)
+        self.assertEqual(True, self.mock_eventhandler.save.called)
+
     def test_eventhandler_debug_called_when_changing_attribute(self):
         ok_host = pynag.Model.Host.objects.get_by_shortname('ok_host')
         ok_host.address = 'Test'
@@ -10,6 +10,7 @@ sys.path.insert(0, pynagbase)
 import unittest2 as unittest
 import mock
 import doctest
+import glob
 import tempfile
 import shutil
 import string
@@ -38,6 +39,15 @@ class Config(unittest.TestCase):
     def tearDown(self):
         self.environment.terminate()
 
+    def assertParsedItemsEqual(self, items1, items2):
+        """ Same as assertEqual, except order of template_fields is ignored
+
+        Order of template_fields depends on ordering of the parent dict
+        """
+        for item in items1 + items2:
+            item['meta']['template_fields'].sort()
+        self.assertEqual(items1, items2)
+
     def test_parse(self):
         """ Smoketest config.parse() """
         self.config.parse()
@@ -107,6 +117,467 @@ class Config(unittest.TestCase):
         del new_item['meta']
         self.assertEqual(new_item, item_after_parse)
 
+    def test_item_edit_field_does_not_reparse(self):
+        """ Test that editing objects in the same file uses definition index instead of parsing the file """
+        with open(self.objects_file, 'w') as f:
+            for i in range(5):
+                f.write("define host {\n  host_name edit_host%s\n  alias a,\\\n    b\n}\n\n" % i)
+        c = self.config
+        c.parse()
+        host1 = c.get_host('edit_host1')
+        host3 = c.get_host('edit_host3')
+        with mock.patch.object(c, 'parse_file') as parse_file:
+            c.item_edit_field(host1, 'notes', 'new note')
+            c.item_remove_field(host3, 'alias')
+            c.item_rewrite(c.get_host('edit_host0'), "define host {\n  host_name rewritten\n}\n")
+            c.item_rename_field(c.get_host('edit_host4'), 'alias', 'notes')
+            self.assertFalse(parse_file.called)
+        self.assertEqual(c._get_definition_index(self.objects_file),
+                         c._get_definition_index(self.objects_file, reread=True))
+
+        c.parse()
+        self.assertEqual('new note', c.get_host('edit_host1')['notes'])
+        self.assertFalse('alias' in c.get_host('edit_host3'))
+        self.assertTrue(c.get_host('rewritten'))
+        self.assertTrue('notes' in c.get_host('edit_host4'))
+        self.assertFalse('alias' in c.get_host('edit_host4'))
+
+        # Changes made by others are noticed
+        with open(self.objects_file, 'a') as f:
+            f.write("define host {\n  host_name edit_host5\n}\n")
+        c.item_edit_field(c.get_host('edit_host1'), 'notes', 'newer note')
+        c.item_edit_field({'host_name': 'edit_host5', 'meta': {'filename': self.objects_file, 'object_type': 'host',
+                                                              'defined_attributes': {'host_name': 'edit_host5'}}},
+                          'notes', 'note')
+        c.parse()
+        self.assertEqual('newer note', c.get_host('edit_host1')['notes'])
+        self.assertEqual('note', c.get_host('edit_host5')['notes'])
+
+    def test_transaction(self):
+        """ Test that changes made in a transaction are written at the end """
+        c = self.config
+        c.parse()
+        other_file = self.environment.objects_dir + "/other_objects.cfg"
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  host_name transaction_host\n}\n")
+            f.write("define host {\n  host_name transaction_host2\n}\n")
+        os.chmod(self.objects_file, 0640)
+        c.parse()
+        with mock.patch.object(c, 'write_atomically', wraps=c.write_atomically) as write:
+            with c.transaction():
+                c.item_edit_field(c.get_host('transaction_host'), 'alias', 'first')
+                c.item_edit_field(c.get_host('transaction_host2'), 'notes', 'second')
+                new_item = c.get_new_item('host', other_file)
+                new_item['host_name'] = 'other_host'
+                c.item_add(new_item, other_file)
+                self.assertFalse(os.path.exists(other_file))
+                self.assertTrue('second' not in open(self.objects_file).read())
+                self.assertFalse(c.needs_reparse())
+                self.assertEqual('second', c.parse_file(self.objects_file)[1]['notes'])
+            self.assertEqual(2, write.call_count)
+        self.assertTrue(c.needs_reparse())
+        self.assertEqual(0640, os.stat(self.objects_file).st_mode & 0777)
+        c.parse()
+        self.assertEqual('first', c.get_host('transaction_host')['alias'])
+        self.assertEqual('second', c.get_host('transaction_host2')['notes'])
+        self.assertTrue(c.get_host('other_host'))
+
+        # Changes are discarded if there is an exception
+        contents = open(self.objects_file).read()
+        try:
+            with c.transaction():
+                c.item_edit_field(c.get_host('transaction_host'), 'alias', 'third')
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(contents, open(self.objects_file).read())
+        c.item_edit_field(c.get_host('transaction_host2'), 'notes', 'fourth')
+        c.parse()
+        self.assertEqual('first', c.get_host('transaction_host')['alias'])
+        self.assertEqual('fourth', c.get_host('transaction_host2')['notes'])
+
+    def test_durable_write(self):
+        """ Test that written files are synced to disk, once per file and directory in a transaction """
+        c = self.config
+        self.assertFalse(c.durable)
+        c.durable = True
+        other_file = self.environment.objects_dir + "/other_objects.cfg"
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  host_name durable_host\n}\n")
+        with open(other_file, 'w') as f:
+            f.write("define host {\n  host_name durable_host2\n}\n")
+        c.parse()
+
+        # The file and its directory
+        with mock.patch.object(c, 'fsync', wraps=c.fsync) as fsync:
+            c.item_edit_field(c.get_host('durable_host'), 'alias', 'first')
+            self.assertEqual(2, fsync.call_count)
+        c.parse()
+
+        # Each file, and their directory once
+        with mock.patch.object(c, 'fsync', wraps=c.fsync) as fsync:
+            with c.transaction():
+                c.item_edit_field(c.get_host('durable_host'), 'notes', 'note')
+                c.item_edit_field(c.get_host('durable_host2'), 'notes', 'note')
+                self.assertEqual(0, fsync.call_count)
+            self.assertEqual(3, fsync.call_count)
+        c.parse()
+
+        c.durable = False
+        with mock.patch.object(c, 'fsync', wraps=c.fsync) as fsync:
+            c.item_edit_field(c.get_host('durable_host'), 'alias', 'second')
+            self.assertEqual(0, fsync.call_count)
+        c.parse()
+        self.assertEqual('second', c.get_host('durable_host')['alias'])
+        self.assertEqual('note', c.get_host('durable_host')['notes'])
+        self.assertEqual('note', c.get_host('durable_host2')['notes'])
+
+    def test_write_keeps_file(self):
+        """ Test that write() keeps owner and hardlinks of the file it replaces """
+        c = self.config
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  host_name write_host\n}\n")
+        self.assertEqual(None, c.write(self.objects_file, "define host {\n  host_name write_host\n}\n"))
+
+        # Hardlinks are kept by rewriting the file in place
+        link = self.tempdir + "/link_to_objects.cfg"
+        os.link(self.objects_file, link)
+        inode = os.stat(self.objects_file).st_ino
+        c.write(self.objects_file, "define host {\n  host_name linked_host\n}\n")
+        self.assertEqual(inode, os.stat(self.objects_file).st_ino)
+        self.assertEqual(open(self.objects_file).read(), open(link).read())
+        os.remove(link)
+
+        # Files in directories we may not create files in are rewritten in place
+        inode = os.stat(self.objects_file).st_ino
+        with mock.patch('tempfile.mkstemp', side_effect=OSError(13, 'Permission denied')):
+            c.write(self.objects_file, "define host {\n  host_name readonly_dir_host\n}\n")
+            self.assertRaises(OSError, c.write, self.objects_file + '.new', "")
+        self.assertEqual(inode, os.stat(self.objects_file).st_ino)
+        self.assertTrue('readonly_dir_host' in open(self.objects_file).read())
+
+        # New files get the mode open() would give them
+        c.write(self.objects_file + '.new', "")
+        self.assertEqual(pynag.Parsers.config_parser.new_file_mode, os.stat(self.objects_file + '.new').st_mode & 0777)
+        os.remove(self.objects_file + '.new')
+
+        if os.geteuid() != 0:
+            return
+        # Owner is kept, if we may not give the new file to them the old one is rewritten
+        os.chown(self.objects_file, 1, 1)
+        c.write(self.objects_file, "define host {\n  host_name owned_host\n}\n")
+        file_stat = os.stat(self.objects_file)
+        self.assertEqual((1, 1), (file_stat.st_uid, file_stat.st_gid))
+        self.assertNotEqual(inode, file_stat.st_ino)
+        inode = file_stat.st_ino
+        with mock.patch('os.fchown', side_effect=OSError(1, 'Operation not permitted')):
+            c.write(self.objects_file, "define host {\n  host_name other_owned_host\n}\n")
+        file_stat = os.stat(self.objects_file)
+        self.assertEqual((1, 1), (file_stat.st_uid, file_stat.st_gid))
+        self.assertEqual(inode, file_stat.st_ino)
+        self.assertTrue('other_owned_host' in open(self.objects_file).read())
+        self.assertEqual([], [i for i in os.listdir(self.environment.objects_dir) if i.endswith('.tmp')])
+
+    def test_commit(self):
+        """ Test that config.commit() writes every file with changed items once """
+        with open(self.objects_file, 'w') as f:
+            for i in range(4):
+                f.write("define host {\n  host_name commit_host%s\n}\n" % i)
+        other_file = self.environment.objects_dir + "/other_objects.cfg"
+        c = self.config
+        c.parse()
+        c.get_host('commit_host0')['alias'] = 'changed'
+        c.get_host('commit_host0')['meta']['needs_commit'] = True
+        c.get_host('commit_host1')['meta']['delete_me'] = True
+        c.get_host('commit_host1')['meta']['needs_commit'] = True
+        c.get_host('commit_host2')['meta']['filename'] = other_file
+        c.get_host('commit_host2')['meta']['needs_commit'] = True
+        with mock.patch.object(c, 'write', wraps=c.write) as write:
+            c.commit()
+            self.assertEqual(sorted([other_file, self.objects_file]), sorted(i[0][0] for i in write.call_args_list))
+        self.assertEqual(None, c.get_host('commit_host0')['meta']['needs_commit'])
+
+        c.parse()
+        self.assertEqual('changed', c.get_host('commit_host0')['alias'])
+        self.assertEqual(None, c.get_host('commit_host1'))
+        self.assertEqual(other_file, c.get_host('commit_host2')['meta']['filename'])
+        self.assertEqual(self.objects_file, c.get_host('commit_host3')['meta']['filename'])
+
+        # Items added or removed since last parse are not lost or brought back by commit
+        new_item = c.get_new_item('host', self.objects_file)
+        new_item['host_name'] = 'commit_host4'
+        c.item_add(new_item, self.objects_file)
+        c.item_remove(c.get_host('commit_host3'))
+        c.get_host('commit_host0')['meta']['needs_commit'] = True
+        c.commit()
+        c.parse()
+        self.assertTrue(c.get_host('commit_host4'))
+        self.assertEqual(None, c.get_host('commit_host3'))
+
+    def test_get_object_index(self):
+        """ Test that config.get_object() and get_service() find objects after edits """
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  host_name index_host\n}\n")
+            f.write("define host {\n  host_name index_host\n  alias duplicate\n}\n")
+            f.write("define service {\n  host_name index_host\n  service_description index_service\n}\n")
+        c = self.config
+        c.parse()
+        host = c.get_host('index_host')
+        self.assertFalse('alias' in host)
+        self.assertTrue(c.get_service('index_host', 'index_service'))
+        self.assertEqual(None, c.get_service('index_host', 'no_such_service'))
+        self.assertEqual(None, c.get_host('no_such_host'))
+        self.assertTrue(c._get_key_index('host', 'host_name') is c._get_key_index('host', 'host_name'))
+
+        # Renaming, the way pynag.Model does it
+        c.item_edit_field(host, 'host_name', 'renamed_host')
+        host['host_name'] = 'renamed_host'
+        self.assertTrue(c.get_host('renamed_host') is host)
+        self.assertEqual('duplicate', c.get_host('index_host')['alias'])
+
+        # Items added to self.data directly
+        new_item = c.get_new_item('host', self.objects_file)
+        new_item['host_name'] = 'new_host'
+        c.data['all_host'].append(new_item)
+        self.assertTrue(c.get_host('new_host') is new_item)
+
+    def test_extended_parse(self):
+        """ Test meta information added by config.extended_parse() """
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  name ext_template\n  register 0\n}\n")
+            f.write("define host {\n  host_name ext_host1\n  hostgroups ext_group2\n}\n")
+            f.write("define host {\n  host_name ext_host2\n}\n")
+            f.write("define hostgroup {\n  hostgroup_name ext_group1\n  members ext_host1,ext_host2\n}\n")
+            f.write("define hostgroup {\n  hostgroup_name ext_group2\n}\n")
+            f.write("define service {\n  hostgroup_name ext_group1\n  host_name !ext_host2\n"
+                    "  service_description ext_service1\n}\n")
+            f.write("define service {\n  host_name ext_host1,ext_host2\n  service_description ext_service2\n}\n")
+        c = self.config
+        c.extended_parse()
+        host1 = c.get_host('ext_host1')
+        host2 = c.get_host('ext_host2')
+        self.assertEqual(['ext_group2', 'ext_group1'], host1['meta']['hostgroup_list'])
+        self.assertEqual(['ext_group1'], host2['meta']['hostgroup_list'])
+        self.assertEqual(['ext_service1', 'ext_service2'], host1['meta']['service_list'])
+        self.assertEqual(['ext_service2'], host2['meta']['service_list'])
+        service1 = c.get_object('service', 'ext_service1', user_key='service_description')
+        self.assertEqual(['ext_host1'], service1['meta']['service_members'])
+
+    def test_extended_parse_incremental(self):
+        """ Test that extended_parse() forgets hostgroups of hosts in files that did not change """
+        groups_file = self.environment.objects_dir + "/ext_groups.cfg"
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  host_name ext_host1\n}\n")
+            f.write("define host {\n  host_name ext_host2\n  register 0\n}\n")
+        with open(groups_file, 'w') as f:
+            f.write("define hostgroup {\n  hostgroup_name g1\n  members ext_host1,ext_host2\n}\n")
+            f.write("define hostgroup {\n  hostgroup_name g2\n}\n")
+            f.write("define service {\n  host_name ext_host1\n  service_description ext_service1\n}\n")
+        c = self.config
+        c.extended_parse()
+        host1 = c.get_host('ext_host1')
+        self.assertEqual(['g1'], host1['meta']['hostgroup_list'])
+        self.assertEqual(['g1'], c.get_host('ext_host2')['meta']['hostgroup_list'])
+        self.assertEqual(['ext_service1'], host1['meta']['service_list'])
+
+        with open(groups_file, 'w') as f:
+            f.write("define hostgroup {\n  hostgroup_name g1\n}\n")
+            f.write("define hostgroup {\n  hostgroup_name g2\n  members ext_host1\n}\n")
+        os.utime(groups_file, (time.time() + 10, time.time() + 10))
+        c.extended_parse()
+        self.assertTrue(host1 is c.get_host('ext_host1'))
+        self.assertEqual(['g2'], host1['meta']['hostgroup_list'])
+        self.assertEqual([], host1['meta']['service_list'])
+        self.assertFalse('hostgroup_list' in c.get_host('ext_host2')['meta'])
+
+        # Same as extended_parse() of everything from scratch
+        fresh_config = pynag.Parsers.config(cfg_file=c.cfg_file)
+        fresh_config.extended_parse()
+        for host_name in ('ext_host1', 'ext_host2'):
+            self.assertEqual(fresh_config.get_host(host_name)['meta'], c.get_host(host_name)['meta'])
+
+    def test_get_impacted_objects(self):
+        """ Test config.get_impacted_objects() """
+        with open(self.objects_file, 'w') as f:
+            f.write("define command {\n  command_name dep_command\n  command_line /bin/true\n}\n")
+            f.write("define host {\n  name dep_template\n  check_command dep_command!1\n  register 0\n}\n")
+            f.write("define host {\n  use dep_template\n  host_name dep_host1\n  hostgroups dep_group1\n}\n")
+            f.write("define host {\n  host_name dep_host2\n  contact_groups dep_contactgroup\n}\n")
+            f.write("define hostgroup {\n  hostgroup_name dep_group1\n  members dep_host2\n}\n")
+            f.write("define hostgroup {\n  hostgroup_name dep_group2\n  hostgroup_members dep_group1\n}\n")
+            f.write("define service {\n  hostgroup_name dep_group2\n  service_description dep_service1\n}\n")
+            f.write("define service {\n  host_name dep_host2\n  service_description dep_service2\n}\n")
+            f.write("define contactgroup {\n  contactgroup_name dep_contactgroup\n  members dep_contact\n}\n")
+            f.write("define contact {\n  contact_name dep_contact\n}\n")
+        c = self.config
+        c.parse()
+
+        def impacted(item, attribute_names=None):
+            result = []
+            for i in c.get_impacted_objects(item, attribute_names):
+                object_type = i['meta']['object_type']
+                result.append(i.get('%s_name' % object_type) or i.get('service_description') or i.get('name'))
+            return sorted(result)
+
+        template = [i for i in c.data['all_host'] if i.get('name') == 'dep_template'][0]
+        self.assertEqual(['dep_group1', 'dep_group2', 'dep_host1', 'dep_service1'], impacted(template))
+        self.assertEqual(['dep_host1', 'dep_template'], impacted(c.get_command('dep_command')))
+        self.assertEqual(['dep_group2', 'dep_host1', 'dep_host2', 'dep_service1'],
+                         impacted(c.get_hostgroup('dep_group1')))
+        self.assertEqual(['dep_host1', 'dep_host2', 'dep_service1'], impacted(c.get_hostgroup('dep_group2')))
+        self.assertEqual(['dep_group1', 'dep_group2', 'dep_service1', 'dep_service2'],
+                         impacted(c.get_host('dep_host2')))
+        self.assertEqual(['dep_contact', 'dep_host2'], impacted(c.get_contactgroup('dep_contactgroup')))
+        self.assertEqual(['dep_contactgroup', 'dep_host2'], impacted(c.get_contact('dep_contact')))
+
+        # Only what depends on the edited attributes
+        self.assertEqual(['dep_service2'], impacted(c.get_host('dep_host2'), ['notes']))
+        self.assertEqual([], impacted(c.get_contact('dep_contact'), ['email']))
+        self.assertEqual(['dep_service1'], impacted(c.get_hostgroup('dep_group2'), ['alias']))
+        # dep_host1 defines its own hostgroups
+        self.assertEqual(['dep_host1'], impacted(template, ['hostgroups', 'notes']))
+        self.assertEqual([], impacted(template, ['host_name']))
+
+        # Edits are taken into account, here the way pynag.Model does it
+        host2 = c.get_host('dep_host2')
+        c.item_edit_field(host2, 'hostgroups', 'dep_group2')
+        host2['hostgroups'] = 'dep_group2'
+        self.assertEqual(['dep_group2', 'dep_service1', 'dep_service2'], impacted(host2, ['hostgroups', 'notes']))
+
+    def test_diff(self):
+        """ Test config.diff() """
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  name diff_template\n  notes old notes\n  register 0\n}\n")
+            f.write("define host {\n  use diff_template\n  host_name diff_host1\n  address 127.0.0.1\n}\n")
+            f.write("define host {\n  host_name diff_host2\n}\n")
+            f.write("define service {\n  host_name diff_host1\n  service_description diff_service\n}\n")
+        old_config = pynag.Parsers.config(cfg_file=self.config.cfg_file)
+        old_config.parse()
+        self.config.parse()
+        self.assertEqual([], list(old_config.diff(self.config)))
+
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  name diff_template\n  notes new notes\n  register 0\n}\n")
+            f.write("define service {\n  host_name diff_host1\n  service_description diff_service\n}\n")
+            f.write("define host {\n  use diff_template\n  host_name diff_host1\n  address 127.0.0.2\n}\n")
+            f.write("define host {\n  host_name diff_host3\n}\n")
+        new_config = pynag.Parsers.config(cfg_file=self.config.cfg_file)
+        new_config.parse()
+        differences = {}
+        for i in old_config.diff(new_config):
+            differences[(i['change'], i['object_type'], i['key'])] = i
+        self.assertEqual(4, len(differences))
+
+        template = differences[('changed', 'host', ('template', 'diff_template'))]
+        self.assertEqual({'notes': ('old notes', 'new notes')}, template['defined_attributes'])
+        host1 = differences[('changed', 'host', 'diff_host1')]
+        self.assertEqual({'address': ('127.0.0.1', '127.0.0.2')}, host1['defined_attributes'])
+        self.assertEqual({'address': ('127.0.0.1', '127.0.0.2'), 'notes': ('old notes', 'new notes')},
+                         host1['effective_attributes'])
+        self.assertEqual(new_config.get_host('diff_host1'), host1['new'])
+        self.assertEqual(None, differences[('removed', 'host', 'diff_host2')]['new'])
+        self.assertEqual(None, differences[('added', 'host', 'diff_host3')]['old'])
+
+    def test_get_cfg_files(self):
+        """ Test config.get_cfg_files() with symlinks and symlink loops in cfg_dir """
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        cfg_dir = os.path.join(tempdir, 'objects')
+        os.makedirs(os.path.join(cfg_dir, 'hosts'))
+        for filename in ('a.cfg', 'hosts/b.cfg', 'readme.txt'):
+            open(os.path.join(cfg_dir, filename), 'w').close()
+        os.symlink('../a.cfg', os.path.join(cfg_dir, 'hosts/link_to_a.cfg'))
+        os.symlink('missing.cfg', os.path.join(cfg_dir, 'broken.cfg'))
+        os.symlink('..', os.path.join(cfg_dir, 'hosts/loop'))
+        main_cfg = os.path.join(tempdir, 'nagios.cfg')
+        with open(main_cfg, 'w') as f:
+            f.write('cfg_dir=objects\n')
+
+        c = pynag.Parsers.config(cfg_file=main_cfg)
+        c.parse_maincfg()
+        cfg_files = c.get_cfg_files()
+        expected = [os.path.join(cfg_dir, 'a.cfg'), os.path.join(cfg_dir, 'hosts/b.cfg')]
+        self.assertEqual(sorted(expected), sorted(cfg_files))
+
+        timestamps = c.get_timestamps()
+        for filename in cfg_files:
+            self.assertEqual(os.stat(filename).st_mtime, timestamps[filename])
+
+    def test_watch(self):
+        """ Test that config.needs_reparse() with watch=True notices changes """
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  host_name watched_host\n}\n")
+        c = pynag.Parsers.config(cfg_file=self.config.cfg_file, watch=True)
+        c.parse()
+        if not isinstance(c._watcher, pynag.Parsers.watcher.InotifyWatcher):
+            self.skipTest("inotify is not available")
+        with mock.patch.object(c, 'get_timestamps') as get_timestamps:
+            self.assertFalse(c.needs_reparse())
+            self.assertEqual(set(), c.get_changed_files())
+            self.assertFalse(get_timestamps.called)
+
+        # Changes made by someone else
+        with open(self.objects_file, 'a') as f:
+            f.write("define host {\n  host_name watched_host2\n}\n")
+        self.assertTrue(c.needs_reparse())
+        self.assertEqual(set([self.objects_file]), c.get_changed_files())
+        c.parse()
+        self.assertFalse(c.needs_reparse())
+        self.assertTrue(c.get_host('watched_host2'))
+
+        # New files and directories in cfg_dir
+        new_file = self.environment.objects_dir + "/watched.cfg"
+        open(new_file, 'w').close()
+        self.assertEqual(set([new_file]), c.get_changed_files())
+        os.mkdir(self.environment.objects_dir + "/watched")
+        self.assertEqual(None, c.get_changed_files())
+        c.parse()
+        self.assertFalse(c.needs_reparse())
+        open(self.environment.objects_dir + "/watched/new.cfg", 'w').close()
+        self.assertTrue(c.needs_reparse())
+
+    def test_watch_parse(self):
+        """ Test that parse() with watch=True only looks at files the watcher saw change """
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  host_name watched_host\n}\n")
+        c = pynag.Parsers.config(cfg_file=self.config.cfg_file, watch=True)
+        c.parse()
+        if not isinstance(c._watcher, pynag.Parsers.watcher.InotifyWatcher):
+            self.skipTest("inotify is not available")
+        with mock.patch.object(c, 'stat', wraps=c.stat) as stat:
+            c.parse()
+            stat_calls = [args[0] for args, kwargs in stat.call_args_list]
+            self.assertFalse(self.objects_file in stat_calls)
+        self.assertTrue(c.get_host('watched_host'))
+
+        # A change made while the previous watcher is replaced is not lost
+        get_watcher = pynag.Parsers.watcher.get_watcher
+
+        def change_and_get_watcher(config):
+            with open(self.objects_file, 'a') as f:
+                f.write("define host {\n  host_name watched_host2\n}\n")
+            return get_watcher(config)
+        with mock.patch('pynag.Parsers.watcher.get_watcher', side_effect=change_and_get_watcher):
+            c.parse()
+        self.assertTrue(c.get_host('watched_host2'))
+        self.assertFalse(c.needs_reparse())
+
+    def test_watch_polling(self):
+        """ Test config.get_changed_files() when inotify is not available """
+        c = self.config
+        c.parse()
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  host_name watched_host\n}\n")
+        self.assertEqual(set([self.objects_file]), c.get_changed_files())
+        with mock.patch('pynag.Parsers.watcher.Inotify', side_effect=OSError):
+            c.watch = True
+            c.parse()
+        self.assertTrue(isinstance(c._watcher, pynag.Parsers.watcher.PollingWatcher))
+        self.assertFalse(c.needs_reparse())
+        os.remove(self.objects_file)
+        self.assertTrue(c.needs_reparse())
+        self.assertEqual(set([self.objects_file]), c.get_changed_files())
+
     def test_parse_string(self):
         """ test config.parse_string()
         """
@@ -167,6 +638,269 @@ class Config(unittest.TestCase):
         self.assertTrue(item['members'] == 'root')
         self.assertFalse('armin.gruner.sms' in item['meta']['raw_definition'])
 
+    def test_parse_reuses_unchanged_files(self):
+        """ Test that parse() only re-reads files that have changed """
+        c = self.config
+        c.parse()
+        host = c.get_host('ok_host')
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  host_name new_host\n  use generic-host\n}\n")
+        c.parse()
+        self.assertTrue(host is c.get_host('ok_host'))
+        self.assertEqual('generic-host', c.get_host('new_host')['use'])
+
+        # Remove the file, and its objects should go away
+        os.remove(self.objects_file)
+        c.parse()
+        self.assertEqual(None, c.get_host('new_host'))
+
+    def test_parse_incremental_template_change(self):
+        """ Test that changes in a template propagate to objects in unchanged files """
+        c = self.config
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  name incremental-template\n  register 0\n  notes old\n}\n")
+        with open(self.environment.objects_dir + "/incremental_hosts.cfg", 'w') as f:
+            f.write("define host {\n  host_name incremental_host\n  use incremental-template\n}\n")
+        c.parse()
+        self.assertEqual('old', c.get_host('incremental_host')['notes'])
+
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  name incremental-template\n  register 0\n  notes new value\n}\n")
+        c.parse()
+        host = c.get_host('incremental_host')
+        self.assertEqual('new value', host['notes'])
+        self.assertEqual({'notes': 'new value'}, host['meta']['inherited_attributes'])
+
+        # Result should be identical to parsing everything from scratch
+        fresh_config = pynag.Parsers.config(cfg_file=c.cfg_file)
+        fresh_config.parse()
+        for key in fresh_config.data:
+            self.assertItemsEqual(fresh_config.data[key], c.data[key])
+        self.assertEqual(len(fresh_config.errors), len(c.errors))
+
+    def test_parse_parallel(self):
+        """ Test that parsing in worker processes gives same result as parsing in a single process """
+        broken_file = os.path.join(tests_dir, 'dataset01/nagios/conf.d/missing.end.of.object.cfg')
+        shutil.copy(broken_file, self.environment.objects_dir)
+        for i in range(5):
+            with open(self.environment.objects_dir + "/hosts%s.cfg" % i, 'w') as f:
+                f.write("define host {\n  host_name parallel_host%s\n  use generic-host\n}\n" % i)
+        serial_config = pynag.Parsers.config(cfg_file=self.config.cfg_file)
+        serial_config.parse()
+        parallel_config = pynag.Parsers.config(cfg_file=self.config.cfg_file, parallel=2)
+        parallel_config.parse()
+
+        self.assertEqual(serial_config.cfg_files, parallel_config.cfg_files)
+        self.assertParsedItemsEqual(serial_config.pre_object_list, parallel_config.pre_object_list)
+        self.assertEqual(map(str, serial_config.errors), map(str, parallel_config.errors))
+        self.assertEqual(1, len(parallel_config.errors))
+        self.assertEqual('generic-host', parallel_config.get_host('parallel_host4')['use'])
+
+        # Subclasses that read files their own way parse them in this process
+        opened_files = []
+
+        class MyConfig(pynag.Parsers.config_parser.Config):
+            def open(self, filename, *args, **kwargs):
+                opened_files.append(filename)
+                return super(MyConfig, self).open(filename, *args, **kwargs)
+        my_config = MyConfig(cfg_file=self.config.cfg_file, parallel=2)
+        with mock.patch('multiprocessing.Pool') as pool:
+            my_config.parse()
+            self.assertFalse(pool.called)
+        self.assertTrue(os.path.join(self.environment.objects_dir, 'hosts4.cfg') in opened_files)
+        self.assertParsedItemsEqual(serial_config.pre_object_list, my_config.pre_object_list)
+
+    def test_parse_with_cache_dir(self):
+        """ Test that parsed files are cached on disk and reused by other Config instances """
+        cache_dir = os.path.join(self.tempdir, 'parse_cache')
+        first_config = pynag.Parsers.config(cfg_file=self.config.cfg_file, cache_dir=cache_dir)
+        first_config.parse()
+        self.assertEqual(len(first_config.cfg_files), len(os.listdir(cache_dir)))
+
+        second_config = pynag.Parsers.config(cfg_file=self.config.cfg_file, cache_dir=cache_dir)
+        with mock.patch.object(second_config, 'parse_string') as parse_string:
+            second_config.parse()
+            self.assertFalse(parse_string.called)
+        self.assertParsedItemsEqual(first_config.pre_object_list, second_config.pre_object_list)
+
+        # Changed files should be parsed again
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  host_name cached_host\n}\n")
+        third_config = pynag.Parsers.config(cfg_file=self.config.cfg_file, cache_dir=cache_dir)
+        third_config.parse()
+        self.assertTrue(third_config.get_host('cached_host'))
+        self.assertEqual(len(third_config.cfg_files), len(os.listdir(cache_dir)))
+
+        # Unicode filenames are cached under the same name as their encoded counterpart
+        filename = u'/etc/nagios/objects/h\xf8sts.cfg'
+        encoded_filename = filename.encode(sys.getfilesystemencoding() or 'utf-8', 'replace')
+        self.assertEqual(third_config._get_parse_cache_filename(encoded_filename),
+                         third_config._get_parse_cache_filename(filename))
+
+    def test_template_resolution(self):
+        """ Test use= with multiple and deeply nested templates """
+        with open(self.objects_file, 'w') as f:
+            f.write("define host {\n  name level0\n  register 0\n  notes from level0\n  notes_url from level0\n}\n")
+            for i in range(1, 2000):
+                f.write("define host {\n  name level%s\n  use level%s\n  register 0\n}\n" % (i, i - 1))
+            f.write("define host {\n  name other\n  register 0\n  notes from other\n  action_url from other\n}\n")
+            f.write("define host {\n  host_name deep_host\n  use other,level1999\n  notes_url own\n}\n")
+        c = self.config
+        c.parse()
+        host = c.get_host('deep_host')
+        self.assertEqual('from other', host['notes'])
+        self.assertEqual('from other', host['action_url'])
+        self.assertEqual('own', host['notes_url'])
+        self.assertEqual(['action_url', 'notes'], sorted(host['meta']['template_fields']))
+        self.assertEqual([], c.errors)
+
+    def test_template_resolution_circular_use(self):
+        """ Test that circular use= are reported """
+        with open(self.objects_file, 'w') as f:
+            f.write("define contact {\n  name template1\n  use template2\n  register 0\n  pager 1\n}\n")
+            f.write("define contact {\n  name template2\n  use template1\n  register 0\n  email a@example.com\n}\n")
+            f.write("define contact {\n  contact_name circular\n  use template1\n}\n")
+        c = self.config
+        c.parse()
+        contact = c.get_object('contact', 'circular')
+        self.assertEqual('1', contact['pager'])
+        self.assertEqual('a@example.com', contact['email'])
+        self.assertEqual(1, len(c.errors))
+        self.assertTrue('template1 -> template2 -> template1' in str(c.errors[0]))
+
+    def test_parse_compact(self):
+        """ Test that compact items look exactly like the items they replace """
+        normal_config = pynag.Parsers.config(cfg_file=self.config.cfg_file)
+        normal_config.parse()
+        compact_config = pynag.Parsers.config(cfg_file=self.config.cfg_file, compact=True)
+        compact_config.parse()
+        self.assertEqual(map(str, normal_config.errors), map(str, compact_config.errors))
+
+        def to_dicts(items):
+            result = []
+            for item in items:
+                item = dict(item)
+                item['meta'] = dict(item['meta'])
+                item['meta']['template_fields'] = sorted(item['meta']['template_fields'])
+                result.append(item)
+            return result
+        self.assertEqual(to_dicts(normal_config.post_object_list), to_dicts(compact_config.post_object_list))
+        self.assertTrue(isinstance(compact_config.get_host('ok_host'), pynag.Parsers.compact.CompactItem))
+
+    def test_compact_item(self):
+        """ Test that compact items can be edited like dicts, and raw definitions are read from disk """
+        with open(self.objects_file, 'w') as f:
+            f.write("# comment\ndefine host {\n  host_name compact_host\n  use generic-host\n  alias a\n}\n")
+        c = pynag.Parsers.config(cfg_file=self.config.cfg_file, compact=True)
+        c.parse()
+        host = c.get_host('compact_host')
+        self.assertEqual("define host {\n    host_name compact_host\n    use generic-host\n    alias a\n}", host['meta']['raw_definition'])
+        self.assertTrue('max_check_attempts' in host['meta']['inherited_attributes'])
+        self.assertTrue('max_check_attempts' in host['meta']['template_fields'])
+        self.assertTrue('max_check_attempts' in host)
+
+        host['alias'] = 'b'
+        del host['use']
+        self.assertEqual('b', host.get('alias'))
+        self.assertFalse('use' in host)
+        self.assertRaises(KeyError, host.__getitem__, 'use')
+        self.assertEqual('a', host['meta']['defined_attributes']['alias'])
+        self.assertEqual('a', host.get_pristine_copy()['alias'])
+
+        # Raw definitions can not be read from a file that has changed
+        c = pynag.Parsers.config(cfg_file=self.config.cfg_file, compact=True)
+        c.parse()
+        with open(self.objects_file, 'a') as f:
+            f.write("# another comment\n")
+        host = c.get_host('compact_host')
+        self.assertRaises(pynag.Parsers.ParserError, host['meta'].__getitem__, 'raw_definition')
+
+    def test_iter_definitions(self):
+        """ Test that config.iter_definitions() yields the same items as parse_file() """
+        c = self.config
+        c.parse_maincfg()
+        expected = []
+        for filename in c.get_cfg_files():
+            expected += c.parse_file(filename)
+        definitions = c.iter_definitions()
+        self.assertFalse(isinstance(definitions, list))
+        self.assertEqual(expected, list(definitions))
+
+        # Definitions of other object types should be skipped
+        hosts = [i for i in expected if i['meta']['object_type'] == 'host']
+        self.assertTrue(hosts)
+        self.assertEqual(hosts, list(c.iter_definitions(object_types=['host'])))
+
+        # Skipping a definition should not confuse line numbers of the next one
+        with open(self.objects_file, 'w') as f:
+            f.write("define command {\n  command_name a\\\n}\ncommand_line b\n}\n")
+            f.write("define host {\n  host_name iter_host\n}\n")
+        result = list(c.iter_definitions(files=[self.objects_file], object_types=['host']))
+        self.assertEqual(1, len(result))
+        self.assertEqual('iter_host', result[0]['host_name'])
+        self.assertEqual(6, result[0]['meta']['line_start'])
+        self.assertEqual(result, c.parse_file(self.objects_file)[1:])
+
+    def test_parse_string_edge_cases(self):
+        """ Test parse_string() with comments, line continuations and broken definitions """
+        c = self.config
+
+        def parse(config_string, object_types=None):
+            c.errors = []
+            items = list(c._iter_string(config_string, 'test.cfg', object_types))
+            for item in items:
+                attributes = dict((k, v) for k, v in item.items() if k != 'meta')
+                self.assertEqual(attributes, item['meta']['defined_attributes'])
+            result = [(dict((k, v) for k, v in item.items() if k != 'meta'),
+                       item['meta']['line_start'], item['meta']['line_end'], item['meta']['raw_definition'])
+                      for item in items]
+            return result, [str(i) for i in c.errors]
+
+        config_string = "define host {\n  host_name h1 ; comment\n  alias\tsome alias  \n\n  # comment\n  register\n} junk\n"
+        expected = [({'host_name': 'h1', 'alias': 'some alias', 'register': ''}, 1, 7,
+                     'define host {\n    host_name h1 ; comment\n    alias\tsome alias\n    register\n} junk')]
+        self.assertEqual((expected, []), parse(config_string))
+        self.assertEqual((expected, []), parse(config_string, ['host', 'timeperiod']))
+
+        config_string = "define service{\r\n description d\r\n host_name a,\\\r\n  b\r\n}\r\n"
+        expected = [({'service_description': 'd', 'host_name': 'a,  b'}, 1, 5,
+                     'define service{\n    description d\n    host_name a,  b\n}')]
+        self.assertEqual((expected, []), parse(config_string))
+        self.assertEqual(([], []), parse(config_string, ['host', 'timeperiod']))
+
+        config_string = "; comment\ndefine timeperiod {\n timeperiod_name t\n monday 00:00-24:00 ; c\n}\n"
+        expected = [({'timeperiod_name': 't', 'monday 00:00-24:00 ; c': ''}, 2, 5,
+                     'define timeperiod {\n    timeperiod_name t\n    monday 00:00-24:00 ; c\n}')]
+        self.assertEqual((expected, []), parse(config_string))
+        self.assertEqual((expected, []), parse(config_string, ['host', 'timeperiod']))
+
+        config_string = "define host {\n  host_name h \\\n}\n}\ndefine command {\n}"
+        expected = [({'host_name': 'h }'}, 1, 4, 'define host {\n    host_name h }\n}'),
+                    ({}, 5, 6, 'define command {\n}')]
+        self.assertEqual((expected, []), parse(config_string))
+        self.assertEqual((expected[:1], []), parse(config_string, ['host', 'timeperiod']))
+
+        # Text outside of a definition swallows the next line
+        config_string = "garbage\ndefine host {\n}\ndefine contact {\n contact_name c\n}\n"
+        self.assertEqual(([], []), parse(config_string))
+        self.assertEqual(([], []), parse(config_string, ['host', 'timeperiod']))
+
+        config_string = "define host {\ndefine host {\n host_name x\n}\n"
+        expected = [({'host_name': 'x'}, 2, 4, 'define host {\n    host_name x\n}')]
+        errors = ["\"Unexpected 'define' in test.cfg on line 2. was expecting '}'. in test.cfg, line 1\""]
+        self.assertEqual((expected, errors), parse(config_string))
+        self.assertEqual((expected, errors), parse(config_string, ['host', 'timeperiod']))
+
+        self.assertRaises(pynag.Parsers.ParserError, parse, "define host {\n host_name x\n")
+        self.assertRaises(pynag.Parsers.ParserError, parse, "}\n")
+
+        # Skipping object types gives the same items as leaving them out afterwards
+        for filename in glob.glob(os.path.join(tests_dir, 'dataset01/nagios/conf.d/*.cfg')):
+            config_string = open(filename).read()
+            items = list(c._iter_string(config_string, filename))
+            expected = [i for i in items if i['meta']['object_type'] in ('host', 'timeperiod')]
+            self.assertEqual(expected, list(c._iter_string(config_string, filename, ['host', 'timeperiod'])))
+
     def test_missing_end_of_object(self):
         """ Test parsing of a config with missing '}'
         """
@@ -477,6 +1211,45 @@ class ObjectCache(unittest.TestCase):
         o.parse()
         self.assertTrue(len(o.data.keys()) > 0, 'Object cache seems to be empty')
 
+    def test_parse_object_cache_missing(self):
+        """ Test that pynag.Parsers.object_cache fails when nagios.cfg has no object_cache_file """
+        environment = pynag.Utils.misc.FakeNagiosEnvironment()
+        environment.create_minimal_environment()
+        self.addCleanup(environment.terminate)
+        environment.config._edit_static_file(attribute='object_cache_file', new_value=None)
+        o = pynag.Parsers.object_cache(cfg_file=environment.cfg_file)
+        self.assertRaises(pynag.Parsers.ParserError, o.parse)
+
+    def test_parse_object_cache(self):
+        """ Test loading objects.cache with pynag.Parsers.object_cache """
+        environment = pynag.Utils.misc.FakeNagiosEnvironment()
+        environment.create_minimal_environment()
+        self.addCleanup(environment.terminate)
+        object_cache_file = environment.config.get_cfg_value('object_cache_file')
+        with open(object_cache_file, 'w') as f:
+            f.write(object_cache)
+
+        o = pynag.Parsers.object_cache(cfg_file=environment.cfg_file)
+        o.parse()
+        self.assertEqual([], o.errors)
+        self.assertEqual(['all_host', 'all_service', 'all_timeperiod'], sorted(o.data.keys()))
+        host = o.get_host('localhost')
+        self.assertEqual('127.0.0.1', host['address'])
+        self.assertEqual('', host['notes'])
+        self.assertEqual('host', host['meta']['object_type'])
+        self.assertEqual(object_cache_file, host['meta']['filename'])
+        self.assertEqual('check_ping!100.0,20%!500.0,60%', o.get_service('localhost', 'PING')['check_command'])
+        self.assertTrue('monday\t00:00-09:00,17:00-24:00' in o.get_object('timeperiod', 'nonworkhours'))
+
+        # Same attributes as the full parser finds
+        expected = o.parse_string(object_cache)
+        for item in expected + o.post_object_list:
+            del item['meta']
+        self.assertEqual(expected, o.post_object_list)
+
+        self.assertRaises(pynag.Parsers.ParserError, o.item_edit_field, host, 'address', '127.0.0.2')
+        self.assertRaises(pynag.Parsers.ParserError, o.item_add, host, object_cache_file)
+
 
 class LogFiles(unittest.TestCase):
 
@@ -641,6 +1414,39 @@ class MainConfigTest(unittest.TestCase):
         result = self.main_config._parse_string('# this is a comment')
         self.assertEqual([], result)
 
+object_cache = """########################################
+#       NAGIOS OBJECT CACHE FILE
+#
+# THIS FILE IS AUTOMATICALLY GENERATED
+# BY NAGIOS.  DO NOT MODIFY THIS FILE!
+#
+# Created: Tue Oct 13 09:12:44 2026
+########################################
+
+define timeperiod {
+	timeperiod_name	nonworkhours
+	alias	Non-Work Hours
+	monday	00:00-09:00,17:00-24:00
+	}
+
+define host {
+	host_name	localhost
+	alias	localhost
+	address	127.0.0.1
+	notes	
+	check_period	24x7
+	max_check_attempts	10
+	}
+
+define service {
+	host_name	localhost
+	service_description	PING
+	check_command	check_ping!100.0,20%!500.0,60%
+	max_check_attempts	4
+	}
+
+"""
+
 minimal_config = r"""
 define timeperiod {
   alias                          24 Hours A Day, 7 Days A Week
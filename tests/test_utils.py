@@ -140,6 +140,71 @@ class testUtils(unittest.TestCase):
         self.assertEqual(1, len(result))
         self.assertEqual('XYZ', result[0].name)
 
+    def test_grep_query(self):
+        """ Test that pynag.Utils.GrepQuery finds the same objects as searching one argument at a time """
+        objects = [
+            {'host_name': 'host1', 'hostgroups': '+group1, group2', 'register': '1', 'notes': ''},
+            {'host_name': 'host2', 'hostgroups': 'group2', 'address': '127.0.0.1'},
+            {'host_name': 'host3', 'hostgroups': ['group1', 'group3'], 'register': '0'},
+            {'host_name': None, 'name': 'template', 'register': 0},
+            {'host_name': ['host1', 'host2'], 'notes': 'null'},
+        ]
+        searches = [
+            {'host_name': 'host1'},
+            {'host_name': ['host1', 'host2']},
+            {'host_name': None},
+            {'host_name': 'None', 'register': '1'},
+            {'register': 1},
+            {'register': '0'},
+            {'hostgroups__has_field': 'group1'},
+            {'hostgroups__has_field': ['group1', 'group2']},
+            {'notes__has_field': 'null'},
+            {'host_name__contains': 'host', 'address__exists': False},
+            {'host_name__notcontains': '1', 'host_name__startswith': 'host'},
+            {'host_name__endswith': '3', 'hostgroups__notendswith': '2'},
+            {'host_name__notstartswith': 'h', 'name__isnot': None},
+            {'host_name__regex': '^host[12]$', 'hostgroups__regex': 'group2'},
+            {'host_name__in': ['host1', 'host3', 'None']},
+            {'host_name__notin': ['host1', 'host3']},
+            {'search': 'template'},
+            {'q': '127.0.0', 'address__exists': 'True'},
+        ]
+        for search in searches:
+            expected = pynag.Utils._grep_sequential(objects, search)
+            self.assertEqual(expected, pynag.Utils.grep(objects, **search), search)
+            self.assertEqual(list(expected), list(pynag.Utils.grep(tuple(objects), **search)), search)
+            self.assertEqual(expected, pynag.Utils.GrepQuery(**search).filter(iter(objects)), search)
+
+        # Compiled queries are reused, unless they have arguments that are not plain values
+        query = pynag.Utils.GrepQuery.get({'host_name__in': ['host1']})
+        self.assertTrue(query is pynag.Utils.GrepQuery.get({'host_name__in': ['host1']}))
+        self.assertFalse(query is pynag.Utils.GrepQuery.get({'host_name__in': ['host2']}))
+        self.assertFalse(query is pynag.Utils.GrepQuery.get({'host_name__in': set(['host1'])}))
+
+        # Conditions are tested in order of how cheap and selective they are
+        query = pynag.Utils.GrepQuery(search='host', host_name__regex='host', host_name='host1')
+        self.assertEqual(['exact', 'regex', 'search'], [i[0] for i in query.conditions])
+
+        # Values that are not strings are compared as strings
+        objects = [{'host_name': 'host1', 'port': 5}, {'host_name': 'host2', 'port': 6, 'state': 0}]
+        searches = [
+            {'port': 5},
+            {'port': '6', 'state': 0},
+            {'port__in': ['5', '6']},
+            {'port__isnot': 5, 'state__exists': True},
+            {'port__regex': '^[56]$', 'host_name__endswith': 2},
+        ]
+        for search in searches:
+            expected = pynag.Utils._grep_sequential(objects, search)
+            self.assertEqual(expected, pynag.Utils.grep(objects, **search), search)
+
+        # __has_field raises on int values, unless a cheaper condition rules the object out first
+        search = {'port__has_field': '6'}
+        self.assertRaises(TypeError, pynag.Utils._grep_sequential, objects, search)
+        self.assertRaises(TypeError, pynag.Utils.grep, objects, **search)
+        search = {'port__has_field': '6', 'host_name': 'host3'}
+        self.assertEqual([], pynag.Utils.GrepQuery(**search).filter(objects))
+
     def _compare_search_expressions(self, **expression):
         # print "Testing search expression %s" % expression
         all_services = pynag.Model.Service.objects.all
@@ -331,6 +396,49 @@ class testUtils(unittest.TestCase):
         except PynagError:
             pass
 
+    def test_instrumentation(self):
+        """ Test pynag.Utils.instrumentation counts calls, objects and bytes """
+        from pynag.Utils import instrumentation
+        objects = [{'host_name': 'host1'}, {'host_name': 'host2'}]
+
+        # Nothing is counted unless enabled, or inside recording()
+        instrumentation.reset()
+        utils.grep(objects, host_name='host1')
+        self.assertEqual({}, instrumentation.get_stats())
+
+        with instrumentation.recording() as stats:
+            utils.grep(objects, host_name='host1')
+            utils.grep(objects, host_name__contains='host')
+            with instrumentation.recording() as inner_stats:
+                pynag.Model.config.parse_file(pynag.Model.config.cfg_file)
+        self.assertEqual(2, stats['Utils.grep']['calls'])
+        self.assertEqual(3, stats['Utils.grep']['objects'])
+        self.assertEqual(0, stats['Utils.grep']['bytes'])
+        self.assertTrue(stats['Utils.grep']['seconds'] >= 0)
+        self.assertEqual(inner_stats['Config.parse_file'], stats['Config.parse_file'])
+        self.assertEqual(1, inner_stats['Config.parse_file']['calls'])
+        size = os.path.getsize(pynag.Model.config.cfg_file)
+        self.assertEqual(size, inner_stats['Config.parse_file']['bytes'])
+        self.assertEqual({}, instrumentation.get_stats())
+
+        report = instrumentation.report(stats).splitlines()
+        self.assertEqual(['name', 'calls', 'seconds', 'objects', 'bytes'], report[0].split())
+        rows = sorted(line.split()[:2] for line in report[1:])
+        self.assertEqual([['Config.parse_file', '1'], ['Utils.grep', '2']], rows)
+
+        instrumentation.enable()
+        try:
+            pynag.Model.ObjectFetcher._cached_objects = []
+            pynag.Model.Host.objects.get_all()
+        finally:
+            instrumentation.disable()
+        stats = instrumentation.get_stats()
+        instrumentation.reset()
+        self.assertEqual(1, stats['ObjectFetcher.reload_cache']['calls'])
+        self.assertEqual(len(pynag.Model.ObjectDefinition.objects.all), stats['ObjectFetcher.reload_cache']['objects'])
+        self.assertEqual(1, stats['ObjectRelations.resolve_hostgroups']['calls'])
+        self.assertEqual({}, instrumentation.get_stats())
+
     def test_send_nsca(self):
         """ test pynag.Utils.send_nsca
 